@@ -68,7 +68,7 @@ from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
 from wtforms import StringField, PasswordField, TextAreaField, DecimalField, IntegerField, SelectField, FileField
 from wtforms.validators import DataRequired, Email, Length, NumberRange
-from models_b4a import db, User, Category, Product, Order, OrderItem, CartItem, Wishlist, ProductView, PasswordResetToken
+from models_b4a import db, gather, prefetch, GuardError, User, Category, Product, Order, OrderItem, CartItem, Wishlist, PasswordResetToken
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
@@ -79,6 +79,10 @@ from flask_mail import Mail, Message
 import stripe
 from decimal import Decimal
 from imgbb_uploader import ImgBBUploader
+import product_search
+import seller_stats
+from view_buffer import view_buffer
+from back4app_client import Back4AppUnavailable
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
@@ -103,10 +107,30 @@ app.config['STRIPE_PUBLISHABLE_KEY'] = os.environ.get('STRIPE_PUBLISHABLE_KEY')
 mail = Mail(app)
 db.init_app(app)
 tax_rate = Decimal("0.08")
+shipping_threshold = Decimal("50.00")
+shipping_cost = Decimal("5.99")
+
+def cart_totals(cart_items):
+    """Returns (subtotal, shipping, tax, total) as Decimals for the given cart items."""
+    subtotal = sum((item.product.price * item.quantity for item in cart_items), Decimal("0.00"))
+    shipping = Decimal("0.00") if subtotal >= shipping_threshold else shipping_cost
+    tax = subtotal * tax_rate
+    return subtotal, shipping, tax, subtotal + shipping + tax
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+@app.errorhandler(Back4AppUnavailable)
+def back4app_unavailable(e):
+    # The circuit breaker is open: answer at once instead of tying up the worker
+    retry_after = {'Retry-After': str(int(e.retry_after) + 1)}
+    if request.path.startswith('/api/'):
+        return jsonify({
+            'success': False,
+            'message': 'The store is temporarily unavailable. Please try again shortly.'
+        }), 503, retry_after
+    return 'The store is temporarily unavailable. Please try again shortly.', 503, retry_after
+
 # Forms
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -202,7 +226,7 @@ def login():
                     ).first()
                     
                     if existing_item:
-                        existing_item.quantity += item.quantity
+                        existing_item.increment('quantity', item.quantity)
                     else:
                         item.session_id = f"user_{user.id}"
                     
@@ -640,7 +664,10 @@ def reset_password():
 @app.route('/')
 def home():
     # Get featured products (latest 8 active products)
-    featured_products = Product.query.filter_by(status='active').order_by(Product.created_at.desc()).limit(8).all()
+    featured_products = (
+        Product.query.filter_by(status='active').order_by(Product.created_at.desc())
+        .only(*Product.list_fields).limit(8).cached().all()
+    )
     categories = Category.query.all()
     return render_template('home.html', featured_products=featured_products, categories=categories)
 
@@ -655,7 +682,6 @@ from decimal import Decimal # Ensure this import is present at the top of the fi
 
 @app.route('/shop')
 def shop():
-    page = request.args.get('page', 1, type=int)
     category_id = request.args.get('category', type=str)
     search = request.args.get('search', '')
     sort_by = request.args.get('sort_by', 'newest')  # Default sort is 'newest'
@@ -677,14 +703,15 @@ def shop():
         # Log or ignore bad input, setting to None effectively disables filter
         pass 
 
-    query = Product.query.filter_by(status='active')  # Only show active products
+    # Only show active products; pages are shared between workers via query_cache
+    query = Product.query.filter_by(status='active').only(*Product.list_fields).prefetch('category').cached()
     
     if category_id:
         query = query.filter_by(category_id=category_id)
     
     if search:
-        # Use ilike for case-insensitive search
-        query = query.filter(Product.name.ilike(f'%{search}%'))
+        # Indexed lookup on the search_terms array (see product_search.py)
+        query = query.filter(product_search.search_criterion(search))
         
     # ✅ Apply Price Range Filters
     if min_price is not None:
@@ -706,19 +733,24 @@ def shop():
     # Default to 9 items per page for better mobile experience
     per_page = 9
     
-    products = query.paginate(
-        page=page, per_page=per_page, error_out=False
+    # Keyset pagination: one bounded query per page however deep, and the
+    # "Showing N of M" total comes from a cached count
+    user_id = session.get('user_id')
+    products, wishlist_items, categories = gather(
+        lambda: query.keyset_paginate(
+            after=request.args.get('after'), before=request.args.get('before'),
+            per_page=per_page, approximate_count=True
+        ),
+        # Get user's wishlist items if logged in
+        lambda: Wishlist.query.filter_by(user_id=user_id).only('product_id').all() if user_id else [],
+        lambda: Category.query.all()
     )
+    if search and sort_by == 'newest':
+        # No explicit sort chosen: best matches first within the page
+        products.items = product_search.rank(products.items, search)
     
-    # Get user's wishlist items if logged in
-    user_wishlist = []
-    if 'user_id' in session:
-        user_wishlist = [
-            item.product_id for item in 
-            Wishlist.query.filter_by(user_id=session['user_id']).all()
-        ]
+    user_wishlist = [item.product_id for item in wishlist_items]
     
-    categories = Category.query.all()
     return render_template('shop.html', 
                           products=products, 
                           categories=categories, 
@@ -731,7 +763,14 @@ def shop():
 
 @app.route('/product/<product_id>')
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
+    user_id = session.get('user_id')
+    
+    # Load the product, the viewer and their wishlist entry concurrently
+    product, user, wishlist_item = gather(
+        lambda: Product.query.get_or_404(product_id),
+        lambda: User.query.get(user_id) if user_id else None,
+        lambda: Wishlist.query.filter_by(user_id=user_id, product_id=product_id).first() if user_id else None
+    )
     
     # Check if product is inactive and user is not the seller
     if product.status == 'inactive':
@@ -739,15 +778,17 @@ def product_detail(product_id):
             flash('This product is no longer available.', 'warning')
             return redirect(url_for('shop'))
     
-    related_products = Product.query.filter(
-        Product.category_id == product.category_id,
-        Product.id != product.id,
-        Product.status == 'active'  # Only show active related products
-    ).limit(4).all()
+    related_products, _ = gather(
+        lambda: Product.query.filter(
+            Product.category_id == product.category_id,
+            Product.id != product.id,
+            Product.status == 'active'  # Only show active related products
+        ).limit(4).all(),
+        lambda: product.seller  # Shown on the page; loaded into the identity map here
+    )
     
     # Track the full detail view (only for buyers, not sellers of their own products)
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
         # Only track if user is a buyer or if seller is viewing someone else's product
         if user.role == 'buyer' or (user.role == 'seller' and product.seller_id != user.id):
             track_product_view(product_id, 'full_detail')
@@ -755,17 +796,11 @@ def product_detail(product_id):
         # Track for guest users
         track_product_view(product_id, 'full_detail')
     
-    # Get view count for this product
-    view_count = ProductView.query.filter_by(product_id=product_id).count()
+    # Get view count for this product (counter maintained by view_buffer)
+    view_count = product.view_count or 0
     
     # Check if product is in user's wishlist
-    is_in_wishlist = False
-    if 'user_id' in session:
-        wishlist_item = Wishlist.query.filter_by(
-            user_id=session['user_id'],
-            product_id=product_id
-        ).first()
-        is_in_wishlist = wishlist_item is not None
+    is_in_wishlist = wishlist_item is not None
     
     # Check if current user is the seller (to prevent buying own products)
     is_own_product = False
@@ -784,18 +819,13 @@ def product_detail(product_id):
 @app.route("/cart")
 def cart():
     session_id = get_session_id()
-    cart_items = CartItem.query.filter_by(session_id=session_id).all()
+    cart_items = CartItem.query.filter_by(session_id=session_id).prefetch(
+        'product.category', 'product.seller'
+    ).all()
     
     # Calculate totals for items that are NOT saved for later
     active_items = [item for item in cart_items if not item.save_for_later]
-    total = sum(item.product.price * item.quantity for item in active_items)
-    tax_rate = Decimal("0.08")
-    shipping_threshold = Decimal("50.00")
-    shipping_cost = Decimal("5.99")
-    
-    tax = total * tax_rate
-    shipping = Decimal("0.00") if total >= shipping_threshold else shipping_cost
-    grand_total = total + tax + shipping
+    total, shipping, tax, grand_total = cart_totals(active_items)
     remaining_for_free_shipping = (
         shipping_threshold - total if total < shipping_threshold else Decimal("0.00")
     )
@@ -835,7 +865,7 @@ def add_to_cart(product_id):
     ).first()
     
     if cart_item:
-        cart_item.quantity += quantity
+        cart_item.increment('quantity', quantity)
     else:
         cart_item = CartItem(
             session_id=session_id,
@@ -874,12 +904,12 @@ def remove_from_cart(item_id):
 @app.route('/api/cart-items')
 def api_cart_items():
     session_id = get_session_id()
-    cart_items = CartItem.query.filter_by(session_id=session_id).all()
+    cart_items = CartItem.query.filter_by(session_id=session_id).prefetch('product').all()
     
     items = []
     total = 0
     for item in cart_items:
-        item_total = float(item.product.price) * item.quantity
+        item_total = float(item.product.price * item.quantity)
         total += item_total
         items.append({
             'id': item.id,
@@ -899,6 +929,20 @@ def api_cart_items():
         'tax': total * 0.08
     })
 
+@app.route('/api/search/suggest')
+def api_search_suggest():
+    """Search-as-you-type suggestions from the in-memory trie (no Back4App call once loaded)"""
+    q = request.args.get('q', '')[:100]
+    limit = min(request.args.get('limit', 8, type=int), 20)
+    try:
+        product_search.suggestions.ensure_loaded()
+    except Exception:
+        return jsonify({'suggestions': [], 'version': None}), 503
+    return jsonify({
+        'suggestions': product_search.suggestions.suggest(q, limit=limit),
+        'version': product_search.suggestions.version
+    })
+
 @app.route('/api/cart-count')
 def api_cart_count():
     return jsonify({'count': get_cart_count()})
@@ -1094,6 +1138,7 @@ def api_toggle_product_status(product_id):
         # Update product status
         product.status = new_status
         db.session.commit()
+        product_search.suggestions.update_product(product)
         
         return jsonify({
             'success': True,
@@ -1140,6 +1185,7 @@ def add_to_wishlist(product_id):
         )
         db.session.add(wishlist_item)
         db.session.commit()
+        seller_stats.record_wishlist_change(product.seller_id, 1)
         
         return jsonify({
             'success': True,
@@ -1166,6 +1212,10 @@ def remove_from_wishlist(product_id):
         db.session.delete(wishlist_item)
         db.session.commit()
         
+        product = Product.query.get(product_id)
+        if product:
+            seller_stats.record_wishlist_change(product.seller_id, -1)
+        
         return jsonify({
             'success': True,
             'message': 'Removed from wishlist!'
@@ -1196,8 +1246,8 @@ def product_quick_view(product_id):
         # Track for guest users
         track_product_view(product_id, 'quick_view')
     
-    # Get view count for this product
-    view_count = ProductView.query.filter_by(product_id=product_id).count()
+    # Get view count for this product (counter maintained by view_buffer)
+    view_count = product.view_count or 0
     
     return render_template('partials/quick_view.html', product=product, view_count=view_count)
 
@@ -1237,8 +1287,9 @@ def track_product_view(product_id, view_type):
         ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR'))
         user_agent = request.headers.get('User-Agent', '')
         
-        # Create view record
-        view = ProductView(
+        # Queue the view record; view_buffer writes it and the seller's view
+        # count in bulk from a background thread
+        view_buffer.add(
             user_id=user_id,
             product_id=product_id,
             view_type=view_type,
@@ -1246,9 +1297,6 @@ def track_product_view(product_id, view_type):
             user_agent=user_agent[:500]  # Truncate to fit column
         )
         
-        db.session.add(view)
-        db.session.commit()
-        
     except Exception as e:
         print(f"Error tracking view: {e}")
         # Don't fail the main request if view tracking fails
@@ -1262,57 +1310,29 @@ def seller_dashboard():
     
     user_id = session['user_id']
 
-    # Get seller statistics
-    total_products = Product.query.filter_by(seller_id=user_id).count()
-
-    # Get all seller's products
-    seller_products = Product.query.filter_by(seller_id=user_id).all()
-    seller_product_ids = [p.id for p in seller_products]
-    
-    # Calculate total orders by checking order items
-    all_order_items = OrderItem.query.all()
-    seller_order_ids = set()
-    total_revenue = 0
-    
-    for item in all_order_items:
-        if item.product_id in seller_product_ids:
-            seller_order_ids.add(item.order_id)
-            total_revenue += float(item.price) * int(item.quantity)
-    
-    total_orders = len(seller_order_ids)
+    # Get seller statistics (pre-aggregated, see seller_stats.py) and recent
+    # products concurrently
+    stats, total_products, recent_products = gather(
+        lambda: seller_stats.get_seller_stats(user_id),
+        lambda: Product.query.filter_by(seller_id=user_id).count(),
+        lambda: (
+            Product.query.filter_by(seller_id=user_id)
+            .order_by(Product.created_at.desc())
+            .only(*Product.list_fields)
+            .limit(5)
+            .prefetch('category')
+            .all()
+        )
+    )
+    total_orders = stats.total_orders or 0
+    total_revenue = stats.total_revenue or 0
 
     # Calculate daily order performance (today vs yesterday)
-    today = datetime.now().date()
+    today = datetime.utcnow().date()
     yesterday = today - timedelta(days=1)
-    
-    # Get all orders
-    all_orders = Order.query.all()
-    orders_today = 0
-    orders_yesterday = 0
-    unique_customers = set()
-    
-    for order in all_orders:
-        # Check if this order contains seller's products
-        order_items = OrderItem.query.filter_by(order_id=order.id).all()
-        has_seller_product = any(item.product_id in seller_product_ids for item in order_items)
-        
-        if has_seller_product:
-            unique_customers.add(order.user_id)
-            
-            # Parse created_at date
-            if hasattr(order, 'created_at') and order.created_at:
-                try:
-                    if isinstance(order.created_at, str):
-                        order_date = datetime.fromisoformat(order.created_at.replace('Z', '+00:00')).date()
-                    else:
-                        order_date = order.created_at.date()
-                    
-                    if order_date == today:
-                        orders_today += 1
-                    elif order_date == yesterday:
-                        orders_yesterday += 1
-                except:
-                    pass
+    daily_orders = stats.daily_orders or {}
+    orders_today = daily_orders.get(today.strftime('%Y-%m-%d'), 0)
+    orders_yesterday = daily_orders.get(yesterday.strftime('%Y-%m-%d'), 0)
     
     # Calculate percentage change
     if orders_yesterday > 0:
@@ -1324,18 +1344,11 @@ def seller_dashboard():
     daily_change_percent = abs(daily_change_percent)
 
     # Count new customers (unique customers who bought seller's products)
-    new_customers_count = len(unique_customers)
+    new_customers_count = stats.total_customers or 0
 
     # Calculate average rating based on wishlist counts
-    all_wishlists = Wishlist.query.all()
-    wishlist_counts = {}
-    
-    for wishlist in all_wishlists:
-        if wishlist.product_id in seller_product_ids:
-            wishlist_counts[wishlist.product_id] = wishlist_counts.get(wishlist.product_id, 0) + 1
-    
-    if wishlist_counts:
-        avg_wishlist_per_product = sum(wishlist_counts.values()) / len(seller_product_ids) if seller_product_ids else 0
+    if stats.total_wishlists:
+        avg_wishlist_per_product = stats.total_wishlists / total_products if total_products else 0
         # Convert to 1-5 scale (assuming 10+ wishlists = 5 stars)
         average_rating = min(5.0, max(1.0, (avg_wishlist_per_product / 2) + 1))
         average_rating = f"{average_rating:.1f}"
@@ -1343,25 +1356,7 @@ def seller_dashboard():
         average_rating = "0.0"
 
     # Calculate total views for seller's products
-    all_views = ProductView.query.all()
-    total_views = sum(1 for view in all_views if view.product_id in seller_product_ids)
-
-    # Recent products
-    recent_products = (
-        Product.query.filter_by(seller_id=user_id)
-        .order_by(Product.created_at.desc())
-        .limit(5)
-        .all()
-    )
-
-    # Recent orders for this seller
-    recent_orders = []
-    for order in sorted(all_orders, key=lambda x: x.created_at if hasattr(x, 'created_at') else '', reverse=True)[:50]:
-        order_items = OrderItem.query.filter_by(order_id=order.id).all()
-        if any(item.product_id in seller_product_ids for item in order_items):
-            recent_orders.append(order)
-            if len(recent_orders) >= 10:
-                break
+    total_views = stats.total_views or 0
 
     return render_template(
         'seller/dashboard.html',
@@ -1369,7 +1364,6 @@ def seller_dashboard():
         total_orders=total_orders,
         total_revenue=total_revenue,
         recent_products=recent_products,
-        recent_orders=recent_orders,
         average_rating=average_rating,
         daily_change_percent=daily_change_percent,
         daily_change_direction=daily_change_direction,
@@ -1399,13 +1393,15 @@ def duplicate_product(product_id):
         seller_id=original_product.seller_id, # Inherits the seller ID
         image_url=original_product.image_url,
         additional_images=original_product.additional_images.copy() if original_product.additional_images else None,
-        status=original_product.status if hasattr(original_product, 'status') and original_product.status else 'active',
-        created_at=datetime.utcnow() # Set a new creation date
+        status=original_product.status if hasattr(original_product, 'status') and original_product.status else 'active'
+        # Parse stamps the copy with a new createdAt
     )
     
     # 3. Save the new product to the database
+    product_search.index_product(new_product)
     db.session.add(new_product)
     db.session.commit()
+    product_search.suggestions.update_product(new_product)
     
     flash(f'Product "{original_product.name}" duplicated successfully. You are now editing the copy.', 'success')
     
@@ -1416,10 +1412,9 @@ def duplicate_product(product_id):
 @seller_required
 def seller_products():
     user_id = session['user_id']
-    page = request.args.get('page', 1, type=int)
     
-    products = Product.query.filter_by(seller_id=user_id).paginate(
-        page=page, per_page=10, error_out=False
+    products = Product.query.filter_by(seller_id=user_id).only(*Product.list_fields).prefetch('category').keyset_paginate(
+        after=request.args.get('after'), before=request.args.get('before'), per_page=10
     )
     
     return render_template('seller/products.html', products=products)
@@ -1440,6 +1435,7 @@ def delete_product(product_id):
     # 2. Delete the product
     db.session.delete(product)
     db.session.commit()
+    product_search.suggestions.remove_product(product.id)
     
     flash(f'Product "{product_name}" deleted successfully.', 'info')
     
@@ -1493,9 +1489,11 @@ def add_product():
                 additional_images=additional_images if additional_images else None,
                 status='active'  # Set default status to active
             )
+            product_search.index_product(product)
             
             db.session.add(product)
             db.session.commit()
+            product_search.suggestions.update_product(product)
             
             flash('Product added successfully with images hosted on ImgBB!', 'success')
         except Exception as e:
@@ -1557,7 +1555,9 @@ def edit_product(product_id):
         # Limit to 4 additional images
         product.additional_images = current_additional_images[:4] if current_additional_images else None
         
+        product_search.index_product(product)
         db.session.commit()
+        product_search.suggestions.update_product(product)
         
         flash('Product updated successfully!', 'success')
         return redirect(url_for('seller_products'))
@@ -1577,7 +1577,9 @@ def edit_product(product_id):
 @login_required
 def order_history():
     user_id = session['user_id']
-    orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).prefetch(
+        'order_items.product'
+    ).all()
     return render_template('order_history.html', orders=orders)
 
 @app.route('/seller/order-history')
@@ -1590,14 +1592,16 @@ def seller_order_history():
         return redirect(url_for('home'))
     
     # Get orders where the seller is the buyer (not their own products)
-    orders = Order.query.filter_by(user_id=user.id).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter_by(user_id=user.id).order_by(Order.created_at.desc()).prefetch(
+        'order_items.product.seller'
+    ).all()
     return render_template('seller_order_history.html', orders=orders)
 
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
     session_id = get_session_id()
-    cart_items = CartItem.query.filter_by(session_id=session_id).all()
+    cart_items = CartItem.query.filter_by(session_id=session_id).prefetch('product').all()
     
     # Only include items that are NOT saved for later
     active_cart_items = [item for item in cart_items if not item.save_for_later]
@@ -1606,14 +1610,7 @@ def checkout():
         flash('No items selected for checkout. Please select items to purchase.', 'warning')
         return redirect(url_for('cart'))
     
-    subtotal = sum(item.product.price * item.quantity for item in active_cart_items)
-    shipping_threshold = Decimal("50.00")
-    shipping_cost = Decimal("5.99")
-    tax_rate = Decimal("0.08")
-    
-    shipping = Decimal("0.00") if subtotal >= shipping_threshold else shipping_cost
-    tax = subtotal * tax_rate
-    total = subtotal + shipping + tax
+    subtotal, shipping, tax, total = cart_totals(active_cart_items)
     
     return render_template('checkout.html', 
                          cart_items=active_cart_items,
@@ -1629,7 +1626,7 @@ def checkout():
 def create_payment_intent():
     try:
         session_id = get_session_id()
-        cart_items = CartItem.query.filter_by(session_id=session_id).all()
+        cart_items = CartItem.query.filter_by(session_id=session_id).prefetch('product').all()
         
         # Only include items that are NOT saved for later
         active_cart_items = [item for item in cart_items if not item.save_for_later]
@@ -1638,14 +1635,7 @@ def create_payment_intent():
             return jsonify({'error': 'No items selected for purchase'}), 400
         
         # Calculate total for active items only
-        subtotal = sum(item.product.price * item.quantity for item in active_cart_items)
-        shipping_threshold = Decimal("50.00")
-        shipping_cost = Decimal("5.99")
-        tax_rate = Decimal("0.08")
-        
-        shipping = Decimal("0.00") if subtotal >= shipping_threshold else shipping_cost
-        tax = subtotal * tax_rate
-        total = subtotal + shipping + tax
+        subtotal, shipping, tax, total = cart_totals(active_cart_items)
         
         # Convert to cents for Stripe (ensure it's an integer)
         amount_in_cents = int(total * 100)
@@ -1701,7 +1691,7 @@ def process_stripe_payment():
             return jsonify({'success': False, 'error': 'Payment not completed'}), 400
         
         session_id = get_session_id()
-        cart_items = CartItem.query.filter_by(session_id=session_id).all()
+        cart_items = CartItem.query.filter_by(session_id=session_id).prefetch('product').all()
         
         # Only include items that are NOT saved for later
         active_cart_items = [item for item in cart_items if not item.save_for_later]
@@ -1710,14 +1700,21 @@ def process_stripe_payment():
             return jsonify({'success': False, 'error': 'No items selected for purchase'}), 400
         
         # Calculate totals for active items only
-        subtotal = sum(item.product.price * item.quantity for item in active_cart_items)
-        shipping_threshold = Decimal("50.00")
-        shipping_cost = Decimal("5.99")
-        tax_rate = Decimal("0.08")
+        subtotal, shipping, tax, total = cart_totals(active_cart_items)
+        
+        # Reserve stock with atomic decrements before creating the order. The
+        # minimum guard reverts every decrement if a concurrent buyer got there first.
+        for cart_item in active_cart_items:
+            if cart_item.product.stock_quantity < cart_item.quantity:
+                db.session.rollback()
+                return jsonify({'success': False, 'error': f'{cart_item.product.name} is out of stock'}), 400
+            cart_item.product.increment('stock_quantity', -cart_item.quantity, minimum=0)
         
-        shipping = Decimal("0.00") if subtotal >= shipping_threshold else shipping_cost
-        tax = subtotal * tax_rate
-        total = subtotal + shipping + tax
+        try:
+            db.session.commit()
+        except GuardError as e:
+            product = e.errors[0][0]
+            return jsonify({'success': False, 'error': f'{product.name} is out of stock'}), 400
         
         # Create order
         order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
@@ -1731,18 +1728,9 @@ def process_stripe_payment():
         db.session.add(order)
         db.session.flush()
         
-        # Only process items that are NOT saved for later
-        active_cart_items = [item for item in cart_items if not item.save_for_later]
-        
-        if not active_cart_items:
-            return jsonify({'success': False, 'error': 'No items selected for purchase'}), 400
-        
-        # Create order items and update stock
+        # Create order items
+        order_items = []
         for cart_item in active_cart_items:
-            if cart_item.product.stock_quantity < cart_item.quantity:
-                db.session.rollback()
-                return jsonify({'success': False, 'error': f'{cart_item.product.name} is out of stock'}), 400
-            
             order_item = OrderItem(
                 order_id=order.id,
                 product_id=cart_item.product_id,
@@ -1750,7 +1738,7 @@ def process_stripe_payment():
                 price=cart_item.product.price
             )
             db.session.add(order_item)
-            cart_item.product.stock_quantity -= cart_item.quantity
+            order_items.append(order_item)
         
         # Clear only the purchased items from cart (keep saved for later items)
         for cart_item in active_cart_items:
@@ -1758,6 +1746,8 @@ def process_stripe_payment():
         
         db.session.commit()
         
+        seller_stats.record_order(order, order_items)
+        
         send_order_confirmation_email(order)
         
         return jsonify({
@@ -1789,13 +1779,20 @@ def cancel_order(order_id):
                 'message': 'Order cannot be cancelled at this stage. Orders can only be cancelled when pending or confirmed.'
             }), 400
         
+        previous_status = order.status
+        
         # Restore stock quantities
-        for item in order.order_items:
-            item.product.stock_quantity += item.quantity
+        order_items = prefetch(order.order_items, 'product')
+        for item in order_items:
+            item.product.increment('stock_quantity', item.quantity)
         
         # Update order status
         order.status = 'cancelled'
         db.session.commit()
+        seller_stats.record_order_status(order)
+        
+        if previous_status in seller_stats.SUCCESSFUL_STATUSES:
+            seller_stats.record_order_cancelled(order, order_items)
         
         return jsonify({
             'success': True,
@@ -1850,6 +1847,7 @@ def reorder(order_id):
         session_id = get_session_id()
         items_added = 0
         
+        prefetch([order], 'order_items.product')
         for order_item in order.order_items:
             # Check if product is still available
             if order_item.product.stock_quantity > 0:
@@ -1862,7 +1860,7 @@ def reorder(order_id):
                 quantity_to_add = min(order_item.quantity, order_item.product.stock_quantity)
                 
                 if cart_item:
-                    cart_item.quantity += quantity_to_add
+                    cart_item.increment('quantity', quantity_to_add)
                 else:
                     cart_item = CartItem(
                         session_id=session_id,
@@ -1897,55 +1895,11 @@ def seller_sales_trend():
     user_id = session['user_id']
     
     # Get sales data for the last 30 days
-    end_date = datetime.now().date()
+    end_date = datetime.utcnow().date()
     start_date = end_date - timedelta(days=29)  # 30 days total including today
     
-    # Get all seller's products
-    seller_products = Product.query.filter_by(seller_id=user_id).all()
-    seller_product_ids = [p.id for p in seller_products]
-    
-    # Get all orders and order items
-    all_orders = Order.query.all()
-    all_order_items = OrderItem.query.all()
-    
-    # Build daily sales data
-    sales_by_date = {}
-    successful_statuses = ['confirmed', 'processing', 'shipped', 'delivered']
-    
-    for order in all_orders:
-        # Check if order is in date range and has successful status
-        if not hasattr(order, 'created_at') or not order.created_at:
-            continue
-            
-        try:
-            if isinstance(order.created_at, str):
-                order_date = datetime.fromisoformat(order.created_at.replace('Z', '+00:00')).date()
-            else:
-                order_date = order.created_at.date()
-        except:
-            continue
-        
-        if order_date < start_date or order_date > end_date:
-            continue
-            
-        if order.status not in successful_statuses:
-            continue
-        
-        # Check if order has seller's products
-        order_items = [item for item in all_order_items if item.order_id == order.id]
-        seller_items = [item for item in order_items if item.product_id in seller_product_ids]
-        
-        if seller_items:
-            date_str = order_date.strftime('%Y-%m-%d')
-            if date_str not in sales_by_date:
-                sales_by_date[date_str] = {'revenue': 0, 'orders': set()}
-            
-            # Add revenue from seller's items
-            for item in seller_items:
-                sales_by_date[date_str]['revenue'] += float(item.price) * int(item.quantity)
-            
-            # Track unique orders
-            sales_by_date[date_str]['orders'].add(order.id)
+    # Read the per-day rollup rows (see seller_stats.py)
+    sales_by_date = seller_stats.daily_sales(user_id, start_date, end_date)
     
     # Generate all dates in range
     current_date = start_date
@@ -1958,8 +1912,8 @@ def seller_sales_trend():
         dates.append(date_str)
         
         if date_str in sales_by_date:
-            revenues.append(sales_by_date[date_str]['revenue'])
-            orders.append(len(sales_by_date[date_str]['orders']))
+            revenues.append(sales_by_date[date_str].revenue or 0)
+            orders.append(sales_by_date[date_str].orders or 0)
         else:
             revenues.append(0)
             orders.append(0)
@@ -1997,79 +1951,49 @@ def seller_sales_trend():
 @app.route('/api/seller/orders')
 @seller_required
 def seller_orders():
-    """Get all orders for seller's products"""
+    """Get one page of orders for seller's products, newest first"""
     user_id = session['user_id']
+    before = request.args.get('before')
+    limit = request.args.get('limit', 20, type=int)
     
-    # Get all seller's products
-    seller_products = Product.query.filter_by(seller_id=user_id).all()
-    seller_product_ids = [p.id for p in seller_products]
+    # Read from the per-seller order index instead of scanning every order
+    rows, next_cursor = seller_stats.seller_order_feed(user_id, before=before, limit=limit)
     
-    # Get all orders and order items
-    all_orders = Order.query.all()
-    all_order_items = OrderItem.query.all()
+    # Load customers and products for the whole page in one query each
+    customers = User.query.only('username', 'email').get_many(row.customer_id for row in rows)
+    products = Product.query.only('name', 'image_url').get_many(
+        item['product_id'] for row in rows for item in (row.items or [])
+    )
     
-    # Build orders data
     orders_data = []
-    processed_orders = set()
-    
-    # Sort orders by created_at (newest first)
-    sorted_orders = sorted(
-        all_orders, 
-        key=lambda x: x.created_at if hasattr(x, 'created_at') and x.created_at else '', 
-        reverse=True
-    )
+    for row in rows:
+        customer = customers.get(row.customer_id)
+        
+        # Build items data
+        items_data = []
+        for item in row.items or []:
+            product = products.get(item['product_id'])
+            if product:
+                items_data.append({
+                    'id': item['id'],
+                    'product_name': product.name,
+                    'product_image': product.image_url,
+                    'quantity': item['quantity'],
+                    'price': float(item['price'])
+                })
+        
+        orders_data.append({
+            'id': row.order_id,
+            'order_number': row.order_number or f'ORD-{row.order_id}',
+            'customer_name': customer.username if customer else 'Unknown',
+            'customer_email': customer.email if customer else 'N/A',
+            'status': row.status or 'pending',
+            'created_at': row.order_created_at.strftime('%Y-%m-%d %H:%M') if row.order_created_at else 'N/A',
+            'total_amount': float(row.total_amount or 0),
+            'items': items_data
+        })
     
-    for order in sorted_orders:
-        if order.id in processed_orders:
-            continue
-        
-        # Get order items for this order
-        order_items = [item for item in all_order_items if item.order_id == order.id]
-        
-        # Filter to only seller's items
-        seller_items = [item for item in order_items if item.product_id in seller_product_ids]
-        
-        if seller_items:
-            processed_orders.add(order.id)
-            
-            # Get customer info
-            customer = User.query.get(order.user_id) if hasattr(order, 'user_id') and order.user_id else None
-            
-            # Format created_at
-            try:
-                if isinstance(order.created_at, str):
-                    created_at_dt = datetime.fromisoformat(order.created_at.replace('Z', '+00:00'))
-                    created_at_str = created_at_dt.strftime('%Y-%m-%d %H:%M')
-                else:
-                    created_at_str = order.created_at.strftime('%Y-%m-%d %H:%M')
-            except:
-                created_at_str = str(order.created_at) if hasattr(order, 'created_at') else 'N/A'
-            
-            # Build items data
-            items_data = []
-            for item in seller_items:
-                product = Product.query.get(item.product_id)
-                if product:
-                    items_data.append({
-                        'id': item.id,
-                        'product_name': product.name,
-                        'product_image': product.image_url if hasattr(product, 'image_url') else None,
-                        'quantity': item.quantity,
-                        'price': float(item.price)
-                    })
-            
-            orders_data.append({
-                'id': order.id,
-                'order_number': order.order_number if hasattr(order, 'order_number') else f'ORD-{order.id}',
-                'customer_name': customer.username if customer else 'Unknown',
-                'customer_email': customer.email if customer else 'N/A',
-                'status': order.status if hasattr(order, 'status') else 'pending',
-                'created_at': created_at_str,
-                'total_amount': float(sum(item.price * item.quantity for item in seller_items)),
-                'items': items_data
-            })
-    
-    return jsonify({'orders': orders_data})
+    return jsonify({'orders': orders_data, 'next_cursor': next_cursor})
 
 @app.route('/api/seller/order/<int:order_id>/update-status', methods=['POST'])
 @seller_required
@@ -2092,6 +2016,7 @@ def update_order_status(order_id):
         user_id = session['user_id']
         
         # Check if seller has products in this order
+        prefetch([order], 'order_items.product')
         seller_has_products = any(
             item.product.seller_id == user_id 
             for item in order.order_items
@@ -2113,6 +2038,7 @@ def update_order_status(order_id):
         # Update order status
         order.status = new_status
         db.session.commit()
+        seller_stats.record_order_status(order)
         
         return jsonify({
             'success': True,
@@ -2135,6 +2061,7 @@ def approve_refund(order_id):
         user_id = session['user_id']
         
         # Check if seller has products in this order
+        prefetch([order], 'order_items.product')
         seller_has_products = any(
             item.product.seller_id == user_id 
             for item in order.order_items
@@ -2156,6 +2083,7 @@ def approve_refund(order_id):
         # Update order status to indicate refund approved
         order.status = 'refund_approved'
         db.session.commit()
+        seller_stats.record_order_status(order)
         
         # Here you would typically integrate with payment processor to issue refund
         # For now, we'll just update the status
@@ -2211,6 +2139,7 @@ def send_order_confirmation_email(order):
                         <tbody>
         """
         
+        prefetch([order], 'order_items.product')
         for item in order.order_items:
             html_body += f"""
                             <tr>
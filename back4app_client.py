@@ -1,8 +1,16 @@
+import copy
+import logging
 import os
+import random
+import threading
+import time
 import requests
 import json
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 from decimal import Decimal
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
 
 def convert_decimals(obj):
     """Recursively convert Decimal objects to float for JSON serialization"""
@@ -14,8 +22,107 @@ def convert_decimals(obj):
         return [convert_decimals(item) for item in obj]
     return obj
 
-class Back4AppClient:
+# Parse rejects /batch requests with more than 50 operations
+BATCH_LIMIT = 50
+
+# Responses worth retrying: rate limiting and gateway/overload errors, which
+# Back4App returns before the request reaches Parse
+RETRY_STATUSES = {429, 502, 503, 504}
+
+class Back4AppUnavailable(requests.ConnectionError):
+    """Raised without contacting Back4App while the circuit breaker is open.
+
+    ``retry_after`` is the number of seconds until the breaker lets a trial
+    request through.
+    """
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Fails requests fast after repeated upstream failures.
+
+    After ``threshold`` consecutive failed calls (connection errors, timeouts
+    and 5xx responses, once their retries are used up) the breaker opens and
+    every request raises Back4AppUnavailable for ``reset_timeout`` seconds.
+    Then one trial call is let through: success closes the breaker, failure
+    opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raises Back4AppUnavailable unless a request may be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let this one request through as the trial
+                self.state = self.HALF_OPEN
+                return
+            self.rejected += 1
+            retry_after = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+        raise Back4AppUnavailable('Back4App is unavailable; failing fast while the circuit breaker is open',
+                                  retry_after=retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                if self.state == self.CLOSED:
+                    logger.warning(f"Back4App circuit breaker opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+    def record_aborted(self):
+        """Settles a call that ended without an answer, e.g. on an unexpected exception.
+
+        It says nothing about Back4App's health, but a half-open breaker must
+        not wait forever on its trial, so the next call becomes the new trial.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'rejected': self.rejected
+        }
+
+class _Flight:
+    """One in-progress upstream read that identical reads can wait on."""
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
     def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class Back4AppClient:
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=None, timeout=None,
+                 single_flight=None, max_retries=None, backoff=None, backoff_max=None, breaker=None):
         self.app_id = os.environ.get('BACK4APP_APP_ID')
         self.client_key = os.environ.get('BACK4APP_CLIENT_KEY')
         self.master_key = os.environ.get('BACK4APP_MASTER_KEY')
@@ -45,6 +152,240 @@ class Back4AppClient:
                 "     or: BACK4APP_CLIENT_KEY=your_client_key_here"
             )
 
+        # Connection pool settings. Every gunicorn worker owns one pooled
+        # session, so these limits apply per worker process.
+        if pool_connections is None:
+            pool_connections = int(os.environ.get('BACK4APP_POOL_CONNECTIONS', '4'))
+        if pool_maxsize is None:
+            pool_maxsize = int(os.environ.get('BACK4APP_POOL_MAXSIZE', '10'))
+        if pool_block is None:
+            pool_block = os.environ.get('BACK4APP_POOL_BLOCK', 'False').lower() == 'true'
+        if timeout is None:
+            timeout = (
+                float(os.environ.get('BACK4APP_CONNECT_TIMEOUT', '3.05')),
+                float(os.environ.get('BACK4APP_READ_TIMEOUT', '15'))
+            )
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+        # Identical concurrent get()/query() calls share one upstream request
+        if single_flight is None:
+            single_flight = os.environ.get('BACK4APP_SINGLE_FLIGHT', 'True').lower() == 'true'
+        self.single_flight = single_flight
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._flight_reads = 0
+        self._flight_coalesced = 0
+
+        # Retries of failed idempotent requests, with jittered exponential backoff
+        if max_retries is None:
+            max_retries = int(os.environ.get('BACK4APP_MAX_RETRIES', '2'))
+        if backoff is None:
+            backoff = float(os.environ.get('BACK4APP_RETRY_BACKOFF', '0.25'))
+        if backoff_max is None:
+            backoff_max = float(os.environ.get('BACK4APP_RETRY_BACKOFF_MAX', '2'))
+        if breaker is None:
+            breaker = CircuitBreaker(
+                threshold=int(os.environ.get('BACK4APP_BREAKER_THRESHOLD', '5')),
+                reset_timeout=float(os.environ.get('BACK4APP_BREAKER_RESET_SECONDS', '30'))
+            )
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self._retries = 0
+
+    @property
+    def session(self):
+        """Returns the pooled keep-alive session for the current process.
+
+        The session is created lazily and re-created after a fork, so workers
+        spawned from a preloaded master never share sockets.
+        """
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._session_lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                        pool_block=self.pool_block
+                    )
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def close(self):
+        """Closes the pooled session and all of its connections."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._session_pid = None
+
+    def pool_stats(self):
+        """Returns connection pool statistics for the current process.
+
+        ``checkouts`` counts requests sent through the pools, ``connections``
+        counts the TCP/TLS connections that had to be opened for them.
+        """
+        checkouts = 0
+        connections = 0
+        idle = 0
+        pools = 0
+        if self._session is not None and self._session_pid == os.getpid():
+            adapter = self._session.get_adapter(self.base_url)
+            pool_manager = adapter.poolmanager
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools += 1
+                checkouts += pool.num_requests
+                connections += pool.num_connections
+                if pool.pool is not None:
+                    idle += pool.pool.qsize()
+        reused = max(checkouts - connections, 0)
+        return {
+            'pools': pools,
+            'pool_maxsize': self.pool_maxsize,
+            'checkouts': checkouts,
+            'connections': connections,
+            'reused': reused,
+            'reuse_ratio': (reused / checkouts) if checkouts else 0.0,
+            'idle': idle
+        }
+
+    def flight_stats(self):
+        """Returns request coalescing statistics for the current process.
+
+        ``reads`` counts get()/query() calls, ``coalesced`` the ones that were
+        answered by another thread's identical in-flight request.
+        """
+        return {
+            'reads': self._flight_reads,
+            'coalesced': self._flight_coalesced,
+            'coalesce_ratio': (self._flight_coalesced / self._flight_reads) if self._flight_reads else 0.0,
+            'in_flight': len(self._flights)
+        }
+
+    def resilience_stats(self):
+        """Returns retry and circuit breaker statistics for the current process."""
+        return dict(self.breaker.stats(), retries=self._retries)
+
+    def _coalesced(self, key, fetch):
+        """Runs ``fetch()``, or waits for an identical call already running and shares its result.
+
+        Every caller gets its own copy of the result, since callers modify the
+        dicts they get back.
+        """
+        if not self.single_flight:
+            return fetch()
+        with self._flights_lock:
+            self._flight_reads += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self._flight_coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = fetch()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+                shared = flight.waiters > 0
+            flight.done.set()
+        # Waiters copy flight.result after done is set, so keep it untouched
+        return copy.deepcopy(flight.result) if shared else flight.result
+
+    def _request(self, method, url, idempotent=None, **kwargs):
+        """Sends a request through the pooled session, retrying transient failures.
+
+        Every call first asks the circuit breaker, so calls fail fast with
+        Back4AppUnavailable while Back4App is down, and reports one outcome to it
+        once any retries are done. Idempotent requests (GET and
+        DELETE by default) are retried on connection errors and RETRY_STATUSES.
+        Other requests are only retried when they cannot have been applied:
+        connect timeouts and 429s. Read timeouts are never retried, so a stalled
+        call holds a worker for at most one read timeout.
+        """
+        kwargs.setdefault('headers', self.headers)
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method in ('GET', 'DELETE')
+        self.breaker.before_request()
+        # True once the last attempt failed, False once it succeeded
+        failed = None
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.ConnectionError as e:
+                    failed = True
+                    retry = idempotent or isinstance(e, requests.ConnectTimeout)
+                    if not retry or attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff(attempt)
+                except requests.RequestException:
+                    # Read timeouts and broken responses
+                    failed = True
+                    raise
+                else:
+                    failed = response.status_code >= 500
+                    retry = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+                    if not retry or attempt >= self.max_retries:
+                        return response
+                    delay = self._backoff(attempt, response.headers.get('Retry-After'))
+                    if delay is None:
+                        return response
+                    response.close()
+                attempt += 1
+                self._retries += 1
+                failed = None
+                logger.info(f"Retrying {method} {urlparse(url).path} in {delay:.2f}s (attempt {attempt + 1})")
+                time.sleep(delay)
+        finally:
+            if failed is None:
+                self.breaker.record_aborted()
+            elif failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    def _backoff(self, attempt, retry_after=None):
+        """Returns the delay before the next attempt, or None if Retry-After asks for longer than backoff_max."""
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+            if delay is not None:
+                return delay if delay <= self.backoff_max else None
+        # Full jitter keeps workers that failed together from retrying together
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
     def _get_url(self, endpoint):
         return urljoin(self.base_url, endpoint)
 
@@ -53,37 +394,45 @@ class Back4AppClient:
         url = self._get_url(f'classes/{class_name}')
         # Convert Decimals to floats for JSON serialization
         data = convert_decimals(data)
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self._request('POST', url, json=data)
         response.raise_for_status()
         return response.json()
 
     def get(self, class_name, object_id):
         """Retrieves a single object by ID."""
         url = self._get_url(f'classes/{class_name}/{object_id}')
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 404:
-            return None
-        response.raise_for_status()
-        return response.json()
+
+        def fetch():
+            response = self._request('GET', url)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+        return self._coalesced(('GET', url), fetch)
 
     def update(self, class_name, object_id, data):
         """Updates an object."""
         url = self._get_url(f'classes/{class_name}/{object_id}')
         # Convert Decimals to floats for JSON serialization
         data = convert_decimals(data)
-        response = requests.put(url, headers=self.headers, json=data)
+        # Plain field sets can be repeated; Increment/AddUnique/etc. ops cannot
+        idempotent = not any(isinstance(value, dict) and '__op' in value for value in data.values())
+        response = self._request('PUT', url, idempotent=idempotent, json=data)
         response.raise_for_status()
         return response.json()
 
     def delete(self, class_name, object_id):
         """Deletes an object."""
         url = self._get_url(f'classes/{class_name}/{object_id}')
-        response = requests.delete(url, headers=self.headers)
+        response = self._request('DELETE', url)
         response.raise_for_status()
         return response.json()
 
-    def query(self, class_name, where=None, order=None, limit=None, skip=None, include=None, count=None):
-        """Queries objects from a class."""
+    def query(self, class_name, where=None, order=None, limit=None, skip=None, include=None, count=None, keys=None):
+        """Queries objects from a class.
+
+        ``keys`` is a comma-separated list of the fields to return.
+        """
         url = self._get_url(f'classes/{class_name}')
         params = {}
         if where:
@@ -98,16 +447,65 @@ class Back4AppClient:
             params['include'] = include
         if count is not None:
             params['count'] = count
-            
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json()
+        if keys:
+            params['keys'] = keys
+
+        def fetch():
+            response = self._request('GET', url, params=params)
+            response.raise_for_status()
+            return response.json()
+        return self._coalesced(('GET', url, tuple(sorted(params.items()))), fetch)
+
+    @property
+    def can_aggregate(self):
+        """Parse only serves /aggregate to requests made with the master key."""
+        return bool(self.master_key)
+
+    def aggregate(self, class_name, pipeline):
+        """Runs a MongoDB-style aggregation pipeline on a class; requires the master key.
+
+        Parse returns each $group key under ``objectId``.
+        """
+        url = self._get_url(f'aggregate/{class_name}')
+        params = {'pipeline': json.dumps(pipeline)}
+
+        def fetch():
+            response = self._request('GET', url, params=params)
+            response.raise_for_status()
+            return response.json()
+        return self._coalesced(('GET', url, params['pipeline']), fetch)
+
+    def batch(self, ops):
+        """Runs create/update/delete operations through Parse's /batch endpoint.
+
+        Each op is a dict with ``method``, ``path`` (e.g. ``classes/Product`` or
+        ``classes/Product/<objectId>``) and an optional ``body``. Operations are
+        sent in chunks of BATCH_LIMIT and the per-op results (``{'success': ...}``
+        or ``{'error': ...}``) are returned in the same order as ``ops``.
+        """
+        url = self._get_url('batch')
+        results = []
+        for start in range(0, len(ops), BATCH_LIMIT):
+            chunk = ops[start:start + BATCH_LIMIT]
+            requests_data = []
+            for op in chunk:
+                entry = {
+                    'method': op['method'],
+                    'path': urlparse(self._get_url(op['path'])).path
+                }
+                if op.get('body') is not None:
+                    entry['body'] = convert_decimals(op['body'])
+                requests_data.append(entry)
+            response = self._request('POST', url, json={'requests': requests_data})
+            response.raise_for_status()
+            results.extend(response.json())
+        return results
 
     def login(self, username, password):
         """Logs in a user."""
         url = self._get_url('login')
         params = {'username': username, 'password': password}
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self._request('GET', url, params=params)
         response.raise_for_status()
         return response.json()
 
@@ -115,13 +513,13 @@ class Back4AppClient:
         """Signs up a new user."""
         url = self._get_url('users')
         # Parse requires 'username' and 'password' in the body
-        response = requests.post(url, headers=self.headers, json=user_data)
+        response = self._request('POST', url, json=user_data)
         response.raise_for_status()
         return response.json()
     
     def request_password_reset(self, email):
         """Requests a password reset."""
         url = self._get_url('requestPasswordReset')
-        response = requests.post(url, headers=self.headers, json={'email': email})
+        response = self._request('POST', url, json={'email': email})
         response.raise_for_status()
         return response.json()
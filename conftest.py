@@ -0,0 +1,187 @@
+"""
+Shared pytest fixtures: an in-memory stand-in for Back4AppClient.
+"""
+
+import itertools
+import os
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault('BACK4APP_APP_ID', 'test-app-id')
+os.environ.setdefault('BACK4APP_MASTER_KEY', 'test-master-key')
+
+import pytest
+from flask import Flask
+
+import models_b4a
+from models_b4a import db
+
+
+def _plain(value):
+    if isinstance(value, dict) and value.get('__type') == 'Date':
+        return value['iso']
+    return value
+
+
+def _matches(obj, where):
+    for key, cond in (where or {}).items():
+        if key == '$or':
+            if not any(_matches(obj, clause) for clause in cond):
+                return False
+            continue
+        if key == '$and':
+            if not all(_matches(obj, clause) for clause in cond):
+                return False
+            continue
+        value = obj.get(key)
+        cond = _plain(cond)
+        if isinstance(cond, dict):
+            for op, operand in cond.items():
+                operand = _plain(operand)
+                if op == '$eq' and value != operand:
+                    return False
+                if op == '$ne' and value == operand:
+                    return False
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$all' and not all(v in (value or []) for v in operand):
+                    return False
+                if op == '$gt' and not (value is not None and value > operand):
+                    return False
+                if op == '$gte' and not (value is not None and value >= operand):
+                    return False
+                if op == '$lt' and not (value is not None and value < operand):
+                    return False
+                if op == '$lte' and not (value is not None and value <= operand):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _get_path(obj, key):
+    for part in key.split('.'):
+        obj = obj.get(part) if isinstance(obj, dict) else None
+    return obj
+
+
+def _set_path(obj, key, value):
+    parts = key.split('.')
+    for part in parts[:-1]:
+        obj = obj.setdefault(part, {})
+    obj[parts[-1]] = value
+
+
+class FakeClient:
+    """In-memory stand-in for Back4AppClient that records every call."""
+
+    def __init__(self):
+        self.store = {}
+        self.calls = []
+        # The ``keys`` of the last query, to check Query.only() projections
+        self.last_keys = None
+        self._clock = itertools.count()
+
+    def _table(self, class_name):
+        return self.store.setdefault(class_name, {})
+
+    def _now(self):
+        moment = datetime(2025, 1, 1) + timedelta(seconds=next(self._clock))
+        return moment.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def create(self, class_name, data):
+        self.calls.append(('create', class_name))
+        object_id = uuid.uuid4().hex[:10]
+        created_at = data.get('createdAt') or self._now()
+        self._table(class_name)[object_id] = dict(data, objectId=object_id, createdAt=created_at)
+        return {'objectId': object_id, 'createdAt': created_at}
+
+    def get(self, class_name, object_id):
+        self.calls.append(('get', class_name))
+        obj = self._table(class_name).get(object_id)
+        return dict(obj) if obj else None
+
+    def update(self, class_name, object_id, data):
+        self.calls.append(('update', class_name))
+        obj = self._table(class_name)[object_id]
+        resp = {'updatedAt': self._now()}
+        for key, value in data.items():
+            op = value.get('__op') if isinstance(value, dict) else None
+            if op == 'Increment':
+                _set_path(obj, key, (_get_path(obj, key) or 0) + value['amount'])
+                resp[key] = _get_path(obj, key)
+            else:
+                _set_path(obj, key, value)
+        return resp
+
+    def delete(self, class_name, object_id):
+        self.calls.append(('delete', class_name))
+        self._table(class_name).pop(object_id, None)
+        return {}
+
+    def query(self, class_name, where=None, order=None, limit=None, skip=None, include=None, count=None, keys=None):
+        self.calls.append(('query', class_name))
+        self.last_keys = keys
+        rows = [dict(o) for o in self._table(class_name).values() if _matches(o, where)]
+        for key in reversed((order or '').split(',')):
+            if key:
+                name = key.lstrip('-')
+                rows.sort(key=lambda o: (o.get(name) is not None, o.get(name)), reverse=key.startswith('-'))
+        result = {}
+        if count:
+            result['count'] = len(rows)
+        skip = skip or 0
+        limit = 100 if limit is None else limit
+        result['results'] = rows[skip:skip + limit]
+        if keys:
+            fields = keys.split(',')
+            result['results'] = [{k: v for k, v in row.items() if k in fields} for row in result['results']]
+        return result
+
+    # Aggregations run on the stand-in pipeline evaluator, like with a master key
+    can_aggregate = True
+
+    def aggregate(self, class_name, pipeline):
+        self.calls.append(('aggregate', class_name))
+        rows = [dict(o) for o in self._table(class_name).values()]
+        if pipeline and '$match' in pipeline[0]:
+            rows = [row for row in rows if _matches(row, pipeline[0]['$match'])]
+            pipeline = pipeline[1:]
+        return {'results': models_b4a.run_pipeline(rows, pipeline)}
+
+    def batch(self, ops):
+        self.calls.append(('batch', len(ops)))
+        results = []
+        for op in ops:
+            parts = op['path'].split('/')
+            class_name = parts[1]
+            if op['method'] == 'POST':
+                results.append({'success': self.create(class_name, op['body'])})
+            elif parts[2] not in self._table(class_name):
+                results.append({'error': {'code': 101, 'error': 'Object not found.'}})
+            elif op['method'] == 'PUT':
+                results.append({'success': self.update(class_name, parts[2], op['body'])})
+            else:
+                results.append({'success': self.delete(class_name, parts[2])})
+        return results
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(models_b4a, 'client', fake)
+    db.session.rollback()
+    for model in models_b4a.models.values():
+        if model._cache is not None:
+            model._cache.invalidate()
+    if models_b4a.query_cache.backend is not None:
+        models_b4a.query_cache.backend.clear()
+    yield fake
+    db.session.rollback()
+
+
+@pytest.fixture
+def request_context():
+    app = Flask(__name__)
+    with app.test_request_context('/'):
+        yield
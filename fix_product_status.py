@@ -4,33 +4,30 @@ Script to add status='active' to all existing products that don't have it
 from dotenv import load_dotenv
 load_dotenv()
 
-from back4app_client import Back4AppClient
+from models_b4a import Product
 
 print("=" * 60)
 print("FIXING PRODUCT STATUS")
 print("=" * 60)
 
-client = Back4AppClient()
-
-# Get all products
-print("\n1. Fetching all products...")
-result = client.query('Product', limit=1000)
-products = result.get('results', [])
-print(f"   Found {len(products)} products")
-
-# Update products without status
+# Walk every product; Query.iter() pages through the whole class
+print("\n1. Scanning all products...")
+scanned_count = 0
 updated_count = 0
-for product in products:
-    if 'status' not in product or not product.get('status'):
-        print(f"\n2. Updating product: {product.get('name', 'Unknown')}")
-        print(f"   ID: {product['objectId']}")
+for product in Product.query.only('name', 'status').iter():
+    scanned_count += 1
+    if not product.status:
+        print(f"\n2. Updating product: {product.name or 'Unknown'}")
+        print(f"   ID: {product.id}")
         
         try:
-            client.update('Product', product['objectId'], {'status': 'active'})
+            product.status = 'active'
+            product.save()
             print(f"   ✅ Status set to 'active'")
             updated_count += 1
         except Exception as e:
             print(f"   ❌ Failed to update: {e}")
+print(f"\n   Scanned {scanned_count} products")
 
 print("\n" + "=" * 60)
 print(f"COMPLETE: Updated {updated_count} products")
@@ -38,11 +35,10 @@ print("=" * 60)
 
 # Verify
 print("\n3. Verifying updates...")
-result = client.query('Product', where={'status': 'active'}, limit=1000)
-active_products = result.get('results', [])
-print(f"   ✅ Found {len(active_products)} active products")
-
-if active_products:
-    print(f"\n   Active products:")
-    for p in active_products:
-        print(f"   - {p.get('name')} (status: {p.get('status')})")
+active_count = 0
+for product in Product.query.filter_by(status='active').only('name', 'status').iter():
+    if active_count == 0:
+        print(f"\n   Active products:")
+    active_count += 1
+    print(f"   - {product.name} (status: {product.status})")
+print(f"   ✅ Found {active_count} active products")
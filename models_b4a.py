@@ -1,43 +1,289 @@
 from back4app_client import Back4AppClient
+from query_cache import LocalCache, QueryCache, backend_from_env
+import base64
+import contextvars
+import json
+import logging
 import os
-from datetime import datetime
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from decimal import Decimal
+from flask import g, has_app_context
+import requests
+
+logger = logging.getLogger(__name__)
 
 client = Back4AppClient()
 
+# Shared cache for Query.cached() results, see query_cache.py
+query_cache = QueryCache(backend_from_env())
+
+# Model classes by Parse class name, filled in by BaseModel.__init_subclass__
+models = {}
+
+# Fields managed by Parse itself; never sent in a save
+SYSTEM_FIELDS = ('objectId', 'createdAt', 'updatedAt')
+
+# Parse's maximum page size, used when a lookup has to return every match
+MAX_LIMIT = 1000
+
+# Ids per objectId $in query in get_many(); keeps the query string well under URL limits
+IN_CHUNK_SIZE = 100
+
+# How long an approximate count may be reused before it is run again
+COUNT_CACHE_SECONDS = float(os.environ.get('BACK4APP_COUNT_CACHE_SECONDS', 300))
+
+# Approximate counts by (class_name, where), least recently used dropped first
+_count_cache = LocalCache(int(os.environ.get('BACK4APP_COUNT_CACHE_SIZE', 1000)))
+
+# Default freshness of ReferenceCache contents, for models that set cache_ttl
+REFERENCE_CACHE_SECONDS = float(os.environ.get('BACK4APP_REFERENCE_CACHE_SECONDS', 300))
+
+# Default lifetime of Query.cached() results, for models that set query_cache_ttl
+QUERY_CACHE_SECONDS = float(os.environ.get('BACK4APP_QUERY_CACHE_SECONDS', 30))
+
+# Threads per worker process that gather() runs calls on
+GATHER_WORKERS = int(os.environ.get('BACK4APP_GATHER_WORKERS', 8))
+
+def identity_map():
+    """Returns the request-scoped identity map, or None outside an app context.
+
+    Maps ``(class_name, objectId)`` to the model instance loaded during the
+    current request, so each object is fetched from Back4App at most once.
+    """
+    if not has_app_context():
+        return None
+    objects = g.get('_b4a_identity_map')
+    if objects is None:
+        objects = g._b4a_identity_map = {}
+    return objects
+
+def _load(model_class, data, keys=None):
+    """Builds a model from server data, reusing the instance already in the identity map.
+
+    ``keys`` lists the fields the data was restricted to by Query.only(); the
+    model fetches the others when one of them is first read.
+    """
+    objects = identity_map()
+    object_id = data.get('objectId')
+    if objects is None or not object_id:
+        return model_class._partial(data, keys)
+    key = (model_class.__name__, object_id)
+    obj = objects.get(key)
+    if obj is None:
+        # setdefault keeps concurrent gather() calls on one instance
+        obj = objects.setdefault(key, model_class._partial(data, keys))
+    if obj._loaded is not None:
+        obj._merge(data, keys)
+    return obj
+
+class ReferenceCache:
+    """Process-local copy of every row of a small, rarely written class.
+
+    Models opt in with a ``cache_ttl`` class attribute. Plain ``query.all()``
+    and ``query.get()`` calls are then answered from memory. Once the copy is
+    older than the TTL it is still served while a background thread reloads
+    it. Any save or delete of the class through this process drops the copy,
+    so the next read fetches it again.
+    """
+
+    def __init__(self, model_class, ttl):
+        self.model_class = model_class
+        self.ttl = ttl
+        self._rows = None
+        self._by_id = {}
+        self._loaded_at = None
+        self._refreshing = False
+        # Bumped by invalidate() so a load that started earlier does not store stale rows
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def rows(self):
+        """Returns the cached server data, loading it on a miss."""
+        return self._snapshot()[0]
+
+    def all(self):
+        return [_load(self.model_class, dict(data)) for data in self.rows()]
+
+    def get(self, object_id):
+        data = self._snapshot()[1].get(object_id)
+        return _load(self.model_class, dict(data)) if data is not None else None
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._rows, self._by_id = None, {}
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'refreshes': self.refreshes}
+
+    def _snapshot(self):
+        """Returns matching (rows, by_id), loading them on a miss."""
+        with self._lock:
+            rows, by_id = self._rows, self._by_id
+            stale = rows is not None and time.monotonic() - self._loaded_at > self.ttl
+            start = stale and not self._refreshing
+            if start:
+                self._refreshing = True
+        if rows is None:
+            self.misses += 1
+            return self._load()
+        self.hits += 1
+        if start:
+            threading.Thread(target=self._refresh, name=f'{self.model_class.__name__}-cache', daemon=True).start()
+        return rows, by_id
+
+    def _load(self):
+        with self._lock:
+            generation = self._generation
+        result = client.query(self.model_class.__name__, limit=MAX_LIMIT)
+        rows = result.get('results', [])
+        by_id = {data.get('objectId'): data for data in rows}
+        with self._lock:
+            if self._generation == generation:
+                self._rows, self._by_id, self._loaded_at = rows, by_id, time.monotonic()
+        return rows, by_id
+
+    def _refresh(self):
+        try:
+            self._load()
+            self.refreshes += 1
+        except Exception:
+            # Keep serving the stale copy; the next read past the TTL retries
+            pass
+        finally:
+            self._refreshing = False
+
+class FieldOp:
+    """A Parse field operation applied on the server when the object is saved."""
+    def to_parse(self):
+        raise NotImplementedError
+
+    def merge(self, pending):
+        """Combines this operation with one already queued on the same field."""
+        return self
+
+    def apply(self, value):
+        """Returns the local value after the operation, until the server confirms it."""
+        return value
+
+class Increment(FieldOp):
+    """Atomic server-side increment, saved as Parse's ``{"__op": "Increment"}``.
+
+    Assign it to a field (``product.stock_quantity = Product.stock_quantity - 2``
+    or ``product.increment('stock_quantity', -2)``). With ``minimum`` set, a
+    save whose resulting value drops below it is reverted and raises GuardError.
+    """
+    def __init__(self, amount, minimum=None):
+        self.amount = amount
+        self.minimum = minimum
+
+    def to_parse(self):
+        return {'__op': 'Increment', 'amount': self.amount}
+
+    def merge(self, pending):
+        minimum = self.minimum if self.minimum is not None else pending.minimum
+        return Increment(pending.amount + self.amount, minimum)
+
+    def apply(self, value):
+        return (value or 0) + self.amount
+
+class Count:
+    """group_by() accumulator: the number of rows in each group."""
+    def to_parse(self):
+        return {'$sum': 1}
+
+    def value(self, result):
+        return int(result or 0)
+
+class Sum:
+    """group_by() accumulator: the total of a field, or of the product of several fields.
+
+    ``Sum('price', 'quantity')`` adds up price * quantity row by row.
+    """
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def to_parse(self):
+        if len(self.fields) == 1:
+            return {'$sum': f'${self.fields[0]}'}
+        return {'$sum': {'$multiply': [f'${field}' for field in self.fields]}}
+
+    def value(self, result):
+        return float(result or 0)
+
+class Day:
+    """group_by() key: the UTC 'YYYY-MM-DD' day of a date field."""
+    def __init__(self, field):
+        self.field = field
+
+    def to_parse(self):
+        return {'$dateToString': {'format': '%Y-%m-%d', 'date': f'${self.field}'}}
+
 class Field:
+    """A column of a Parse class, read and written as the JSON value Parse stores."""
     def __init__(self, name=None):
         self.name = name
 
+    def decode(self, value):
+        """Converts the stored JSON value to the Python value the model returns."""
+        return value
+
+    def encode(self, value):
+        """Converts a Python value to the JSON value Parse stores and queries."""
+        return value
+
     def __get__(self, instance, owner):
         if instance is None:
             return self
+        if instance._loaded is not None:
+            instance._ensure_loaded(self.name)
         return instance._data.get(self.name)
 
     def __set__(self, instance, value):
-        instance._data[self.name] = value
+        instance._set_field(self.name, self.encode(value))
+
+    def __add__(self, amount):
+        return Increment(amount)
+
+    def __sub__(self, amount):
+        return Increment(-amount)
 
     def __eq__(self, other):
-        return {'field': self.name, 'op': '$eq', 'value': other}
+        return {'field': self.name, 'op': '$eq', 'value': self.encode(other)}
     
     def __ne__(self, other):
-        return {'field': self.name, 'op': '$ne', 'value': other}
+        return {'field': self.name, 'op': '$ne', 'value': self.encode(other)}
     
     def __gt__(self, other):
-        return {'field': self.name, 'op': '$gt', 'value': other}
+        return {'field': self.name, 'op': '$gt', 'value': self.encode(other)}
     
     def __ge__(self, other):
-        return {'field': self.name, 'op': '$gte', 'value': other}
+        return {'field': self.name, 'op': '$gte', 'value': self.encode(other)}
     
     def __lt__(self, other):
-        return {'field': self.name, 'op': '$lt', 'value': other}
+        return {'field': self.name, 'op': '$lt', 'value': self.encode(other)}
     
     def __le__(self, other):
-        return {'field': self.name, 'op': '$lte', 'value': other}
+        return {'field': self.name, 'op': '$lte', 'value': self.encode(other)}
+    
+    def in_(self, values):
+        return {'field': self.name, 'op': '$in', 'value': [self.encode(value) for value in values]}
     
+    def contains_all(self, values):
+        # For array fields: every value must be an element of the array
+        return {'field': self.name, 'op': '$all', 'value': list(values)}
+
     def ilike(self, pattern):
         # Parse supports regex for string matching
-        # Convert SQL LIKE %pattern% to Regex
-        regex = pattern.replace('%', '.*')
+        # Convert SQL LIKE %pattern% to Regex, escaping everything else
+        regex = '.*'.join(re.escape(part) for part in pattern.split('%'))
         return {'field': self.name, 'op': '$regex', 'value': regex, 'options': 'i'}
     
     def desc(self):
@@ -46,6 +292,63 @@ class Field:
     def asc(self):
         return self.name
 
+class TypedField(Field):
+    """A field whose value is decoded once per instance and kept until the field changes.
+
+    The raw JSON value stays in ``_data`` for saves, cursors and the query
+    cache; the decoded one lives in the instance's ``_values``.
+    """
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        values = instance._values
+        if self.name not in values:
+            raw = Field.__get__(self, instance, owner)
+            values[self.name] = None if raw is None else self.decode(raw)
+        return values[self.name]
+
+class DecimalField(TypedField):
+    """Money and other exact amounts: a Decimal in Python, a Number in Parse."""
+    def decode(self, value):
+        # str() keeps 19.99 from becoming Decimal('19.989999999999998436805981327779591083526611328125')
+        return Decimal(str(value))
+
+    def encode(self, value):
+        return float(value) if isinstance(value, Decimal) else value
+
+class IntField(TypedField):
+    """Counts and quantities, which JSON may hand back as floats."""
+    def decode(self, value):
+        return int(value)
+
+class DateTimeField(TypedField):
+    """A naive UTC datetime, matching the datetime.utcnow() values the app compares it with.
+
+    Stored as a Parse Date, or with ``iso_string=True`` as an ISO 8601 string
+    for fields that are sorted and paged on as text.
+    """
+    def __init__(self, name=None, iso_string=False):
+        super().__init__(name)
+        self.iso_string = iso_string
+
+    def decode(self, value):
+        if isinstance(value, dict):
+            value = value.get('iso')
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def encode(self, value):
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            value = value.isoformat(timespec='milliseconds') + 'Z'
+        if isinstance(value, str) and not self.iso_string:
+            return {'__type': 'Date', 'iso': value}
+        return value
+
 class Query:
     def __init__(self, model_class):
         self.model_class = model_class
@@ -53,6 +356,9 @@ class Query:
         self._order = None
         self._limit = None
         self._skip = 0
+        self._prefetch = []
+        self._cache_ttl = None
+        self._keys = None
 
     def filter_by(self, **kwargs):
         self.where.update(kwargs)
@@ -102,9 +408,78 @@ class Query:
         self._skip = offset
         return self
 
+    def prefetch(self, *paths):
+        """Eagerly loads relations for every result, e.g. prefetch('category', 'product.seller')."""
+        self._prefetch.extend(paths)
+        return self
+
+    def only(self, *fields):
+        """Fetches just these fields (plus objectId, createdAt, updatedAt and the sort keys).
+
+        The models returned are partially loaded: reading any other field
+        fetches the whole object, so list the fields the caller reads,
+        including the id fields of relations it follows.
+        """
+        self._keys = set(fields)
+        return self
+
+    def _projection(self):
+        """The fields sent as Parse's ``keys`` parameter, or None for whole objects."""
+        if self._keys is None:
+            return None
+        sort_fields = {key.lstrip('-') for key in (self._order or '').split(',') if key}
+        return sorted(self._keys | sort_fields | set(SYSTEM_FIELDS))
+
+    def cached(self, ttl=None):
+        """Serves this query's results and count from query_cache.
+
+        Entries live for ``ttl`` seconds, defaulting to the model's
+        query_cache_ttl, and are dropped whenever the class is written. Only
+        use it for reads that can tolerate that staleness, like listing pages.
+        """
+        self._cache_ttl = ttl if ttl is not None else self.model_class.query_cache_ttl
+        return self
+
+    def _fetch(self, kind, **params):
+        """Runs client.query(), going through query_cache when cached() was called."""
+        if params.get('keys'):
+            params['keys'] = ','.join(params['keys'])
+        if not self._cache_ttl:
+            return client.query(self.model_class.__name__, where=self.where, **params)
+        key = query_cache.key(self.model_class.__name__, kind, self.where, params.get('order'),
+                              params.get('limit'), params.get('skip'), params.get('keys'))
+        result = query_cache.get(key)
+        if result is None:
+            try:
+                result = client.query(self.model_class.__name__, where=self.where, **params)
+            except requests.RequestException as e:
+                # Back4App is down or failing: fall back to the last results, however old
+                result = query_cache.get(key, stale=True)
+                if result is None:
+                    raise
+                logger.warning(f"Serving stale {self.model_class.__name__} results: {e}")
+                return result
+            query_cache.set(key, self.model_class.__name__, result, self._cache_ttl)
+        return result
+
+    def _is_plain(self):
+        return not self.where and not self._order and not self._skip
+
     def all(self):
-        result = client.query(self.model_class.__name__, where=self.where, order=self._order, limit=self._limit, skip=self._skip)
-        return [self.model_class(r) for r in result.get('results', [])]
+        cache = self.model_class._cache
+        if cache is not None and self._is_plain():
+            items = cache.all()
+            if self._limit is not None:
+                items = items[:self._limit]
+            if self._prefetch:
+                prefetch(items, *self._prefetch)
+            return items
+        keys = self._projection()
+        result = self._fetch('all', order=self._order, limit=self._limit, skip=self._skip, keys=keys)
+        items = [_load(self.model_class, r, keys) for r in result.get('results', [])]
+        if self._prefetch:
+            prefetch(items, *self._prefetch)
+        return items
 
     def first(self):
         self._limit = 1
@@ -112,11 +487,56 @@ class Query:
         return items[0] if items else None
 
     def get(self, object_id):
+        objects = identity_map()
+        if objects is not None:
+            obj = objects.get((self.model_class.__name__, object_id))
+            if obj is not None:
+                return obj
+        if self.model_class._cache is not None:
+            obj = self.model_class._cache.get(object_id)
+            if obj is not None:
+                return obj
         data = client.get(self.model_class.__name__, object_id)
         if data:
-            return self.model_class(data)
+            return _load(self.model_class, data)
         return None
     
+    def get_many(self, ids):
+        """Loads objects by id and returns {id: object}; ids that do not exist are left out.
+
+        Ids are de-duplicated. Objects already in the request's identity map or
+        the class's ReferenceCache are reused, and the rest are fetched with
+        objectId $in queries of IN_CHUNK_SIZE ids, run concurrently. The loaded
+        objects join the identity map, so later get() calls and relations to
+        them cost nothing. Filters, only() and prefetch() apply as usual.
+        """
+        found = {}
+        missing = []
+        objects = identity_map() if not self.where else None
+        cache = self.model_class._cache if not self.where else None
+        for object_id in dict.fromkeys(object_id for object_id in ids if object_id):
+            obj = objects.get((self.model_class.__name__, object_id)) if objects is not None else None
+            if obj is None and cache is not None:
+                obj = cache.get(object_id)
+            if obj is not None:
+                found[object_id] = obj
+            else:
+                missing.append(object_id)
+
+        def load(chunk):
+            query = Query(self.model_class)
+            query.where = _and_where(self.where, {'objectId': {'$in': chunk}})
+            query._keys = self._keys
+            query._limit = len(chunk)
+            return query.all()
+        chunks = [missing[i:i + IN_CHUNK_SIZE] for i in range(0, len(missing), IN_CHUNK_SIZE)]
+        for loaded in gather(*[lambda chunk=chunk: load(chunk) for chunk in chunks]):
+            for obj in loaded:
+                found[obj.objectId] = obj
+        if self._prefetch:
+            prefetch(list(found.values()), *self._prefetch)
+        return found
+
     def get_or_404(self, object_id):
         item = self.get(object_id)
         if not item:
@@ -124,44 +544,387 @@ class Query:
             abort(404)
         return item
     
-    def count(self):
-        # Parse count query
-        result = client.query(self.model_class.__name__, where=self.where, limit=0, count=1)
-        return result.get('count', 0)
+    def count(self, approximate=False):
+        """Counts matching objects.
+
+        With ``approximate=True`` a count taken within the last
+        COUNT_CACHE_SECONDS for the same filter is reused.
+        """
+        class_name = self.model_class.__name__
+        key = (class_name, json.dumps(self.where, sort_keys=True, default=str))
+        if approximate:
+            cached = _count_cache.get(key)
+            if cached is not None:
+                return cached
+        result = self._fetch('count', limit=0, count=1)
+        total = result.get('count', 0)
+        if approximate:
+            _count_cache.set(key, class_name, total, COUNT_CACHE_SECONDS)
+        return total
+
+    def iter(self, batch_size=MAX_LIMIT):
+        """Yields every matching object, fetching ``batch_size`` rows per request.
+
+        Unlike all(), which Parse silently caps at 100 rows by default, this
+        walks the whole result set. Batches are read with keyset conditions on
+        the sort order (newest first unless order_by() says otherwise, with
+        objectId as tiebreaker), so each request costs the same however deep
+        the scan is, and rows are not skipped when earlier ones are changed or
+        deleted along the way. Objects are not added to the identity map, so
+        memory is bounded by one batch. limit() caps the total yielded.
+        """
+        keys = self._sort_keys()
+        fields = [key.lstrip('-') for key in keys]
+        projection = self._projection()
+        remaining = self._limit
+        skip = self._skip
+        values = None
+        while remaining is None or remaining > 0:
+            where = self.where if values is None else _and_where(self.where, {'$or': _keyset_clauses(keys, values)})
+            limit = batch_size if remaining is None else min(batch_size, remaining)
+            result = client.query(
+                self.model_class.__name__, where=where, order=','.join(keys), limit=limit, skip=skip or None,
+                keys=','.join(projection) if projection else None
+            )
+            rows = result.get('results', [])
+            items = [self.model_class._partial(row, projection) for row in rows]
+            if self._prefetch:
+                prefetch(items, *self._prefetch)
+            yield from items
+            if len(rows) < limit:
+                return
+            if remaining is not None:
+                remaining -= len(rows)
+            skip = 0
+            values = [items[-1]._get_local(field) for field in fields]
+
+    def aggregate(self, pipeline):
+        """Runs an aggregation pipeline over the rows matching this query.
+
+        The query's filters become a leading $match stage and the pipeline
+        runs in Back4App, which needs the master key. With only a client key
+        the matching rows are streamed instead and the pipeline ($group,
+        $sort, $limit and $skip stages) is evaluated here by run_pipeline().
+        Group keys come back under ``objectId``, as Parse returns them.
+        """
+        if not client.can_aggregate:
+            fields = _pipeline_fields(pipeline)
+            return run_pipeline([obj._data for obj in self.only(*fields).iter()], pipeline)
+        if self.where:
+            pipeline = [{'$match': self.where}] + list(pipeline)
+        return client.aggregate(self.model_class.__name__, pipeline).get('results', [])
+
+    def group_by(self, key, **accumulators):
+        """Groups the matching rows by a field, or Day(field), and returns {key: {name: value}}.
+
+        Accumulators are Count() and Sum(); without any, each group gets a
+        ``count``. Only one row per group leaves Back4App::
+
+            OrderItem.query.filter(OrderItem.product_id.in_(ids)).group_by(
+                'order_id', revenue=Sum('price', 'quantity'))
+        """
+        accumulators = accumulators or {'count': Count()}
+        group = {'_id': key.to_parse() if isinstance(key, Day) else f'${key}'}
+        for name, accumulator in accumulators.items():
+            group[name] = accumulator.to_parse()
+        return {
+            row.get('objectId'): {name: accumulator.value(row.get(name)) for name, accumulator in accumulators.items()}
+            for row in self.aggregate([{'$group': group}])
+        }
 
     def paginate(self, page=1, per_page=20, error_out=True):
-        self._limit = per_page
+        self._limit = per_page + 1
         self._skip = (page - 1) * per_page
         items = self.all()
-        total = self.count() # This is expensive, maybe optimize?
-        
-        class Pagination:
-            def __init__(self, items, page, per_page, total):
-                self.items = items
-                self.page = page
-                self.per_page = per_page
-                self.total = total
-                self.pages = (total + per_page - 1) // per_page
-                self.has_prev = page > 1
-                self.has_next = page < self.pages
-                self.prev_num = page - 1
-                self.next_num = page + 1
-                
-            def iter_pages(self):
-                # Simple implementation
-                return range(1, self.pages + 1)
+        return Pagination(self, items[:per_page], page, per_page, len(items) > per_page)
+
+    def _sort_keys(self):
+        """The active sort order, made unique by a trailing objectId key."""
+        keys = [key for key in (self._order or '').split(',') if key] or ['-createdAt']
+        if not any(key.lstrip('-') == 'objectId' for key in keys):
+            keys.append('-objectId' if keys[-1].startswith('-') else 'objectId')
+        return keys
+
+    def keyset_paginate(self, after=None, before=None, per_page=20, approximate_count=False):
+        """Cursor pagination on the active sort order.
+
+        Pass the ``next_cursor`` of a page as ``after`` to get the following
+        page, or its ``prev_cursor`` as ``before`` to go back. Every page is one
+        bounded query whatever its depth; the total is only counted if
+        ``KeysetPagination.total`` is read.
+        """
+        keys = self._sort_keys()
+        values = _decode_cursor(after, len(keys))
+        backwards = values is None and _decode_cursor(before, len(keys)) is not None
+        if backwards:
+            values = _decode_cursor(before, len(keys))
+            keys = [key[1:] if key.startswith('-') else f'-{key}' for key in keys]
+        counted = Query(self.model_class)
+        counted.where = dict(self.where)
+        counted._cache_ttl = self._cache_ttl
+
+        if values is not None:
+            self.where = _and_where(self.where, {'$or': _keyset_clauses(keys, values)})
+        self._order = ','.join(keys)
+        self._limit = per_page + 1
+        self._skip = 0
+        items = self.all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            has_next, has_prev = True, more
+        else:
+            has_next, has_prev = more, values is not None
+
+        sort_keys = [key.lstrip('-') for key in keys]
+        next_cursor = _encode_cursor(items[-1], sort_keys) if items and has_next else None
+        prev_cursor = _encode_cursor(items[0], sort_keys) if items and has_prev else None
+        return KeysetPagination(counted, items, per_page, next_cursor, prev_cursor, approximate_count)
+
+
+class Pagination:
+    """One page of a page-numbered query; the total is counted on first use."""
+
+    def __init__(self, query, items, page, per_page, has_next):
+        self._query = query
+        self._total = None
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_prev = page > 1
+        self.has_next = has_next
+        self.prev_num = page - 1
+        self.next_num = page + 1
+
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = self._query.count()
+        return self._total
+
+    @property
+    def pages(self):
+        return (self.total + self.per_page - 1) // self.per_page
+
+    def iter_pages(self):
+        # Simple implementation
+        return range(1, self.pages + 1)
+
+
+class KeysetPagination:
+    """One page of a keyset-paginated query, see Query.keyset_paginate()."""
+
+    def __init__(self, query, items, per_page, next_cursor, prev_cursor, approximate_count=False):
+        self._query = query
+        self._approximate = approximate_count
+        self._total = None
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.has_next = next_cursor is not None
+        self.has_prev = prev_cursor is not None
+
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = self._query.count(approximate=self._approximate)
+        return self._total
+
+
+def _pipeline_fields(value):
+    """Returns the field names a pipeline refers to as '$field'."""
+    fields = set()
+    if isinstance(value, str) and value.startswith('$') and not value.startswith('$$'):
+        fields.add(value[1:].split('.')[0])
+    elif isinstance(value, dict):
+        for item in value.values():
+            fields |= _pipeline_fields(item)
+    elif isinstance(value, list):
+        for item in value:
+            fields |= _pipeline_fields(item)
+    return fields
+
+def _evaluate(row, expr):
+    """Evaluates the subset of aggregation expressions that Day, Sum and Count produce."""
+    if isinstance(expr, str) and expr.startswith('$'):
+        value = row
+        for part in expr[1:].split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+    if isinstance(expr, dict) and '$multiply' in expr:
+        result = 1
+        for part in expr['$multiply']:
+            value = _evaluate(row, part)
+            if not isinstance(value, (int, float)):
+                return None
+            result *= value
+        return result
+    if isinstance(expr, dict) and '$dateToString' in expr:
+        value = _evaluate(row, expr['$dateToString']['date'])
+        if isinstance(value, dict):
+            value = value.get('iso')
+        if not value:
+            return None
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).strftime(expr['$dateToString']['format'])
+    if isinstance(expr, dict):
+        raise ValueError(f"Unsupported aggregate expression: {expr}")
+    return expr
 
-        return Pagination(items, page, per_page, total)
+def run_pipeline(rows, pipeline):
+    """Evaluates $group, $sort, $limit and $skip stages over raw rows.
+
+    The local stand-in for Back4App's /aggregate endpoint, used when the
+    master key is not available.
+    """
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op == '$group':
+            groups = {}
+            for row in rows:
+                key = _evaluate(row, spec['_id'])
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = dict({name: 0 for name in spec if name != '_id'}, objectId=key)
+                for name, accumulator in spec.items():
+                    if name == '_id':
+                        continue
+                    if list(accumulator) != ['$sum']:
+                        raise ValueError(f"Unsupported accumulator: {accumulator}")
+                    value = _evaluate(row, accumulator['$sum'])
+                    # $sum ignores missing and non-numeric values
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        group[name] += value
+            rows = list(groups.values())
+        elif op == '$sort':
+            for field, direction in reversed(list(spec.items())):
+                field = 'objectId' if field == '_id' else field
+                rows.sort(key=lambda row: (row.get(field) is not None, row.get(field)), reverse=direction < 0)
+        elif op == '$limit':
+            rows = rows[:spec]
+        elif op == '$skip':
+            rows = rows[spec:]
+        else:
+            raise ValueError(f"Unsupported aggregate stage: {op}")
+    return rows
+
+def _where_value(field, value):
+    # Parse only compares its own date fields against Date objects
+    if field in ('createdAt', 'updatedAt') and isinstance(value, str):
+        return {'__type': 'Date', 'iso': value}
+    return value
+
+def _and_where(where, extra):
+    """Combines two where clauses, nesting them under $and if their keys collide."""
+    if any(key in where for key in extra):
+        return {'$and': [where, extra]}
+    return dict(where, **extra)
+
+def _keyset_clauses(keys, values):
+    """Builds the $or clauses selecting rows that sort after ``values``."""
+    clauses = []
+    for i, key in enumerate(keys):
+        clause = {k.lstrip('-'): _where_value(k.lstrip('-'), v) for k, v in zip(keys[:i], values[:i])}
+        field = key.lstrip('-')
+        clause[field] = {'$lt' if key.startswith('-') else '$gt': _where_value(field, values[i])}
+        clauses.append(clause)
+    return clauses
+
+def _encode_cursor(obj, fields):
+    raw = json.dumps([obj._get_local(field) for field in fields], default=float)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor, size):
+    """Returns the sort values in a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
 
 class BaseModel:
+    # Every model declares its fields, so instances need no __dict__; subclasses
+    # set __slots__ = () to keep it that way
+    __slots__ = ('_data', '_values', '_related', '_dirty', '_ops', '_loaded', '_error')
+
     objectId = Field('objectId')
     createdAt = Field('createdAt')
     updatedAt = Field('updatedAt')
 
+    # Field descriptors by attribute name, for encoding constructor arguments; set per subclass
+    _fields = {}
+
+    # Set on small reference classes to serve them from a ReferenceCache
+    cache_ttl = None
+    _cache = None
+    # Lifetime of Query.cached() results for this class; None disables them
+    query_cache_ttl = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        models[cls.__name__] = cls
+        cls._cache = ReferenceCache(cls, cls.cache_ttl) if cls.cache_ttl else None
+        cls._fields = {
+            name: value for klass in reversed(cls.__mro__)
+            for name, value in vars(klass).items() if isinstance(value, Field)
+        }
+
     def __init__(self, data=None, **kwargs):
         self._data = data or {}
-        self._data.update(kwargs)
-        
+        for name, value in kwargs.items():
+            field = self._fields.get(name)
+            if field is None:
+                self._data[name] = value
+            else:
+                self._data[field.name] = field.encode(value)
+        # Decoded values of typed fields, keyed by field name
+        self._values = {}
+        # Relation values attached by prefetch(), keyed by relation name
+        self._related = {}
+        # Fields changed since the object was loaded or last saved
+        self._dirty = set()
+        # Pending Increment operations, keyed by field name
+        self._ops = {}
+        # Fields fetched so far when loaded through Query.only(); None once complete
+        self._loaded = None
+        # Error Parse returned for this object in the last batched commit
+        self._error = None
+
+    @classmethod
+    def _partial(cls, data, keys):
+        obj = cls(data)
+        if keys is not None:
+            obj._loaded = set(keys)
+        return obj
+
+    def _ensure_loaded(self, name):
+        """Fetches the rest of a partially loaded object if ``name`` was not part of it."""
+        if name.split('.')[0] in self._loaded or not self._data.get('objectId'):
+            return
+        data = client.get(self.__class__.__name__, self._data['objectId'])
+        if data is None:
+            self._loaded = None
+            return
+        self._merge(data)
+
+    def _merge(self, data, keys=None):
+        """Adds fields this object did not have yet; ``keys`` is None when ``data`` is complete."""
+        if self._loaded is None:
+            return
+        # Keep local changes to fields that were never fetched
+        dirty = {name.split('.')[0] for name in self._dirty}
+        for key, value in data.items():
+            if key not in self._loaded and key not in dirty:
+                self._data[key] = value
+                self._values.pop(key, None)
+        self._loaded = None if keys is None else self._loaded | set(keys)
+
     @property
     def id(self):
         return self.objectId
@@ -170,21 +933,246 @@ class BaseModel:
     def id(self, value):
         self.objectId = value
 
-    def save(self):
+    def _get_local(self, name):
+        """Reads a field; dotted names address keys of nested objects."""
+        value = self._data
+        for part in name.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def _set_local(self, name, value):
+        parts = name.split('.')
+        self._values.pop(parts[0], None)
+        target = self._data
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        target[parts[-1]] = value
+
+    def _set_field(self, name, value):
+        """Sets a field or queues a FieldOp on it, and marks it dirty."""
+        if isinstance(value, FieldOp):
+            # Keep the local value in step until the server returns the real one
+            self._set_local(name, value.apply(self._get_local(name)))
+            pending = self._ops.get(name)
+            if pending is not None and type(pending) is type(value):
+                self._ops[name] = value.merge(pending)
+            elif pending is not None or name not in self._dirty:
+                self._ops[name] = value
+            # Otherwise a plain value is already queued and now carries the result
+        else:
+            self._ops.pop(name, None)
+            self._set_local(name, value)
+        if self._loaded is not None and '.' not in name:
+            # Assigned fields count as loaded; dotted ones still need the rest of the object
+            self._loaded.add(name)
+        if name not in SYSTEM_FIELDS:
+            self._dirty.add(name)
+            if self._data.get('objectId'):
+                # Persisted objects are flushed by the next db.session.commit()
+                db.session._track(self)
+
+    def increment(self, field, amount=1, minimum=None):
+        """Atomically adds ``amount`` to a numeric field on the next save.
+
+        ``field`` may be dotted (``'daily_orders.2025-01-31'``) to increment a
+        key of an object field.
+        """
+        self._set_field(field, Increment(amount, minimum))
+
+    def _save_op(self):
+        """Returns the batch operation that persists this object.
+
+        Existing objects only send their dirty fields; None means there is
+        nothing to save.
+        """
+        class_name = self.__class__.__name__
         if self.objectId:
+            if not self._dirty:
+                return None
+            data = {
+                k: self._ops[k].to_parse() if k in self._ops else self._get_local(k)
+                for k in self._dirty
+            }
+            return {'method': 'PUT', 'path': f'classes/{class_name}/{self.objectId}', 'body': data}
+        return {'method': 'POST', 'path': f'classes/{class_name}', 'body': self._data}
+
+    def _delete_op(self):
+        """Returns the batch operation that deletes this object."""
+        return {'method': 'DELETE', 'path': f'classes/{self.__class__.__name__}/{self.objectId}'}
+
+    def _guards(self):
+        """Returns the pending increments that carry a minimum guard."""
+        if not self.objectId:
+            return {}
+        return {
+            k: op for k, op in self._ops.items()
+            if isinstance(op, Increment) and op.minimum is not None
+        }
+
+    def _apply_save_result(self, resp):
+        """Copies server-assigned fields from a create/update response.
+
+        Parse also echoes the new value of incremented fields, which replaces
+        the local estimate.
+        """
+        for key, value in resp.items():
+            if value is not None:
+                self._set_local(key, value)
+        self._dirty.clear()
+        self._ops.clear()
+        objects = identity_map()
+        if objects is not None and self.objectId:
+            objects[(self.__class__.__name__, self.objectId)] = self
+
+    def _forget(self):
+        """Drops this object from the request identity map."""
+        objects = identity_map()
+        if objects is not None and self.objectId:
+            objects.pop((self.__class__.__name__, self.objectId), None)
+
+    def save(self):
+        op = self._save_op()
+        if op is None:
+            return
+        guards = self._guards()
+        if op['method'] == 'PUT':
             # Update
-            # Filter out system fields
-            data = {k: v for k, v in self._data.items() if k not in ['objectId', 'createdAt', 'updatedAt']}
-            client.update(self.__class__.__name__, self.objectId, data)
+            resp = client.update(self.__class__.__name__, self.objectId, op['body'])
         else:
             # Create
-            resp = client.create(self.__class__.__name__, self._data)
-            self.objectId = resp.get('objectId')
-            self.createdAt = resp.get('createdAt')
+            resp = client.create(self.__class__.__name__, op['body'])
+        self._apply_save_result(resp or {})
+        self._untrack()
+        _invalidate_caches([self.__class__])
+        _enforce_guards([(self, guards, resp or {})])
 
     def delete(self):
         if self.objectId:
             client.delete(self.__class__.__name__, self.objectId)
+            self._forget()
+            self._untrack()
+            _invalidate_caches([self.__class__])
+
+    def _untrack(self):
+        # Written directly: the session no longer needs to hold or flush the object
+        session = _current_session.get()
+        if session is not None:
+            session._discard([self])
+
+class Relation:
+    """Many-to-one relation resolved through a foreign id field.
+
+    ``Product.category = Relation('Category', 'category_id')`` loads the
+    Category whose objectId is stored in ``category_id``.
+    """
+    def __init__(self, model_name, key):
+        self.model_name = model_name
+        self.key = key
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    @property
+    def target(self):
+        return models[self.model_name]
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.name in instance._related:
+            return instance._related[self.name]
+        if instance._loaded is not None:
+            instance._ensure_loaded(self.key)
+        object_id = instance._data.get(self.key)
+        if not object_id:
+            return None
+        return self.target.query.get(object_id)
+
+    def prefetch(self, instances):
+        """Resolves the relation for all instances with get_many()."""
+        ids = []
+        for instance in instances:
+            if instance._loaded is not None:
+                instance._ensure_loaded(self.key)
+            if self.name not in instance._related:
+                ids.append(instance._data.get(self.key))
+        loaded = self.target.query.get_many(ids) if ids else {}
+
+        related = []
+        for instance in instances:
+            if self.name not in instance._related:
+                instance._related[self.name] = loaded.get(instance._data.get(self.key))
+            if instance._related[self.name] is not None:
+                related.append(instance._related[self.name])
+        return related
+
+class ReverseRelation:
+    """One-to-many relation: the objects whose ``key`` field holds this object's id.
+
+    ``User.products = ReverseRelation('Product', 'seller_id')`` lists the
+    products a user sells.
+    """
+    def __init__(self, model_name, key):
+        self.model_name = model_name
+        self.key = key
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    @property
+    def target(self):
+        return models[self.model_name]
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.name in instance._related:
+            return instance._related[self.name]
+        if not instance.id:
+            return []
+        return self.target.query.filter_by(**{self.key: instance.id}).limit(MAX_LIMIT).all()
+
+    def prefetch(self, instances):
+        """Loads the related lists of all instances with $in queries of IN_CHUNK_SIZE ids.
+
+        Each chunk is streamed with iter(), so no instance loses related rows
+        to the MAX_LIMIT cap of a single request.
+        """
+        pending = [i for i in instances if i.id and self.name not in i._related]
+        if pending:
+            ids = list(dict.fromkeys(i.id for i in pending))
+            grouped = {}
+            for start in range(0, len(ids), IN_CHUNK_SIZE):
+                chunk = ids[start:start + IN_CHUNK_SIZE]
+                query = self.target.query.filter(getattr(self.target, self.key).in_(chunk))
+                for obj in query.iter():
+                    grouped.setdefault(obj._data.get(self.key), []).append(obj)
+            for instance in pending:
+                instance._related[self.name] = grouped.get(instance.id, [])
+
+        related = []
+        for instance in instances:
+            related.extend(instance._related.get(self.name, []))
+        return related
+
+def prefetch(instances, *paths):
+    """Eagerly loads relations for a list of models.
+
+    Each path is a relation name, optionally dotted to follow nested relations
+    (``'product.category'``). Every level costs one $in query per IN_CHUNK_SIZE
+    instances.
+    """
+    for path in paths:
+        level = [i for i in instances if i is not None]
+        for name in path.split('.'):
+            if not level:
+                break
+            level = getattr(type(level[0]), name).prefetch(level)
+    return instances
 
 class QueryDescriptor:
     """Descriptor that returns a new Query instance each time it's accessed"""
@@ -196,11 +1184,117 @@ class QueryDescriptor:
 # Add query descriptor to BaseModel
 BaseModel.query = QueryDescriptor()
 
+_gather_executor = None
+_gather_executor_pid = None
+_gather_lock = threading.Lock()
+# Set inside gather() calls, which then run nested gathers inline
+_in_gather = contextvars.ContextVar('b4a_in_gather', default=False)
+
+def _executor():
+    global _gather_executor, _gather_executor_pid
+    # Pool threads do not survive a fork, so each worker process makes its own
+    if _gather_executor_pid != os.getpid():
+        with _gather_lock:
+            if _gather_executor_pid != os.getpid():
+                _gather_executor = ThreadPoolExecutor(GATHER_WORKERS, thread_name_prefix='b4a-gather')
+                _gather_executor_pid = os.getpid()
+    return _gather_executor
+
+def _run_gathered(context, call):
+    return context.run(_run_in_gather, call)
+
+def _run_in_gather(call):
+    _in_gather.set(True)
+    return call()
+
+def gather(*calls):
+    """Runs independent loads concurrently and returns their results in order.
+
+    Each call is a zero-argument callable, such as a lambda wrapping a query::
+
+        related, seller = gather(
+            lambda: Product.query.filter_by(category_id=cid).limit(4).all(),
+            lambda: User.query.get(product.seller_id),
+        )
+
+    The calls run on a per-process thread pool in a copy of the caller's
+    context, so they see the same Flask ``g``, session and identity map, and
+    the request pays roughly the slowest call's latency instead of the sum.
+    Use it for reads; writes should stay on the request thread with
+    db.session. If any call raises, the first exception (in call order) is
+    raised once all calls have finished.
+    """
+    if len(calls) < 2 or _in_gather.get():
+        return [call() for call in calls]
+    # Bind the caller's session first so every call's context copy shares it
+    db.session
+    executor = _executor()
+    futures = [executor.submit(_run_gathered, contextvars.copy_context(), call) for call in calls]
+    wait(futures)
+    return [future.result() for future in futures]
+
+class CommitError(Exception):
+    """Raised when some operations of a batched commit were rejected by Parse.
+
+    ``errors`` holds ``(obj, error)`` pairs; successful operations in the same
+    commit have already been applied and are not rolled back.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        details = ', '.join(
+            f"{obj.__class__.__name__}({obj.objectId or 'new'}): {error.get('error', error)}"
+            for obj, error in errors
+        )
+        super().__init__(f"{len(errors)} operation(s) failed during commit: {details}")
+
+class GuardError(CommitError):
+    """Raised when a guarded Increment would have pushed a field below its minimum.
+
+    All guarded increments of the failing save or commit have been reverted.
+    """
+
+def _invalidate_caches(model_classes):
+    """Drops cached rows and query results of classes that were just written."""
+    for model_class in set(model_classes):
+        if model_class._cache is not None:
+            model_class._cache.invalidate()
+        query_cache.invalidate(model_class.__name__)
+
+def _enforce_guards(saved):
+    """Reverts guarded increments if any of them crossed its minimum.
+
+    ``saved`` holds ``(obj, guards, response)`` for every successful save.
+    """
+    violations = []
+    for obj, guards, resp in saved:
+        for name, op in guards.items():
+            value = resp.get(name)
+            if value is not None and value < op.minimum:
+                violations.append((obj, {'field': name, 'error': f'{name} would drop below {op.minimum}'}))
+    if not violations:
+        return
+
+    revert_ops = []
+    for obj, guards, resp in saved:
+        if not guards:
+            continue
+        body = {name: Increment(-op.amount).to_parse() for name, op in guards.items()}
+        revert_ops.append({'method': 'PUT', 'path': f'classes/{obj.__class__.__name__}/{obj.objectId}', 'body': body})
+        for name, op in guards.items():
+            obj._set_local(name, (obj._get_local(name) or 0) - op.amount)
+    client.batch(revert_ops)
+    raise GuardError(violations)
+
 # Mock DB Session
 class Session:
     def __init__(self):
         self._new = []
         self._deleted = []
+        # Persisted objects with unsaved field changes, keyed by id()
+        self._dirty = {}
+
+    def _track(self, obj):
+        self._dirty[id(obj)] = obj
 
     def add(self, obj):
         self._new.append(obj)
@@ -209,24 +1303,109 @@ class Session:
         self._deleted.append(obj)
 
     def commit(self):
-        for obj in self._new:
-            obj.save()
-        for obj in self._deleted:
-            obj.delete()
-        self._new = []
-        self._deleted = []
+        """Flushes pending saves and deletes through Back4App /batch requests.
+
+        If the request fails the objects stay pending, so the commit can be retried.
+        """
+        pending_new, pending_deleted = self._new + list(self._dirty.values()), list(self._deleted)
+
+        ops = []
+        targets = []
+        seen = set()
+        for obj in pending_new:
+            if id(obj) in seen or obj in pending_deleted:
+                continue
+            seen.add(id(obj))
+            op = obj._save_op()
+            if op is None:
+                continue
+            ops.append(op)
+            targets.append(('save', obj))
+        for obj in pending_deleted:
+            if id(obj) in seen or not obj.objectId:
+                continue
+            seen.add(id(obj))
+            ops.append(obj._delete_op())
+            targets.append(('delete', obj))
+
+        if not ops:
+            self._discard(pending_new + pending_deleted)
+            return
+
+        guards = {id(obj): obj._guards() for action, obj in targets if action == 'save'}
+        results = client.batch(ops)
+        self._discard(pending_new + pending_deleted)
+        errors = []
+        saved = []
+        for (action, obj), result in zip(targets, results):
+            if 'error' in result:
+                obj._error = result['error']
+                errors.append((obj, result['error']))
+            elif action == 'save':
+                obj._error = None
+                success = result.get('success') or {}
+                obj._apply_save_result(success)
+                saved.append((obj, guards[id(obj)], success))
+            else:
+                obj._forget()
+        _invalidate_caches(obj.__class__ for action, obj in targets)
+        _enforce_guards(saved)
+        if errors:
+            raise CommitError(errors)
+
+    def _discard(self, objects):
+        """Drops flushed objects from the pending lists, keeping any added meanwhile."""
+        flushed = {id(obj) for obj in objects}
+        self._new = [obj for obj in self._new if id(obj) not in flushed]
+        self._deleted = [obj for obj in self._deleted if id(obj) not in flushed]
+        for key in flushed:
+            self._dirty.pop(key, None)
+
+    def flush(self):
+        """Writes pending objects so they get an objectId.
+
+        Back4App has no transactions, so flushed writes survive a later rollback().
+        """
+        self.commit()
         
     def rollback(self):
+        for obj in self._dirty.values():
+            obj._dirty.clear()
+            obj._ops.clear()
         self._new = []
         self._deleted = []
+        self._dirty = {}
+
+# The unit of work of the current request, thread or greenlet, see DB.session
+_current_session = contextvars.ContextVar('b4a_session', default=None)
 
 class DB:
     def __init__(self):
-        self.session = Session()
         self.Model = BaseModel
-        
+
+    @property
+    def session(self):
+        """Returns the Session of the current context, creating it on first use.
+
+        Each thread, greenlet and asyncio task has its own, so concurrent
+        requests in a threaded or gevent worker never flush each other's
+        objects. gather() calls share their caller's session.
+        """
+        session = _current_session.get()
+        if session is None:
+            session = Session()
+            _current_session.set(session)
+        return session
+
     def init_app(self, app):
-        pass
+        app.teardown_appcontext(self._end_session)
+
+    def _end_session(self, exc=None):
+        # Threads are reused across requests: drop whatever the request did not commit
+        session = _current_session.get()
+        if session is not None:
+            session.rollback()
+            _current_session.set(None)
         
     def create_all(self):
         pass # No schema creation needed for Parse
@@ -250,6 +1429,7 @@ db = DB()
 
 # Define Models mirroring models.py
 class User(BaseModel):
+    __slots__ = ()
     username = Field('username')
     email = Field('email')
     password_hash = Field('password_hash')
@@ -258,65 +1438,95 @@ class User(BaseModel):
     last_name = Field('last_name')
     phone = Field('phone')
     address = Field('address')
-    # ... other fields can be dynamic in NoSQL, so we don't strictly need to define them all if we use _data
-    # But for query filters to work with Field objects, we should define them.
-    
-    # We can use __getattr__ to handle dynamic fields for getting/setting, 
-    # but for class-level filtering (User.email == ...), we need the descriptors.
-    
-    # Let's define the ones used in queries
+    avatar_url = Field('avatar_url')
+    # Structured phone and address, edited on the profile page
+    phone_country_code = Field('phone_country_code')
+    phone_number = Field('phone_number')
+    address_line1 = Field('address_line1')
+    address_line2 = Field('address_line2')
+    city = Field('city')
+    state_province = Field('state_province')
+    postal_code = Field('postal_code')
+    country = Field('country')
+    # Seller company details
+    company_name = Field('company_name')
+    company_description = Field('company_description')
+    company_website = Field('company_website')
+    company_logo_url = Field('company_logo_url')
+    company_phone = Field('company_phone')
+    company_phone_country_code = Field('company_phone_country_code')
+    company_phone_number = Field('company_phone_number')
+    company_address = Field('company_address')
+    company_address_line1 = Field('company_address_line1')
+    company_address_line2 = Field('company_address_line2')
+    company_city = Field('company_city')
+    company_state_province = Field('company_state_province')
+    company_postal_code = Field('company_postal_code')
+    company_country = Field('company_country')
+
+    # In SQLAlchemy this was the Product.seller backref
+    products = ReverseRelation('Product', 'seller_id')
     
 class Category(BaseModel):
+    __slots__ = ()
+    cache_ttl = REFERENCE_CACHE_SECONDS
     name = Field('name')
     description = Field('description')
 
 class Product(BaseModel):
+    __slots__ = ()
+    query_cache_ttl = QUERY_CACHE_SECONDS
+    # What product cards and lists show, for Query.only(); leaves out search_terms and additional_images
+    list_fields = ('name', 'description', 'price', 'image_url', 'stock_quantity', 'status',
+                   'category_id', 'seller_id')
     name = Field('name')
     description = Field('description')
-    price = Field('price')
-    stock_quantity = Field('stock_quantity')
+    price = DecimalField('price')
+    stock_quantity = IntField('stock_quantity')
     image_url = Field('image_url')
     additional_images = Field('additional_images')
     status = Field('status')
     category_id = Field('category_id') # Storing ID as string now
     seller_id = Field('seller_id')
-    created_at = Field('createdAt') # Map to system field
+    view_count = IntField('view_count') # Kept up to date by view_buffer
+    search_terms = Field('search_terms') # Maintained by product_search
+    created_at = DateTimeField('createdAt') # Map to system field
+    seller = Relation('User', 'seller_id')
+    category = Relation('Category', 'category_id')
 
 class Order(BaseModel):
+    __slots__ = ()
     order_number = Field('order_number')
-    total_amount = Field('total_amount')
+    total_amount = DecimalField('total_amount')
     status = Field('status')
     user_id = Field('user_id')
+    created_at = DateTimeField('createdAt') # Map to system field
+    user = Relation('User', 'user_id')
+    order_items = ReverseRelation('OrderItem', 'order_id')
 
 class OrderItem(BaseModel):
-    quantity = Field('quantity')
-    price = Field('price')
+    __slots__ = ()
+    quantity = IntField('quantity')
+    price = DecimalField('price')
     order_id = Field('order_id')
     product_id = Field('product_id')
-    
-    @property
-    def product(self):
-        if self.product_id:
-            return Product.query.get(self.product_id)
-        return None
+    product = Relation('Product', 'product_id')
 
 class CartItem(BaseModel):
+    __slots__ = ()
     session_id = Field('session_id')
     product_id = Field('product_id')
-    quantity = Field('quantity')
+    quantity = IntField('quantity')
     save_for_later = Field('save_for_later')
-    
-    @property
-    def product(self):
-        if self.product_id:
-            return Product.query.get(self.product_id)
-        return None
+    product = Relation('Product', 'product_id')
 
 class Wishlist(BaseModel):
+    __slots__ = ()
     user_id = Field('user_id')
     product_id = Field('product_id')
 
 class ProductView(BaseModel):
+    __slots__ = ()
     user_id = Field('user_id')
     product_id = Field('product_id')
     view_type = Field('view_type')
@@ -324,27 +1534,40 @@ class ProductView(BaseModel):
     user_agent = Field('user_agent')
 
 class PasswordResetToken(BaseModel):
+    __slots__ = ()
     user_id = Field('user_id')
     token = Field('token')
-    expires_at = Field('expires_at') # Needs to handle datetime serialization
+    expires_at = DateTimeField('expires_at')
     used = Field('used')
 
-# Helper to handle relationships that were backrefs
-# In SQLAlchemy: product.seller
-# In here: we need to implement it manually or use a property
-# User.products -> Product.query.filter_by(seller_id=self.id).all()
-
-# Monkey patch or add methods to classes
-def get_products(self):
-    return Product.query.filter_by(seller_id=self.id).all()
-User.products = property(get_products)
-
-def get_seller(self):
-    return User.query.get(self.seller_id)
-Product.seller = property(get_seller)
+class SellerStats(BaseModel):
+    """Running totals for one seller, maintained by seller_stats.py."""
+    __slots__ = ()
+    seller_id = Field('seller_id')
+    total_revenue = Field('total_revenue')
+    total_orders = Field('total_orders')
+    total_customers = Field('total_customers') # Distinct buyers of the seller's products
+    total_views = Field('total_views')
+    total_wishlists = Field('total_wishlists')
+    daily_orders = Field('daily_orders') # {'YYYY-MM-DD': count}
+    daily_revenue = Field('daily_revenue') # {'YYYY-MM-DD': amount}
 
-def get_category(self):
-    return Category.query.get(self.category_id)
-Product.category = property(get_category)
+class SellerDailySales(BaseModel):
+    """Confirmed revenue and order count of one seller on one UTC day."""
+    __slots__ = ()
+    seller_id = Field('seller_id')
+    day = Field('day') # 'YYYY-MM-DD'
+    revenue = Field('revenue')
+    orders = Field('orders')
 
-# ... add others as needed
+class SellerOrder(BaseModel):
+    """One seller's share of an order, indexed for the seller order feed."""
+    __slots__ = ()
+    seller_id = Field('seller_id')
+    order_id = Field('order_id')
+    order_number = Field('order_number')
+    customer_id = Field('customer_id')
+    status = Field('status')
+    total_amount = DecimalField('total_amount') # Seller's items only
+    items = Field('items') # [{'id', 'product_id', 'quantity', 'price'}]
+    order_created_at = DateTimeField('order_created_at', iso_string=True) # Order's createdAt, used for ordering and cursors
@@ -0,0 +1,281 @@
+"""
+Product search index.
+
+/shop used to search with an unanchored case-insensitive $regex on the name,
+which Parse cannot serve from an index. Instead each product keeps its own
+inverted-index entries in Product.search_terms: the lowercased tokens of its
+name, description and category name, plus every prefix of the name and
+category tokens. A search is then one $all lookup on that array, which Back4App
+can serve from an index on search_terms (add it in the dashboard under
+Database > Product > Indexes).
+
+Terms are refreshed whenever a product is added or edited; run
+rebuild_search_index.py after changing category names or this tokenizer.
+
+Search-as-you-type suggestions come from SuggestionIndex, a prefix trie of
+active product names and category names held in memory by each worker. It is
+loaded once, updated in place when this worker changes a product, and
+reloaded in the background every BACK4APP_SUGGEST_REFRESH_SECONDS to pick up
+changes made by other workers.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from models_b4a import db, prefetch, MAX_LIMIT, Category, Product
+
+logger = logging.getLogger(__name__)
+
+# Tokens longer than this are cut; prefixes start at MIN_TOKEN_LENGTH characters
+MAX_TOKEN_LENGTH = 20
+MIN_TOKEN_LENGTH = 2
+
+# Upper bound on search_terms entries per product, to keep rows small
+MAX_TERMS = 400
+
+# Query tokens beyond this are ignored
+MAX_QUERY_TERMS = 5
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Splits text into lowercase alphanumeric tokens, in order, without duplicates."""
+    tokens = []
+    for token in _TOKEN_RE.findall((text or '').lower()):
+        token = token[:MAX_TOKEN_LENGTH]
+        if len(token) >= MIN_TOKEN_LENGTH and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def _prefixes(token):
+    return [token[:i] for i in range(MIN_TOKEN_LENGTH, len(token) + 1)]
+
+
+def index_terms(name, description=None, category_name=None):
+    """Returns the search_terms entries for a product's text.
+
+    Name and category prefixes are taken first; description tokens only fill
+    what is left of MAX_TERMS, so a long description never pushes out the name.
+    """
+    terms = {}
+    for token in tokenize(name) + tokenize(category_name):
+        for prefix in _prefixes(token):
+            terms.setdefault(prefix)
+    for token in tokenize(description):
+        terms.setdefault(token)
+    return sorted(list(terms)[:MAX_TERMS])
+
+
+def index_product(product):
+    """Refreshes product.search_terms from its current name, description and category."""
+    category = product.category
+    terms = index_terms(product.name, product.description, category.name if category else None)
+    if terms != product.search_terms:
+        product.search_terms = terms
+
+
+def search_criterion(text):
+    """Returns a Query.filter() criterion matching every token of ``text`` as a word or prefix.
+
+    Text without searchable tokens (``'a'``, ``'!'``) matches no product
+    rather than the whole catalog.
+    """
+    tokens = tokenize(text)[:MAX_QUERY_TERMS]
+    if not tokens:
+        return Product.objectId.in_([])
+    return Product.search_terms.contains_all(tokens)
+
+
+def _score(token, words, exact, prefix):
+    if token in words:
+        return exact
+    if any(word.startswith(token) for word in words):
+        return prefix
+    return 0
+
+
+def rank(products, text):
+    """Orders products by how well they match ``text``: name over category over description.
+
+    The sort is stable, so products with equal scores keep their order. Parse
+    cannot sort by this score, so /shop applies it to one page of results;
+    a better match on a later page stays there.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return list(products)
+
+    def score(product):
+        name = tokenize(product.name)
+        category = tokenize(product.category.name) if product.category else []
+        description = tokenize(product.description)
+        total = 0
+        for token in tokens:
+            total += _score(token, name, 3, 2)
+            total += _score(token, category, 1, 1)
+            total += _score(token, description, 1, 0)
+        # Whole-phrase match at the start of the name beats scattered tokens
+        if (product.name or '').lower().startswith(text.strip().lower()):
+            total += 2
+        return total
+
+    return sorted(products, key=score, reverse=True)
+
+
+def reindex_products(products):
+    """Refreshes search_terms for many products, saving the changed ones in one batch."""
+    prefetch(products, 'category')
+    for product in products:
+        index_product(product)
+    db.session.commit()
+    return len(products)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'keys')
+
+    def __init__(self):
+        self.children = {}
+        # Keys of the entries that have a word ending at this node
+        self.keys = set()
+
+
+class SuggestionIndex:
+    """Per-worker prefix trie of product and category names.
+
+    Every word of a name is indexed, so "lamp" suggests "Desk Lamp". Each
+    change bumps ``version``, which is returned with the suggestions.
+    """
+
+    def __init__(self, refresh_seconds=None):
+        self.refresh_seconds = refresh_seconds or float(os.environ.get('BACK4APP_SUGGEST_REFRESH_SECONDS', 300))
+        self.version = 0
+        self.loaded_at = None
+        self._root = _TrieNode()
+        # key -> (text, kind, object id, words)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._reloading = False
+
+    def add(self, key, text, kind, object_id):
+        """Adds or replaces the entry stored under ``key``."""
+        with self._lock:
+            self._remove(key)
+            words = tokenize(text)
+            self._entries[key] = (text, kind, object_id, words)
+            for word in words:
+                node = self._root
+                for char in word:
+                    node = node.children.setdefault(char, _TrieNode())
+                node.keys.add(key)
+            self.version += 1
+
+    def remove(self, key):
+        with self._lock:
+            if self._remove(key):
+                self.version += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for word in entry[3]:
+            node = self._root
+            for char in word:
+                node = node.children.get(char)
+                if node is None:
+                    break
+            else:
+                node.keys.discard(key)
+        return True
+
+    def suggest(self, text, limit=8):
+        """Returns up to ``limit`` suggestions for the prefix typed so far.
+
+        Every word typed must match a word of the name; the last one may be a
+        prefix. Shorter words (closer matches) come first.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        # add(), remove() and reload() change the trie and entries from other threads
+        with self._lock:
+            candidates = None
+            for token in tokens[:-1]:
+                keys = self._keys_for(token, exact=True)
+                candidates = keys if candidates is None else candidates & keys
+            candidates_last = self._keys_for(tokens[-1], exact=False)
+            candidates = candidates_last if candidates is None else candidates & candidates_last
+            entries = [self._entries[key] for key in candidates]
+
+        results = []
+        seen = set()
+        for text, kind, object_id, _ in sorted(entries, key=lambda entry: (entry[1] != 'category', len(entry[0]))):
+            if (kind, text.lower()) in seen:
+                continue
+            seen.add((kind, text.lower()))
+            results.append({'text': text, 'type': kind, 'id': object_id})
+            if len(results) >= limit:
+                break
+        return results
+
+    def _keys_for(self, token, exact):
+        node = self._root
+        for char in token:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        if exact:
+            return set(node.keys)
+        keys = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            keys |= node.keys
+            stack.extend(node.children.values())
+        return keys
+
+    def update_product(self, product):
+        """Indexes a product after it is added or edited; inactive products are removed."""
+        if product.status == 'active' and product.name:
+            self.add(('product', product.id), product.name, 'product', product.id)
+        else:
+            self.remove(('product', product.id))
+
+    def remove_product(self, product_id):
+        self.remove(('product', product_id))
+
+    def ensure_loaded(self):
+        """Loads the index on first use and starts a background reload once it is stale."""
+        if self.loaded_at is None:
+            self.reload()
+        elif time.monotonic() - self.loaded_at > self.refresh_seconds and not self._reloading:
+            self._reloading = True
+            threading.Thread(target=self.reload, name='suggest-reload', daemon=True).start()
+
+    def reload(self):
+        """Rebuilds the index from Back4App and swaps it in."""
+        try:
+            fresh = SuggestionIndex(self.refresh_seconds)
+            for category in Category.query.limit(MAX_LIMIT).all():
+                if category.name:
+                    fresh.add(('category', category.id), category.name, 'category', category.id)
+            for product in Product.query.filter_by(status='active').only('name', 'status').iter():
+                fresh.update_product(product)
+            with self._lock:
+                self._root, self._entries = fresh._root, fresh._entries
+                self.version += 1
+                self.loaded_at = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Failed to load search suggestions: {e}")
+            if self.loaded_at is None:
+                raise
+        finally:
+            self._reloading = False
+
+
+suggestions = SuggestionIndex()
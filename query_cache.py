@@ -0,0 +1,193 @@
+"""
+Shared cache for query results.
+
+Query.cached() stores the raw results of a query (or its count) under a key
+made of the class name, where, order, limit, skip and projected keys. Entries expire after
+the model's query_cache_ttl, and every save or delete of a class drops all
+entries for that class.
+
+The backend is chosen with BACK4APP_QUERY_CACHE:
+
+- ``local`` (default): an in-process LRU, one per worker
+- ``sqlite:/path/to/file.sqlite3``: a SQLite file shared by every worker on
+  the host, so one worker's results are reused by the others and writes
+  invalidate them for everyone
+- ``none``: caching disabled
+
+Both backends hold at most BACK4APP_QUERY_CACHE_SIZE entries. Expired
+entries stay until they are evicted or invalidated, so a cached query can
+still be answered with its last results while Back4App is unreachable.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """In-process LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stale=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            class_name, value, expires = entry
+            if expires < time.time() and not stale:
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, class_name, value, ttl):
+        with self._lock:
+            self._entries[key] = (class_name, value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, class_name):
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] == class_name]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """Cache in a SQLite file shared by all worker processes on a host.
+
+    Eviction drops expired entries first, then the least recently stored.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    @property
+    def _conn(self):
+        # sqlite3 connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS query_cache ('
+                'key TEXT PRIMARY KEY, class_name TEXT, value TEXT, expires REAL, stored REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS query_cache_class ON query_cache (class_name)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key, stale=False):
+        row = self._conn.execute(
+            'SELECT value FROM query_cache WHERE key = ? AND expires >= ?', (key, 0 if stale else time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, class_name, value, ttl):
+        now = time.time()
+        conn = self._conn
+        conn.execute(
+            'INSERT OR REPLACE INTO query_cache (key, class_name, value, expires, stored) VALUES (?, ?, ?, ?, ?)',
+            (key, class_name, value, now + ttl, now)
+        )
+        (count,) = conn.execute('SELECT COUNT(*) FROM query_cache').fetchone()
+        if count > self.max_entries:
+            conn.execute('DELETE FROM query_cache WHERE expires < ?', (now,))
+            conn.execute(
+                'DELETE FROM query_cache WHERE key IN '
+                '(SELECT key FROM query_cache ORDER BY stored LIMIT MAX(0, (SELECT COUNT(*) FROM query_cache) - ?))',
+                (self.max_entries,)
+            )
+
+    def invalidate(self, class_name):
+        self._conn.execute('DELETE FROM query_cache WHERE class_name = ?', (class_name,))
+
+    def clear(self):
+        self._conn.execute('DELETE FROM query_cache')
+
+
+class QueryCache:
+    """Front end over a backend: builds keys, (de)serializes results and counts hits."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    @staticmethod
+    def key(class_name, kind, where, order, limit, skip, keys=None):
+        raw = json.dumps([class_name, kind, where, order, limit, skip, keys], sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key, stale=False):
+        """Returns the cached value, or None on a miss or backend failure.
+
+        With ``stale=True`` expired entries are returned too; that is the
+        fallback used when Back4App cannot be reached.
+        """
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key, stale=stale)
+        except Exception as e:
+            logger.warning(f"Query cache read failed: {e}")
+            value = None
+        if stale:
+            if value is not None:
+                self.stale_hits += 1
+        elif value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, class_name, value, ttl):
+        if self.backend is None or not ttl:
+            return
+        try:
+            self.backend.set(key, class_name, json.dumps(value, default=str), ttl)
+        except Exception as e:
+            logger.warning(f"Query cache write failed: {e}")
+
+    def invalidate(self, class_name):
+        if self.backend is None:
+            return
+        try:
+            self.backend.invalidate(class_name)
+        except Exception as e:
+            logger.warning(f"Query cache invalidation failed for {class_name}: {e}")
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits
+        }
+
+
+def backend_from_env():
+    """Builds the backend named by BACK4APP_QUERY_CACHE."""
+    setting = os.environ.get('BACK4APP_QUERY_CACHE', 'local')
+    max_entries = int(os.environ.get('BACK4APP_QUERY_CACHE_SIZE', 1000))
+    if setting == 'none':
+        return None
+    if setting.startswith('sqlite:'):
+        return SQLiteCache(setting[len('sqlite:'):], max_entries)
+    return LocalCache(max_entries)
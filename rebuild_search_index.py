@@ -0,0 +1,33 @@
+"""
+Script to rebuild Product.search_terms for every product, e.g. after
+renaming categories or changing the tokenizer in product_search.py
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+from itertools import islice
+
+from models_b4a import MAX_LIMIT, Product
+from product_search import reindex_products
+
+print("=" * 60)
+print("REBUILDING PRODUCT SEARCH INDEX")
+print("=" * 60)
+
+# Stream the catalog so only one batch of products is in memory at a time
+products = Product.query.order_by('createdAt').iter()
+indexed = 0
+try:
+    while True:
+        batch = list(islice(products, MAX_LIMIT))
+        if not batch:
+            break
+        indexed += reindex_products(batch)
+        print(f"   Indexed {indexed} products...")
+    print(f"   ✅ Indexed {indexed} products")
+except Exception as e:
+    print(f"   ❌ Failed to rebuild search index after {indexed} products: {e}")
+
+print("\n" + "=" * 60)
+print("COMPLETE")
+print("=" * 60)
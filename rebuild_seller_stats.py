@@ -0,0 +1,37 @@
+"""
+Script to rebuild SellerStats, the SellerDailySales rollup, the SellerOrder
+feed and Product.view_count for every seller from the raw order, view and
+wishlist data
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+from models_b4a import User
+from seller_stats import (
+    rebuild_seller_stats, rebuild_daily_sales, rebuild_seller_orders, rebuild_product_view_counts
+)
+
+print("=" * 60)
+print("REBUILDING SELLER STATS")
+print("=" * 60)
+
+sellers = list(User.query.filter_by(role='seller').only().iter())
+print(f"\n   Found {len(sellers)} sellers")
+
+rebuilt_count = 0
+for seller in sellers:
+    try:
+        stats = rebuild_seller_stats(seller.id)
+        sales_days = rebuild_daily_sales(seller.id)
+        rebuild_seller_orders(seller.id)
+        rebuild_product_view_counts(seller.id)
+        print(f"   ✅ {seller.username}: {stats.total_orders} orders, "
+              f"${stats.total_revenue:.2f} revenue, {stats.total_views} views, "
+              f"{sales_days} days with sales")
+        rebuilt_count += 1
+    except Exception as e:
+        print(f"   ❌ Failed to rebuild stats for {seller.username}: {e}")
+
+print("\n" + "=" * 60)
+print(f"COMPLETE: Rebuilt stats for {rebuilt_count} sellers")
+print("=" * 60)
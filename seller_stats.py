@@ -0,0 +1,435 @@
+"""
+Pre-aggregated seller statistics.
+
+The seller dashboard used to scan every Order, OrderItem, Wishlist and
+ProductView on each load. Instead, a SellerStats row per seller is kept up
+to date with atomic increments whenever an order, view or wishlist entry is
+written, and the dashboard reads that row. Concurrent first writes can create
+more than one row for a seller; reads add them up and the rebuild merges them.
+
+The sales trend chart reads SellerDailySales, a per-seller, per-day rollup of
+confirmed orders that is adjusted when orders are placed or cancelled.
+
+The seller order feed reads SellerOrder, one row per seller per order, so it
+can be queried by seller with server-side ordering and a cursor.
+
+The rebuild_* functions recompute all of these from the raw rows; sums and
+per-product counts are grouped in Back4App with Query.group_by().
+"""
+import logging
+from datetime import datetime
+
+from models_b4a import (
+    db, gather, prefetch, Increment, Sum, IN_CHUNK_SIZE, MAX_LIMIT, SellerStats, SellerDailySales, SellerOrder, Product, Order, OrderItem,
+    Wishlist, ProductView
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Order statuses that count as sales in the trend rollup
+SUCCESSFUL_STATUSES = ['confirmed', 'processing', 'shipped', 'delivered']
+
+# Largest page the seller order feed will return
+MAX_ORDERS_PAGE = 50
+
+
+def day_key(value=None):
+    """Returns the UTC 'YYYY-MM-DD' bucket for a datetime or a Parse ISO date string."""
+    if value is None:
+        value = datetime.utcnow()
+    elif isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.strftime('%Y-%m-%d')
+
+
+def _new_stats(seller_id, total_views=0):
+    return SellerStats(
+        seller_id=seller_id,
+        total_revenue=0,
+        total_orders=0,
+        total_customers=0,
+        total_views=total_views,
+        total_wishlists=0,
+        daily_orders={},
+        daily_revenue={}
+    )
+
+
+# SellerStats fields that hold running totals, summed when a seller has several rows
+_COUNTERS = ('total_revenue', 'total_orders', 'total_customers', 'total_views', 'total_wishlists')
+_DAILY_COUNTERS = ('daily_orders', 'daily_revenue')
+
+
+def _stats_rows(seller_id):
+    return SellerStats.query.filter_by(seller_id=seller_id).limit(MAX_LIMIT).all()
+
+
+def _merge_stats(seller_id, rows):
+    """Returns one SellerStats holding the sum of a seller's rows.
+
+    Rows are created by whichever writer first needs one, and Parse has no
+    unique constraint, so concurrent first writes can leave a seller with
+    several rows that each hold part of the counts. The merged object is
+    unsaved; rebuild_seller_stats() folds the rows back into one.
+    """
+    if len(rows) == 1:
+        return rows[0]
+    merged = _new_stats(seller_id)
+    for row in rows:
+        for field in _COUNTERS:
+            setattr(merged, field, getattr(merged, field) + (getattr(row, field) or 0))
+        for field in _DAILY_COUNTERS:
+            totals = getattr(merged, field)
+            for day, amount in (getattr(row, field) or {}).items():
+                totals[day] = totals.get(day, 0) + amount
+    return merged
+
+
+def get_seller_stats(seller_id):
+    """Returns a seller's stats, summed over all of its rows, or an unsaved empty row."""
+    return _merge_stats(seller_id, _stats_rows(seller_id))
+
+
+def stats_for_sellers(seller_ids):
+    """Returns {seller_id: SellerStats}, adding new rows to the session for sellers without one."""
+    seller_ids = {seller_id for seller_id in seller_ids if seller_id}
+    stats = {}
+    if not seller_ids:
+        return stats
+    # Any of a seller's rows can take the increments; reads add them up
+    rows = SellerStats.query.filter(SellerStats.seller_id.in_(seller_ids)).limit(MAX_LIMIT).all()
+    for row in rows:
+        stats.setdefault(row.seller_id, row)
+    for seller_id in seller_ids - set(stats):
+        stats[seller_id] = _new_stats(seller_id)
+        db.session.add(stats[seller_id])
+    return stats
+
+
+def _chunks(ids):
+    """Splits ids into lists of IN_CHUNK_SIZE, so $in queries stay under URL length limits."""
+    ids = list(ids)
+    return [ids[i:i + IN_CHUNK_SIZE] for i in range(0, len(ids), IN_CHUNK_SIZE)]
+
+
+def _new_customer_sellers(customer_id, seller_ids):
+    """Returns the sellers ``customer_id`` has not bought from before, according to SellerOrder."""
+    if not customer_id:
+        return set()
+    seller_ids = list(seller_ids)
+    earlier = gather(*[
+        lambda seller_id=seller_id: SellerOrder.query.filter_by(seller_id=seller_id, customer_id=customer_id).only().first()
+        for seller_id in seller_ids
+    ])
+    return {seller_id for seller_id, row in zip(seller_ids, earlier) if row is None}
+
+
+def _revenue_by_seller(order_items):
+    revenue_by_seller = {}
+    for item in order_items:
+        product = item.product
+        if product is None or not product.seller_id:
+            continue
+        revenue = float(item.price * item.quantity)
+        revenue_by_seller[product.seller_id] = revenue_by_seller.get(product.seller_id, 0) + revenue
+    return revenue_by_seller
+
+
+def daily_sales_for_sellers(seller_ids, day):
+    """Returns {seller_id: SellerDailySales} for one day, adding missing rows to the session."""
+    seller_ids = {seller_id for seller_id in seller_ids if seller_id}
+    rows = {}
+    if not seller_ids:
+        return rows
+    query = SellerDailySales.query.filter(SellerDailySales.seller_id.in_(seller_ids)).filter_by(day=day)
+    # A seller may have duplicate rows for the day (see daily_sales()); any one takes the increments
+    for row in query.limit(MAX_LIMIT).all():
+        rows.setdefault(row.seller_id, row)
+    for seller_id in seller_ids - set(rows):
+        rows[seller_id] = SellerDailySales(seller_id=seller_id, day=day, revenue=0, orders=0)
+        db.session.add(rows[seller_id])
+    return rows
+
+
+def _record_daily_sales(order, revenue_by_seller, sign):
+    day = day_key(order.createdAt)
+    for seller_id, row in daily_sales_for_sellers(revenue_by_seller, day).items():
+        row.increment('revenue', sign * revenue_by_seller[seller_id])
+        row.increment('orders', sign)
+
+
+def _seller_orders_for(order, order_items):
+    """Builds the SellerOrder index rows for an order, one per seller."""
+    rows = {}
+    for item in order_items:
+        product = item.product
+        if product is None or not product.seller_id:
+            continue
+        row = rows.get(product.seller_id)
+        if row is None:
+            row = rows[product.seller_id] = SellerOrder(
+                seller_id=product.seller_id,
+                order_id=order.id,
+                order_number=order.order_number,
+                customer_id=order.user_id,
+                status=order.status,
+                total_amount=0,
+                items=[],
+                order_created_at=order.createdAt
+            )
+        row.items.append({
+            'id': item.id,
+            'product_id': item.product_id,
+            'quantity': item.quantity,
+            'price': float(item.price)
+        })
+        row.total_amount += item.price * item.quantity
+    return list(rows.values())
+
+
+def record_order(order, order_items):
+    """Adds a newly placed order to the stats, daily sales and order feed of every seller it contains."""
+    try:
+        revenue_by_seller = _revenue_by_seller(order_items)
+        # Checked before this order's own SellerOrder rows are written
+        new_customer_sellers = _new_customer_sellers(order.user_id, revenue_by_seller)
+        for row in _seller_orders_for(order, order_items):
+            db.session.add(row)
+
+        day = day_key(order.createdAt)
+        for seller_id, stats in stats_for_sellers(revenue_by_seller).items():
+            revenue = revenue_by_seller[seller_id]
+            stats.increment('total_revenue', revenue)
+            stats.increment('total_orders', 1)
+            stats.increment(f'daily_orders.{day}', 1)
+            stats.increment(f'daily_revenue.{day}', revenue)
+            if seller_id in new_customer_sellers:
+                stats.increment('total_customers', 1)
+        if order.status in SUCCESSFUL_STATUSES:
+            _record_daily_sales(order, revenue_by_seller, 1)
+        db.session.commit()
+    except Exception as e:
+        # Stats are rebuilt by rebuild_seller_stats.py; never fail the order for them
+        logger.warning(f"Failed to update seller stats for order {order.id}: {e}")
+
+
+def record_order_cancelled(order, order_items):
+    """Takes a cancelled order out of the daily sales of its sellers."""
+    try:
+        _record_daily_sales(order, _revenue_by_seller(order_items), -1)
+        db.session.commit()
+    except Exception as e:
+        logger.warning(f"Failed to update daily sales for cancelled order {order.id}: {e}")
+
+
+def record_order_status(order):
+    """Copies an order's new status to its SellerOrder rows."""
+    try:
+        for row in SellerOrder.query.filter_by(order_id=order.id).limit(MAX_LIMIT).all():
+            row.status = order.status
+        db.session.commit()
+    except Exception as e:
+        logger.warning(f"Failed to update seller order status for order {order.id}: {e}")
+
+
+def seller_order_feed(seller_id, before=None, limit=20):
+    """Returns one page of a seller's orders, newest first.
+
+    ``before`` is the cursor returned with the previous page; the result is
+    ``(rows, next_cursor)`` with ``next_cursor`` None on the last page. The
+    cursor holds the order date and objectId of the last row, so orders placed
+    in the same millisecond are neither skipped nor repeated.
+    """
+    limit = max(1, min(limit, MAX_ORDERS_PAGE))
+    page = (
+        SellerOrder.query.filter_by(seller_id=seller_id)
+        .order_by(SellerOrder.order_created_at.desc())
+        .keyset_paginate(after=before, per_page=limit)
+    )
+    return page.items, page.next_cursor
+
+
+def daily_sales(seller_id, start_date, end_date):
+    """Returns {'YYYY-MM-DD': SellerDailySales} for a seller between two dates, inclusive.
+
+    A seller's first orders of a day can each create a row for that day, as
+    Parse has no unique constraint; such rows are summed into one unsaved row.
+    """
+    query = (
+        SellerDailySales.query.filter_by(seller_id=seller_id)
+        .filter(SellerDailySales.day >= day_key(start_date), SellerDailySales.day <= day_key(end_date))
+    )
+    sales = {}
+    for row in query.iter():
+        total = sales.get(row.day)
+        if total is None:
+            sales[row.day] = row
+            continue
+        if total.objectId:
+            total = sales[row.day] = SellerDailySales(
+                seller_id=seller_id, day=row.day, revenue=total.revenue or 0, orders=total.orders or 0
+            )
+        total.revenue += row.revenue or 0
+        total.orders += row.orders or 0
+    return sales
+
+
+def view_ops(views_by_seller):
+    """Returns batch operations adding {seller_id: views} to SellerStats.
+
+    Builds the operations directly rather than going through db.session, so
+    the view buffer can call it from its own thread.
+    """
+    views_by_seller = {seller_id: n for seller_id, n in views_by_seller.items() if seller_id}
+    if not views_by_seller:
+        return []
+    query = SellerStats.query.filter(SellerStats.seller_id.in_(list(views_by_seller)))
+    existing = {}
+    for row in query.limit(MAX_LIMIT).all():
+        existing.setdefault(row.seller_id, row)
+    ops = []
+    for seller_id, views in views_by_seller.items():
+        row = existing.get(seller_id)
+        if row is None:
+            ops.append(_new_stats(seller_id, total_views=views)._save_op())
+        else:
+            body = {'total_views': Increment(views).to_parse()}
+            ops.append({'method': 'PUT', 'path': f'classes/SellerStats/{row.id}', 'body': body})
+    return ops
+
+
+def record_wishlist_change(seller_id, delta):
+    """Adjusts a seller's wishlist count by ``delta`` (+1 on add, -1 on remove)."""
+    _record(seller_id, 'total_wishlists', delta)
+
+
+def _record(seller_id, field, amount):
+    if not seller_id:
+        return
+    try:
+        stats_for_sellers([seller_id])[seller_id].increment(field, amount)
+        db.session.commit()
+    except Exception as e:
+        logger.warning(f"Failed to update {field} for seller {seller_id}: {e}")
+
+
+def _revenue_by_order(product_ids):
+    """Returns {order_id: revenue from these products}, summed by Back4App."""
+    revenue_by_order = {}
+    for chunk in _chunks(product_ids):
+        totals = OrderItem.query.filter(OrderItem.product_id.in_(chunk)).group_by(
+            'order_id', revenue=Sum('price', 'quantity')
+        )
+        for order_id, total in totals.items():
+            revenue_by_order[order_id] = revenue_by_order.get(order_id, 0) + total['revenue']
+    return revenue_by_order
+
+
+def _orders(order_ids, *fields):
+    """Yields the orders with these ids, fetching only ``fields``."""
+    for chunk in _chunks(order_ids):
+        yield from Order.query.filter(Order.objectId.in_(chunk)).only(*fields).iter()
+
+
+def _count_in(model_class, field, ids):
+    """Counts the rows of a class whose ``field`` is one of ``ids``."""
+    return sum(model_class.query.filter(getattr(model_class, field).in_(chunk)).count() for chunk in _chunks(ids))
+
+
+def rebuild_seller_stats(seller_id):
+    """Recomputes a seller's stats from the raw Order, Wishlist and ProductView rows."""
+    product_ids = [p.id for p in Product.query.filter_by(seller_id=seller_id).only().iter()]
+    rows = _stats_rows(seller_id)
+    stats = rows[0] if rows else _new_stats(seller_id)
+    # Fold duplicate rows left by concurrent first writes into the first one
+    for row in rows[1:]:
+        db.session.delete(row)
+
+    revenue_by_order = _revenue_by_order(product_ids)
+
+    customer_ids = set()
+    daily_orders = {}
+    daily_revenue = {}
+    for order in _orders(revenue_by_order, 'user_id'):
+        if order.user_id:
+            customer_ids.add(order.user_id)
+        if order.createdAt:
+            day = day_key(order.createdAt)
+            daily_orders[day] = daily_orders.get(day, 0) + 1
+            daily_revenue[day] = daily_revenue.get(day, 0) + revenue_by_order[order.id]
+
+    stats.total_revenue = sum(revenue_by_order.values())
+    stats.total_orders = len(revenue_by_order)
+    stats.total_customers = len(customer_ids)
+    stats.daily_orders = daily_orders
+    stats.daily_revenue = daily_revenue
+    stats.total_views = _count_in(ProductView, 'product_id', product_ids)
+    stats.total_wishlists = _count_in(Wishlist, 'product_id', product_ids)
+    db.session.add(stats)
+    db.session.commit()
+    return stats
+
+
+def rebuild_daily_sales(seller_id):
+    """Recomputes a seller's SellerDailySales rows from the raw orders."""
+    product_ids = [p.id for p in Product.query.filter_by(seller_id=seller_id).only().iter()]
+
+    revenue_by_order = _revenue_by_order(product_ids)
+
+    totals = {}
+    for order in _orders(revenue_by_order, 'status'):
+        if order.status not in SUCCESSFUL_STATUSES or not order.createdAt:
+            continue
+        revenue, count = totals.get(day_key(order.createdAt), (0, 0))
+        totals[day_key(order.createdAt)] = (revenue + revenue_by_order[order.id], count + 1)
+
+    rows = {}
+    for row in SellerDailySales.query.filter_by(seller_id=seller_id).iter():
+        if row.day in rows:
+            # Fold duplicate rows for a day into one
+            db.session.delete(row)
+        else:
+            rows[row.day] = row
+    for day in set(rows) | set(totals):
+        row = rows.get(day)
+        if row is None:
+            row = SellerDailySales(seller_id=seller_id, day=day)
+            db.session.add(row)
+        row.revenue, row.orders = totals.get(day, (0, 0))
+    db.session.commit()
+    return len(totals)
+
+
+def rebuild_product_view_counts(seller_id):
+    """Resets Product.view_count for a seller's products from the raw ProductView rows."""
+    products = list(Product.query.filter_by(seller_id=seller_id).only('view_count').iter())
+    counts = {}
+    # One grouped count per chunk of products instead of a count query per product
+    for chunk in _chunks(p.id for p in products):
+        counts.update(ProductView.query.filter(ProductView.product_id.in_(chunk)).group_by('product_id'))
+    for product in products:
+        view_count = counts.get(product.id, {}).get('count', 0)
+        if product.view_count != view_count:
+            product.view_count = view_count
+    db.session.commit()
+    return sum(product.view_count or 0 for product in products)
+
+
+def rebuild_seller_orders(seller_id):
+    """Recreates a seller's SellerOrder rows from the raw orders."""
+    product_ids = [p.id for p in Product.query.filter_by(seller_id=seller_id).only().iter()]
+    items_by_order = {}
+    for chunk in _chunks(product_ids):
+        items = list(OrderItem.query.filter(OrderItem.product_id.in_(chunk)).iter())
+        for item in prefetch(items, 'product'):
+            items_by_order.setdefault(item.order_id, []).append(item)
+
+    for row in SellerOrder.query.filter_by(seller_id=seller_id).iter():
+        db.session.delete(row)
+    for chunk in _chunks(items_by_order):
+        for order in Order.query.filter(Order.objectId.in_(chunk)).iter():
+            for row in _seller_orders_for(order, items_by_order[order.id]):
+                db.session.add(row)
+    db.session.commit()
+    return len(items_by_order)
@@ -0,0 +1,371 @@
+"""
+Unit tests for Back4AppClient against a local stand-in for parseapi.
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from back4app_client import Back4AppClient, Back4AppUnavailable, CircuitBreaker
+
+
+class FakeParseHandler(BaseHTTPRequestHandler):
+    """Minimal keep-alive HTTP handler that echoes Parse-style JSON."""
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _fail_flaky(self):
+        """Answers requests to /classes/Flaky with server.flaky_status while server.flaky_failures lasts."""
+        if '/classes/Flaky' not in self.path or self.server.flaky_failures <= 0:
+            return False
+        self.server.flaky_failures -= 1
+        body = json.dumps({'code': 1, 'error': 'Service unavailable.'}).encode('utf-8')
+        self.send_response(self.server.flaky_status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.retry_after is not None:
+            self.send_header('Retry-After', self.server.retry_after)
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def do_GET(self):
+        self.server.calls.append(('GET', self.path, None))
+        if self._fail_flaky():
+            return
+        if self.path.startswith('/classes/Slow'):
+            time.sleep(0.2)
+        if self.path.startswith('/classes/Broken'):
+            time.sleep(0.2)
+            self._send_json(500, {'code': 1, 'error': 'Internal server error.'})
+        elif self.path.startswith('/classes/Missing/'):
+            self._send_json(404, {'code': 101, 'error': 'Object not found.'})
+        else:
+            self._send_json(200, {'results': [], 'objectId': 'abc'})
+
+    def do_POST(self):
+        body = self._read_json()
+        self.server.calls.append(('POST', self.path, body))
+        if self._fail_flaky():
+            return
+        if self.path.endswith('/batch'):
+            self._send_json(200, [{'success': {'objectId': f'obj{i}'}} for i, _ in enumerate(body['requests'])])
+            return
+        self._send_json(201, {'objectId': 'new1', 'createdAt': '2025-01-01T00:00:00.000Z'})
+
+    def do_PUT(self):
+        body = self._read_json()
+        self.server.calls.append(('PUT', self.path, body))
+        if self._fail_flaky():
+            return
+        self._send_json(200, {'updatedAt': '2025-01-01T00:00:00.000Z'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def parse_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeParseHandler)
+    server.calls = []
+    server.flaky_failures = 0
+    server.flaky_status = 503
+    server.retry_after = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(parse_server, monkeypatch):
+    monkeypatch.setenv('BACK4APP_APP_ID', 'test-app-id')
+    monkeypatch.setenv('BACK4APP_MASTER_KEY', 'test-master-key')
+    monkeypatch.setenv('BACK4APP_API_URL', f'http://127.0.0.1:{parse_server.server_port}/')
+    client = Back4AppClient(pool_maxsize=2)
+    yield client
+    client.close()
+
+
+class TestConnectionPool:
+    """Tests for the pooled keep-alive session."""
+
+    def test_pool_settings_from_environment(self, monkeypatch):
+        monkeypatch.setenv('BACK4APP_APP_ID', 'test-app-id')
+        monkeypatch.setenv('BACK4APP_MASTER_KEY', 'test-master-key')
+        monkeypatch.setenv('BACK4APP_POOL_MAXSIZE', '25')
+        monkeypatch.setenv('BACK4APP_READ_TIMEOUT', '7')
+
+        client = Back4AppClient()
+
+        assert client.pool_maxsize == 25
+        assert client.timeout[1] == 7.0
+
+    def test_session_is_reused_across_calls(self, client):
+        assert client.session is client.session
+
+    def test_connections_are_kept_alive(self, client):
+        for _ in range(5):
+            client.query('Product', limit=1)
+        client.get('Product', 'abc')
+        client.update('Product', 'abc', {'status': 'active'})
+
+        stats = client.pool_stats()
+        assert stats['checkouts'] == 7
+        assert stats['connections'] == 1
+        assert stats['reuse_ratio'] == pytest.approx(6 / 7)
+
+    def test_missing_object_returns_none(self, client):
+        assert client.get('Missing', 'nope') is None
+
+    def test_session_recreated_after_fork(self, client, monkeypatch):
+        first = client.session
+        monkeypatch.setattr(os, 'getpid', lambda: -1)
+        assert client.session is not first
+
+
+class TestBatch:
+    """Tests for Back4AppClient.batch()."""
+
+    def test_batch_is_chunked(self, client, parse_server):
+        ops = [{'method': 'POST', 'path': 'classes/OrderItem', 'body': {'quantity': i}} for i in range(120)]
+
+        results = client.batch(ops)
+
+        batch_calls = [c for c in parse_server.calls if c[1] == '/batch']
+        assert [len(c[2]['requests']) for c in batch_calls] == [50, 50, 20]
+        assert len(results) == 120
+        assert all('success' in r for r in results)
+
+    def test_batch_paths_include_mount_path(self, parse_server, monkeypatch):
+        monkeypatch.setenv('BACK4APP_APP_ID', 'test-app-id')
+        monkeypatch.setenv('BACK4APP_MASTER_KEY', 'test-master-key')
+        monkeypatch.setenv('BACK4APP_API_URL', f'http://127.0.0.1:{parse_server.server_port}/parse/')
+        client = Back4AppClient()
+
+        client.batch([{'method': 'DELETE', 'path': 'classes/CartItem/abc'}])
+
+        method, path, body = parse_server.calls[-1]
+        assert path == '/parse/batch'
+        assert body == {'requests': [{'method': 'DELETE', 'path': '/parse/classes/CartItem/abc'}]}
+        client.close()
+
+
+class TestAggregate:
+    """Tests for the /aggregate endpoint."""
+
+    def test_pipeline_is_sent_as_json(self, client, parse_server):
+        pipeline = [{'$group': {'_id': '$order_id', 'count': {'$sum': 1}}}]
+        client.aggregate('OrderItem', pipeline)
+
+        method, path, _ = parse_server.calls[0]
+        assert method == 'GET'
+        assert path.startswith('/aggregate/OrderItem?pipeline=')
+        assert json.loads(parse_qs(urlparse(path).query)['pipeline'][0]) == pipeline
+
+    def test_requires_master_key(self, client, monkeypatch):
+        assert client.can_aggregate
+        monkeypatch.delenv('BACK4APP_MASTER_KEY')
+        monkeypatch.setenv('BACK4APP_CLIENT_KEY', 'test-client-key')
+        assert not Back4AppClient().can_aggregate
+
+
+class TestSingleFlight:
+    """Tests for coalescing identical concurrent reads."""
+
+    def _concurrently(self, count, fn):
+        results = [None] * count
+        errors = [None] * count
+
+        def run(i):
+            try:
+                results[i] = fn()
+            except Exception as e:
+                errors[i] = e
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_identical_reads_share_one_request(self, client, parse_server):
+        results, _ = self._concurrently(5, lambda: client.query('Slow', where={'status': 'active'}, limit=8))
+
+        assert len([c for c in parse_server.calls if c[1].startswith('/classes/Slow')]) == 1
+        assert all(r == {'results': [], 'objectId': 'abc'} for r in results)
+        assert len({id(r) for r in results}) == 5
+        stats = client.flight_stats()
+        assert (stats['reads'], stats['coalesced'], stats['in_flight']) == (5, 4, 0)
+
+    def test_different_reads_are_not_coalesced(self, client, parse_server):
+        self._concurrently(3, lambda: client.get('Slow', 'abc'))
+        self._concurrently(1, lambda: client.query('Slow', limit=1))
+        self._concurrently(1, lambda: client.query('Slow', limit=2))
+
+        assert len([c for c in parse_server.calls if c[1].startswith('/classes/Slow')]) == 3
+
+    def test_errors_reach_every_waiter(self, client, parse_server):
+        _, errors = self._concurrently(3, lambda: client.query('Broken'))
+
+        assert all(isinstance(e, requests.HTTPError) for e in errors)
+        assert len(parse_server.calls) == 1
+
+    def test_can_be_disabled(self, client, parse_server):
+        client.single_flight = False
+        self._concurrently(3, lambda: client.query('Slow'))
+        assert len(parse_server.calls) == 3
+
+
+class TestRetries:
+    """Tests for retrying transient failures."""
+
+    @pytest.fixture(autouse=True)
+    def fast_backoff(self, client):
+        client.backoff = 0.001
+
+    def test_read_retried_on_503(self, client, parse_server):
+        parse_server.flaky_failures = 2
+        assert client.query('Flaky') == {'results': [], 'objectId': 'abc'}
+        assert len(parse_server.calls) == 3
+        assert client.resilience_stats()['retries'] == 2
+
+    def test_retries_are_bounded(self, client, parse_server):
+        parse_server.flaky_failures = 10
+        with pytest.raises(requests.HTTPError):
+            client.get('Flaky', 'abc')
+        assert len(parse_server.calls) == client.max_retries + 1
+
+    def test_create_not_retried_on_503(self, client, parse_server):
+        parse_server.flaky_failures = 1
+        with pytest.raises(requests.HTTPError):
+            client.create('Flaky', {'name': 'x'})
+        assert len(parse_server.calls) == 1
+
+    def test_create_retried_on_429(self, client, parse_server):
+        parse_server.flaky_failures = 1
+        parse_server.flaky_status = 429
+        assert client.create('Flaky', {'name': 'x'})['objectId'] == 'new1'
+        assert len(parse_server.calls) == 2
+
+    def test_plain_update_retried_but_increment_is_not(self, client, parse_server):
+        parse_server.flaky_failures = 1
+        client.update('Flaky', 'abc', {'name': 'x'})
+        assert len(parse_server.calls) == 2
+
+        parse_server.flaky_failures = 1
+        with pytest.raises(requests.HTTPError):
+            client.update('Flaky', 'abc', {'stock_quantity': {'__op': 'Increment', 'amount': -1}})
+        assert len(parse_server.calls) == 3
+
+    def test_long_retry_after_is_not_waited_for(self, client, parse_server):
+        parse_server.flaky_failures = 1
+        parse_server.flaky_status = 429
+        parse_server.retry_after = '120'
+        with pytest.raises(requests.HTTPError):
+            client.query('Flaky')
+        assert len(parse_server.calls) == 1
+
+    def test_connection_errors_are_retried(self, client, monkeypatch):
+        client.base_url = 'http://127.0.0.1:9/'
+        with pytest.raises(requests.ConnectionError):
+            client.query('Product')
+        assert client.resilience_stats()['retries'] == client.max_retries
+
+
+class TestCircuitBreaker:
+    """Tests for failing fast while Back4App is down."""
+
+    def test_opens_after_consecutive_failures(self, client, parse_server):
+        client.max_retries = 0
+        client.breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        parse_server.flaky_failures = 2
+        for _ in range(2):
+            with pytest.raises(requests.HTTPError):
+                client.query('Flaky')
+
+        with pytest.raises(Back4AppUnavailable) as excinfo:
+            client.query('Flaky')
+        assert len(parse_server.calls) == 2
+        assert 0 < excinfo.value.retry_after <= 60
+        assert client.resilience_stats()['state'] == 'open'
+        assert client.resilience_stats()['rejected'] == 1
+
+    def test_trial_request_closes_breaker(self, client, parse_server):
+        client.max_retries = 0
+        client.breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+        parse_server.flaky_failures = 1
+        with pytest.raises(requests.HTTPError):
+            client.query('Flaky')
+        assert client.breaker.state == 'open'
+
+        time.sleep(0.06)
+        assert client.query('Flaky') == {'results': [], 'objectId': 'abc'}
+        assert client.breaker.state == 'closed'
+
+    def test_failed_trial_reopens_breaker(self, client, parse_server):
+        client.max_retries = 0
+        client.breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+        parse_server.flaky_failures = 2
+        with pytest.raises(requests.HTTPError):
+            client.query('Flaky')
+        time.sleep(0.06)
+        with pytest.raises(requests.HTTPError):
+            client.query('Flaky')
+
+        with pytest.raises(Back4AppUnavailable):
+            client.query('Flaky')
+        assert client.breaker.trips == 2
+
+    def test_retried_call_counts_once(self, client, parse_server):
+        client.max_retries = 2
+        client.backoff = 0
+        client.breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        parse_server.flaky_failures = 3
+        with pytest.raises(requests.HTTPError):
+            client.query('Flaky')
+
+        assert len(parse_server.calls) == 3
+        assert client.resilience_stats()['failures'] == 1
+        assert client.breaker.state == 'closed'
+
+    def test_unexpected_error_in_trial_releases_breaker(self, client, parse_server, monkeypatch):
+        client.max_retries = 0
+        client.breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+        parse_server.flaky_failures = 1
+        with pytest.raises(requests.HTTPError):
+            client.query('Flaky')
+        time.sleep(0.06)
+
+        def broken(*args, **kwargs):
+            raise ValueError('bad request body')
+        with monkeypatch.context() as patch:
+            patch.setattr(client.session, 'request', broken)
+            with pytest.raises(ValueError):
+                client.query('Flaky')
+
+        assert client.query('Flaky') == {'results': [], 'objectId': 'abc'}
+        assert client.breaker.state == 'closed'
+
+    def test_client_errors_do_not_count(self, client, parse_server):
+        client.breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+        assert client.get('Missing', 'abc') is None
+        assert client.breaker.state == 'closed'
@@ -0,0 +1,856 @@
+"""
+Unit tests for the Back4App model layer, run against an in-memory client.
+"""
+
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+import requests
+from flask import Flask
+
+import models_b4a
+from models_b4a import (
+    db, gather, prefetch, CommitError, Count, Day, GuardError, Sum, Category, Product, CartItem, Order, OrderItem,
+    PasswordResetToken, User
+)
+from query_cache import LocalCache
+
+
+class TestBatchedCommit:
+    """Tests for Session.commit() flushing through client.batch()."""
+
+    def test_commit_sends_one_batch(self, fake_client):
+        items = [CartItem(session_id='s1', product_id=f'p{i}', quantity=1) for i in range(3)]
+        for item in items:
+            db.session.add(item)
+        db.session.commit()
+
+        assert [c for c in fake_client.calls if c[0] == 'batch'] == [('batch', 3)]
+        assert all(item.objectId for item in items)
+        assert all(item.createdAt for item in items)
+
+    def test_commit_mixes_creates_and_deletes(self, fake_client):
+        old = CartItem(session_id='s1', product_id='p1', quantity=1)
+        old.save()
+        new = CartItem(session_id='s1', product_id='p2', quantity=2)
+        db.session.add(new)
+        db.session.delete(old)
+        db.session.commit()
+
+        assert old.objectId not in fake_client.store['CartItem']
+        assert new.objectId in fake_client.store['CartItem']
+
+    def test_failed_ops_are_reported_on_objects(self, fake_client):
+        ghost = Product({'objectId': 'gone', 'name': 'Ghost'})
+        ghost.name = 'Renamed ghost'
+        fresh = Product(name='Fresh')
+        db.session.add(ghost)
+        db.session.add(fresh)
+
+        with pytest.raises(CommitError) as excinfo:
+            db.session.commit()
+
+        assert excinfo.value.errors == [(ghost, ghost._error)]
+        assert ghost._error['code'] == 101
+        assert fresh.objectId
+
+    def test_failed_request_keeps_objects_pending(self, fake_client, monkeypatch):
+        item = CartItem(session_id='s1', product_id='p1', quantity=1)
+        db.session.add(item)
+
+        def unavailable(ops):
+            raise requests.ConnectionError('down')
+        with monkeypatch.context() as patch:
+            patch.setattr(fake_client, 'batch', unavailable)
+            with pytest.raises(requests.ConnectionError):
+                db.session.commit()
+        db.session.commit()
+
+        assert item.objectId in fake_client.store['CartItem']
+
+    def test_empty_commit_makes_no_calls(self, fake_client):
+        db.session.commit()
+        assert fake_client.calls == []
+
+
+class TestDirtyTracking:
+    """Tests for partial updates of changed fields."""
+
+    def _saved_product(self, fake_client):
+        product = Product(name='Lamp', description='A long description', price=10, stock_quantity=5)
+        product.save()
+        fake_client.calls.clear()
+        return product
+
+    def test_save_sends_only_changed_fields(self, fake_client, monkeypatch):
+        product = self._saved_product(fake_client)
+        sent = []
+        monkeypatch.setattr(fake_client, 'update', lambda cls, oid, data: sent.append(data) or {})
+
+        product.stock_quantity = 4
+        product.save()
+
+        assert sent == [{'stock_quantity': 4}]
+
+    def test_clean_save_is_skipped(self, fake_client):
+        product = self._saved_product(fake_client)
+        product.save()
+        assert fake_client.calls == []
+
+    def test_loaded_objects_start_clean(self, fake_client):
+        product = self._saved_product(fake_client)
+        loaded = Product.query.get(product.objectId)
+        fake_client.calls.clear()
+        loaded.save()
+        assert fake_client.calls == []
+
+    def test_modified_objects_are_flushed_by_commit(self, fake_client):
+        product = self._saved_product(fake_client)
+        product.status = 'inactive'
+        db.session.commit()
+
+        assert fake_client.calls == [('batch', 1), ('update', 'Product')]
+        assert fake_client.store['Product'][product.objectId]['status'] == 'inactive'
+        assert product._dirty == set()
+
+    def test_direct_save_and_delete_leave_the_session(self, fake_client):
+        saved, deleted = self._saved_product(fake_client), self._saved_product(fake_client)
+        saved.status = 'inactive'
+        deleted.status = 'inactive'
+
+        saved.save()
+        deleted.delete()
+
+        assert db.session._dirty == {}
+        fake_client.calls.clear()
+        db.session.commit()
+        assert fake_client.calls == []
+
+    def test_rollback_discards_tracked_changes(self, fake_client):
+        product = self._saved_product(fake_client)
+        product.status = 'inactive'
+        db.session.rollback()
+        db.session.commit()
+        assert fake_client.calls == []
+
+
+class TestIncrement:
+    """Tests for atomic Increment operations."""
+
+    def _product(self, fake_client, stock):
+        product = Product(name='Lamp', stock_quantity=stock)
+        product.save()
+        fake_client.calls.clear()
+        return product
+
+    def test_increment_is_sent_as_parse_op(self, fake_client, monkeypatch):
+        product = self._product(fake_client, 5)
+        sent = []
+        original = fake_client.update
+        monkeypatch.setattr(fake_client, 'update', lambda cls, oid, data: sent.append(data) or original(cls, oid, data))
+
+        product.stock_quantity = Product.stock_quantity - 2
+        product.save()
+
+        assert sent == [{'stock_quantity': {'__op': 'Increment', 'amount': -2}}]
+        assert product.stock_quantity == 3
+
+    def test_increments_accumulate_and_use_server_value(self, fake_client):
+        product = self._product(fake_client, 5)
+        fake_client.store['Product'][product.objectId]['stock_quantity'] = 10
+
+        product.increment('stock_quantity', 2)
+        product.increment('stock_quantity', 3)
+        assert product.stock_quantity == 10
+        db.session.commit()
+
+        assert product.stock_quantity == 15
+        assert fake_client.store['Product'][product.objectId]['stock_quantity'] == 15
+
+    def test_guard_reverts_all_guarded_increments(self, fake_client):
+        plenty = self._product(fake_client, 5)
+        scarce = self._product(fake_client, 1)
+        # Another buyer took the last unit after we loaded the product
+        fake_client.store['Product'][scarce.objectId]['stock_quantity'] = 0
+
+        plenty.increment('stock_quantity', -2, minimum=0)
+        scarce.increment('stock_quantity', -1, minimum=0)
+        with pytest.raises(GuardError) as excinfo:
+            db.session.commit()
+
+        assert excinfo.value.errors[0][0] is scarce
+        assert fake_client.store['Product'][plenty.objectId]['stock_quantity'] == 5
+        assert fake_client.store['Product'][scarce.objectId]['stock_quantity'] == 0
+
+    def test_plain_assignment_replaces_pending_increment(self, fake_client):
+        product = self._product(fake_client, 5)
+        product.increment('stock_quantity', 2)
+        product.stock_quantity = 1
+        product.save()
+        assert fake_client.store['Product'][product.objectId]['stock_quantity'] == 1
+
+    def test_increment_after_plain_assignment_keeps_assignment(self, fake_client):
+        product = self._product(fake_client, 5)
+        product.stock_quantity = 10
+        product.increment('stock_quantity', 2)
+        assert product.stock_quantity == 12
+        product.save()
+        assert fake_client.store['Product'][product.objectId]['stock_quantity'] == 12
+
+
+class TestTypedFields:
+    """Tests for fields decoded to Decimal, int and datetime."""
+
+    def test_values_are_decoded_from_json(self, fake_client):
+        fake_client.store['OrderItem'] = {'i1': {'objectId': 'i1', 'price': 19.99, 'quantity': 2.0}}
+        fake_client.store['Order'] = {'o1': {'objectId': 'o1', 'createdAt': '2025-01-31T23:59:00.000Z'}}
+
+        item = OrderItem.query.get('i1')
+        order = Order.query.get('o1')
+
+        assert (item.price, item.quantity) == (Decimal('19.99'), 2)
+        assert isinstance(item.quantity, int)
+        assert item.price * item.quantity == Decimal('39.98')
+        assert order.created_at == datetime(2025, 1, 31, 23, 59)
+        assert order.createdAt == '2025-01-31T23:59:00.000Z'
+
+    def test_values_are_encoded_on_save(self, fake_client):
+        order = Order(total_amount=Decimal('43.18'))
+        order.save()
+        token = PasswordResetToken(token='t', expires_at=datetime(2025, 1, 31, 12, 0))
+        token.save()
+
+        assert fake_client.store['Order'][order.id]['total_amount'] == 43.18
+        assert fake_client.store['PasswordResetToken'][token.id]['expires_at'] == {
+            '__type': 'Date', 'iso': '2025-01-31T12:00:00.000Z'
+        }
+        assert token.expires_at == datetime(2025, 1, 31, 12, 0)
+
+    def test_assignment_replaces_decoded_value(self, fake_client):
+        product = Product(price=10)
+        assert product.price == Decimal('10')
+
+        product.price = Decimal('12.50')
+        product.stock_quantity = Product.stock_quantity + 3
+
+        assert (product.price, product.stock_quantity) == (Decimal('12.50'), 3)
+        assert product._data['price'] == 12.5
+
+    def test_criteria_are_encoded(self, fake_client):
+        query = Product.query.filter(Product.price >= Decimal('5'), Product.created_at < datetime(2025, 2, 1))
+
+        assert query.where == {
+            'price': {'$gte': 5.0},
+            'createdAt': {'$lt': {'__type': 'Date', 'iso': '2025-02-01T00:00:00.000Z'}}
+        }
+
+    def test_instances_have_no_dict(self, fake_client):
+        user = User(username='ada')
+
+        assert not hasattr(user, '__dict__')
+        assert user._error is None
+        with pytest.raises(AttributeError):
+            user.nickname = 'ada'
+
+
+class TestIdentityMap:
+    """Tests for the request-scoped identity map."""
+
+    def test_get_is_fetched_once_per_request(self, fake_client, request_context):
+        user = User(username='alice')
+        user.save()
+        fake_client.calls.clear()
+
+        first = User.query.get(user.objectId)
+        second = User.query.get(user.objectId)
+
+        assert first is second
+        assert fake_client.calls == []
+
+    def test_query_results_share_instances_with_get(self, fake_client):
+        product = Product(name='Lamp', status='active')
+        product.save()
+        app = Flask(__name__)
+        with app.test_request_context('/'):
+            listed = Product.query.filter_by(status='active').all()[0]
+            fake_client.calls.clear()
+            assert Product.query.get(product.objectId) is listed
+            assert fake_client.calls == []
+
+    def test_map_is_not_shared_between_requests(self, fake_client):
+        product = Product(name='Lamp')
+        product.save()
+        app = Flask(__name__)
+        with app.test_request_context('/'):
+            first = Product.query.get(product.objectId)
+        with app.test_request_context('/'):
+            second = Product.query.get(product.objectId)
+        assert first is not second
+
+    def test_delete_evicts_from_map(self, fake_client, request_context):
+        product = Product(name='Lamp')
+        product.save()
+        product.delete()
+        assert Product.query.get(product.objectId) is None
+
+    def test_no_caching_outside_app_context(self, fake_client):
+        product = Product(name='Lamp')
+        product.save()
+        assert Product.query.get(product.objectId) is not Product.query.get(product.objectId)
+
+
+class TestPrefetch:
+    """Tests for eager loading of relations."""
+
+    def _catalog(self):
+        seller = User(username='seller')
+        seller.save()
+        categories = [Category(name=f'Cat {i}') for i in range(3)]
+        for category in categories:
+            category.save()
+        products = []
+        for i in range(9):
+            product = Product(name=f'Item {i}', status='active',
+                              category_id=categories[i % 3].objectId, seller_id=seller.objectId)
+            product.save()
+            products.append(product)
+        return seller, categories, products
+
+    def test_prefetch_resolves_relation_in_one_query(self, fake_client, request_context):
+        self._catalog()
+        models_b4a.identity_map().clear()
+        fake_client.calls.clear()
+
+        products = Product.query.filter_by(status='active').prefetch('category', 'seller').all()
+        names = {p.category.name for p in products}
+        sellers = {p.seller.username for p in products}
+
+        assert names == {'Cat 0', 'Cat 1', 'Cat 2'}
+        assert sellers == {'seller'}
+        assert fake_client.calls == [('query', 'Product'), ('query', 'Category'), ('query', 'User')]
+
+    def test_nested_prefetch_on_list(self, fake_client, request_context):
+        _, _, products = self._catalog()
+        items = [CartItem(session_id='s1', product_id=p.objectId, quantity=1) for p in products[:4]]
+        models_b4a.identity_map().clear()
+        fake_client.calls.clear()
+
+        prefetch(items, 'product.category')
+
+        assert [item.product.name for item in items] == [p.name for p in products[:4]]
+        assert all(item.product.category is not None for item in items)
+        assert fake_client.calls == [('query', 'Product'), ('query', 'Category')]
+
+    def test_reverse_relation_prefetch(self, fake_client, request_context):
+        _, _, products = self._catalog()
+        orders = [Order(order_number=f'ORD-{i}') for i in range(2)]
+        for order in orders:
+            order.save()
+        for i, product in enumerate(products[:3]):
+            OrderItem(order_id=orders[i % 2].objectId, product_id=product.objectId, quantity=1).save()
+        fake_client.calls.clear()
+
+        prefetch(orders, 'order_items')
+
+        assert [len(order.order_items) for order in orders] == [2, 1]
+        assert fake_client.calls == [('query', 'OrderItem')]
+
+    def test_reverse_relation_prefetch_is_chunked(self, fake_client, request_context, monkeypatch):
+        monkeypatch.setattr(models_b4a, 'IN_CHUNK_SIZE', 2)
+        orders = [Order(order_number=f'ORD-{i}') for i in range(5)]
+        for order in orders:
+            order.save()
+            for _ in range(3):
+                OrderItem(order_id=order.objectId, quantity=1).save()
+        fake_client.calls.clear()
+
+        prefetch(orders, 'order_items')
+
+        assert [len(order.order_items) for order in orders] == [3] * 5
+        assert fake_client.calls == [('query', 'OrderItem')] * 3
+
+    def test_lazy_access_without_prefetch(self, fake_client, request_context):
+        _, categories, products = self._catalog()
+        assert products[0].category is categories[0]
+        assert Product(name='Loose').category is None
+
+
+class TestProjection:
+    """Tests for Query.only() and partially loaded models."""
+
+    def _product(self, fake_client):
+        category = Category(name='Lighting')
+        category.save()
+        product = Product(name='Lamp', description='Brass desk lamp', price=25, status='active',
+                          category_id=category.objectId, search_terms=['la', 'lam', 'lamp'])
+        product.save()
+        fake_client.calls.clear()
+        return product
+
+    def test_only_requests_listed_system_and_sort_fields(self, fake_client):
+        self._product(fake_client)
+        listed = Product.query.filter_by(status='active').order_by('-price').only('name').all()[0]
+
+        assert fake_client.last_keys == 'createdAt,name,objectId,price,updatedAt'
+        assert 'search_terms' not in listed._data
+        assert listed.name == 'Lamp'
+        assert fake_client.calls == [('query', 'Product')]
+
+    def test_missing_field_is_fetched_once(self, fake_client):
+        self._product(fake_client)
+        listed = Product.query.only('name').all()[0]
+
+        assert listed.description == 'Brass desk lamp'
+        assert listed.price == 25
+        assert fake_client.calls == [('query', 'Product'), ('get', 'Product')]
+
+    def test_assigning_unloaded_field_does_not_fetch(self, fake_client):
+        product = self._product(fake_client)
+        listed = Product.query.only('name').all()[0]
+
+        listed.stock_quantity = 3
+        listed.save()
+
+        assert listed.stock_quantity == 3
+        assert fake_client.store['Product'][product.objectId]['stock_quantity'] == 3
+        assert [c[0] for c in fake_client.calls] == ['query', 'update']
+
+    def test_full_load_completes_partial_instance(self, fake_client, request_context):
+        product = self._product(fake_client)
+        partial = Product.query.only('name').all()[0]
+        full = Product.query.filter_by(status='active').all()[0]
+
+        assert full is partial
+        assert partial._loaded is None
+        assert partial.description == 'Brass desk lamp'
+        assert Product.query.get(product.objectId) is partial
+        assert len(fake_client.calls) == 2
+
+    def test_relations_follow_projected_keys(self, fake_client):
+        self._product(fake_client)
+        products = Product.query.only('category_id').prefetch('category').all()
+
+        assert products[0].category.name == 'Lighting'
+        assert not [c for c in fake_client.calls if c[0] == 'get']
+
+
+class TestIter:
+    """Tests for streaming whole result sets with Query.iter()."""
+
+    def _products(self, fake_client, count, **fields):
+        products = [Product(name=f'Item {i}', **fields) for i in range(count)]
+        for product in products:
+            product.save()
+        fake_client.calls.clear()
+        return products
+
+    def test_walks_every_batch(self, fake_client):
+        self._products(fake_client, 7)
+        names = [p.name for p in Product.query.iter(batch_size=3)]
+
+        assert names == [f'Item {i}' for i in reversed(range(7))]
+        assert fake_client.calls == [('query', 'Product')] * 3
+
+    def test_limit_caps_rows_yielded(self, fake_client):
+        self._products(fake_client, 7)
+        assert len(list(Product.query.limit(4).iter(batch_size=3))) == 4
+        assert fake_client.calls == [('query', 'Product')] * 2
+
+    def test_rows_changed_during_scan_are_not_skipped(self, fake_client):
+        self._products(fake_client, 5, status='draft')
+        for product in Product.query.filter_by(status='draft').order_by('createdAt').iter(batch_size=2):
+            product.status = 'active'
+            product.save()
+
+        assert all(row['status'] == 'active' for row in fake_client.store['Product'].values())
+
+    def test_existing_or_clause_is_kept(self, fake_client):
+        self._products(fake_client, 4)
+        query = Product.query.filter(Product.name.in_(['Item 0', 'Item 3']))
+        query.where['$or'] = [{'name': 'Item 0'}, {'name': 'Item 3'}]
+        assert [p.name for p in query.iter(batch_size=1)] == ['Item 3', 'Item 0']
+
+    def test_objects_stay_out_of_identity_map(self, fake_client, request_context):
+        self._products(fake_client, 2)
+        models_b4a.identity_map().clear()
+        streamed = list(Product.query.iter())
+        assert models_b4a.identity_map() == {}
+        assert Product.query.get(streamed[0].objectId) is not streamed[0]
+
+
+class TestAggregate:
+    """Tests for grouping and summing through /aggregate and its local stand-in."""
+
+    def _items(self, fake_client):
+        for order_id, price, quantity in (('o1', 10.0, 2), ('o1', 2.5, 4), ('o2', 7.0, 1), ('o3', 1.0, 3)):
+            OrderItem(order_id=order_id, product_id='p1', price=price, quantity=quantity).save()
+        OrderItem(order_id='o3', product_id='p2', price=100.0, quantity=1).save()
+        fake_client.calls.clear()
+
+    def test_group_by_sums_on_the_server(self, fake_client):
+        self._items(fake_client)
+        totals = OrderItem.query.filter_by(product_id='p1').group_by(
+            'order_id', revenue=Sum('price', 'quantity'), items=Count()
+        )
+
+        assert totals == {
+            'o1': {'revenue': 30.0, 'items': 2},
+            'o2': {'revenue': 7.0, 'items': 1},
+            'o3': {'revenue': 3.0, 'items': 1},
+        }
+        assert isinstance(totals['o2']['items'], int)
+        assert fake_client.calls == [('aggregate', 'OrderItem')]
+
+    def test_default_accumulator_counts(self, fake_client):
+        self._items(fake_client)
+        assert OrderItem.query.group_by('product_id') == {'p1': {'count': 4}, 'p2': {'count': 1}}
+
+    def test_group_by_day(self, fake_client):
+        self._items(fake_client)
+        assert OrderItem.query.group_by(Day('createdAt'), quantity=Sum('quantity')) == {
+            '2025-01-01': {'quantity': 11.0}
+        }
+
+    def test_local_stand_in_without_master_key(self, fake_client, monkeypatch):
+        self._items(fake_client)
+        monkeypatch.setattr(fake_client, 'can_aggregate', False)
+        totals = OrderItem.query.filter_by(product_id='p1').group_by('order_id', revenue=Sum('price', 'quantity'))
+
+        assert totals == {'o1': {'revenue': 30.0}, 'o2': {'revenue': 7.0}, 'o3': {'revenue': 3.0}}
+        assert fake_client.calls == [('query', 'OrderItem')]
+        assert fake_client.last_keys == 'createdAt,objectId,order_id,price,quantity,updatedAt'
+
+    def test_pipeline_sort_and_limit(self, fake_client):
+        self._items(fake_client)
+        rows = OrderItem.query.aggregate([
+            {'$group': {'_id': '$order_id', 'revenue': Sum('price', 'quantity').to_parse()}},
+            {'$sort': {'revenue': -1}},
+            {'$limit': 2},
+        ])
+        assert [(row['objectId'], row['revenue']) for row in rows] == [('o3', 103.0), ('o1', 30.0)]
+
+    def test_unsupported_stage_is_rejected(self):
+        with pytest.raises(ValueError):
+            models_b4a.run_pipeline([], [{'$lookup': {}}])
+
+
+class TestGetMany:
+    """Tests for bulk loading by id."""
+
+    def _products(self, fake_client, count):
+        products = [Product(name=f'Item {i}', status='active' if i % 2 == 0 else 'draft') for i in range(count)]
+        for product in products:
+            product.save()
+        fake_client.calls.clear()
+        return products
+
+    def test_dedupes_and_skips_missing_ids(self, fake_client):
+        products = self._products(fake_client, 2)
+        ids = [products[0].id, products[1].id, products[0].id, 'missing', None]
+
+        found = Product.query.get_many(ids)
+
+        assert {k: v.name for k, v in found.items()} == {products[0].id: 'Item 0', products[1].id: 'Item 1'}
+        assert fake_client.calls == [('query', 'Product')]
+
+    def test_ids_are_chunked(self, fake_client, monkeypatch):
+        monkeypatch.setattr(models_b4a, 'IN_CHUNK_SIZE', 2)
+        products = self._products(fake_client, 5)
+
+        assert len(Product.query.get_many(p.id for p in products)) == 5
+        assert fake_client.calls == [('query', 'Product')] * 3
+
+    def test_uses_and_fills_identity_map(self, fake_client, request_context):
+        products = self._products(fake_client, 3)
+        models_b4a.identity_map().clear()
+        known = Product.query.get(products[0].id)
+        fake_client.calls.clear()
+
+        found = Product.query.get_many(p.id for p in products)
+
+        assert found[products[0].id] is known
+        assert Product.query.get(products[2].id) is found[products[2].id]
+        assert fake_client.calls == [('query', 'Product')]
+
+    def test_filters_and_projection_apply(self, fake_client):
+        products = self._products(fake_client, 3)
+        found = Product.query.filter_by(status='active').only('name').get_many(p.id for p in products)
+
+        assert sorted(p.name for p in found.values()) == ['Item 0', 'Item 2']
+        assert fake_client.last_keys == 'createdAt,name,objectId,updatedAt'
+
+    def test_empty_ids_cost_nothing(self, fake_client):
+        assert Product.query.get_many([]) == {}
+        assert fake_client.calls == []
+
+
+class TestPagination:
+    """Tests for page-numbered and keyset pagination."""
+
+    def _products(self, prices):
+        products = [Product(name=f'Item {i}', status='active', price=price) for i, price in enumerate(prices)]
+        for product in products:
+            product.save()
+        return products
+
+    def _walk(self, query_factory, per_page, **kwargs):
+        pages = []
+        page = query_factory().keyset_paginate(per_page=per_page, **kwargs)
+        while True:
+            pages.append([p.name for p in page.items])
+            if not page.has_next:
+                return pages, page
+            page = query_factory().keyset_paginate(after=page.next_cursor, per_page=per_page, **kwargs)
+
+    def test_page_mode_counts_lazily(self, fake_client):
+        self._products([1] * 5)
+        fake_client.calls.clear()
+
+        page = Product.query.paginate(page=2, per_page=2)
+
+        assert (len(page.items), page.has_next) == (2, True)
+        assert fake_client.calls == [('query', 'Product')]
+        assert page.pages == 3
+        assert len(fake_client.calls) == 2
+
+    def test_keyset_walks_every_row_once(self, fake_client):
+        self._products(range(7))
+        fake_client.calls.clear()
+
+        pages, last = self._walk(lambda: Product.query.filter_by(status='active'), 3)
+
+        assert pages == [['Item 6', 'Item 5', 'Item 4'], ['Item 3', 'Item 2', 'Item 1'], ['Item 0']]
+        assert fake_client.calls == [('query', 'Product')] * 3
+        assert last.next_cursor is None
+
+    def test_ties_in_sort_key_are_not_skipped(self, fake_client):
+        self._products([5, 5, 5, 1, 5])
+
+        pages, _ = self._walk(lambda: Product.query.order_by(Product.price.asc()), 2)
+
+        names = [name for page in pages for name in page]
+        assert names[0] == 'Item 3'
+        assert sorted(names) == [f'Item {i}' for i in range(5)]
+
+    def test_prev_cursor_returns_previous_page(self, fake_client):
+        self._products(range(5))
+        first = Product.query.keyset_paginate(per_page=2)
+        second = Product.query.keyset_paginate(after=first.next_cursor, per_page=2)
+
+        back = Product.query.keyset_paginate(before=second.prev_cursor, per_page=2)
+
+        assert first.has_prev is False
+        assert [p.name for p in back.items] == [p.name for p in first.items]
+        assert back.has_prev is False and back.has_next is True
+
+    def test_bad_cursor_starts_from_first_page(self, fake_client):
+        self._products(range(3))
+        page = Product.query.keyset_paginate(after='not-a-cursor', per_page=2)
+        assert [p.name for p in page.items] == ['Item 2', 'Item 1']
+
+    def test_approximate_count_is_reused(self, fake_client):
+        self._products(range(3))
+        models_b4a._count_cache.clear()
+
+        assert Product.query.keyset_paginate(approximate_count=True).total == 3
+        Product(name='Late').save()
+        fake_client.calls.clear()
+
+        assert Product.query.keyset_paginate(approximate_count=True).total == 3
+        assert Product.query.keyset_paginate().total == 4
+        assert fake_client.calls == [('query', 'Product'), ('query', 'Product'), ('query', 'Product')]
+
+    def test_only_approximate_counts_are_cached(self, fake_client, monkeypatch):
+        monkeypatch.setattr(models_b4a, '_count_cache', LocalCache(max_entries=2))
+        self._products(range(3))
+
+        for i in range(3):
+            Product.query.filter_by(name=f'Item {i}').count()
+        assert len(models_b4a._count_cache._entries) == 0
+
+        for i in range(3):
+            Product.query.filter_by(name=f'Item {i}').count(approximate=True)
+        assert len(models_b4a._count_cache._entries) == 2
+
+
+class TestReferenceCache:
+    """Tests for the process-local cache of reference classes."""
+
+    def _categories(self, fake_client):
+        for name in ('Books', 'Garden'):
+            Category(name=name).save()
+        fake_client.calls.clear()
+
+    def test_repeat_reads_cost_no_round_trips(self, fake_client, request_context):
+        self._categories(fake_client)
+        misses = Category._cache.stats()['misses']
+
+        first = Category.query.all()
+        second = Category.query.all()
+        by_id = Category.query.get(first[0].objectId)
+
+        assert [c.name for c in second] == ['Books', 'Garden']
+        assert by_id is first[0]
+        assert fake_client.calls == [('query', 'Category')]
+        assert Category._cache.stats()['misses'] == misses + 1
+
+    def test_cached_rows_are_copied_per_request(self, fake_client):
+        self._categories(fake_client)
+        app = Flask(__name__)
+        with app.test_request_context('/'):
+            Category.query.all()[0]._data['name'] = 'Scribbled'
+        with app.test_request_context('/'):
+            assert Category.query.all()[0].name == 'Books'
+
+    def test_writes_invalidate(self, fake_client):
+        self._categories(fake_client)
+        Category.query.all()
+
+        Category(name='Toys').save()
+
+        assert [c.name for c in Category.query.all()] == ['Books', 'Garden', 'Toys']
+
+    def test_stale_copy_served_while_revalidating(self, fake_client, monkeypatch):
+        self._categories(fake_client)
+        Category.query.all()
+        fake_client.store['Category'].clear()
+        monkeypatch.setattr(Category._cache, 'ttl', 0)
+
+        assert len(Category.query.all()) == 2
+
+        deadline = time.monotonic() + 5
+        while Category.query.all() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert Category.query.all() == []
+        assert Category._cache.stats()['refreshes'] >= 1
+
+    def test_load_started_before_a_write_is_not_stored(self, fake_client, monkeypatch):
+        self._categories(fake_client)
+        started, release = threading.Event(), threading.Event()
+        query = fake_client.query
+
+        def slow_query(class_name, **kwargs):
+            result = query(class_name, **kwargs)
+            started.set()
+            release.wait(5)
+            return result
+        monkeypatch.setattr(fake_client, 'query', slow_query)
+        reader = threading.Thread(target=Category._cache.rows)
+        reader.start()
+        started.wait(5)
+
+        Category(name='Toys').save()
+        release.set()
+        reader.join()
+
+        assert [c.name for c in Category.query.all()] == ['Books', 'Garden', 'Toys']
+
+    def test_filtered_queries_bypass_cache(self, fake_client):
+        self._categories(fake_client)
+        Category.query.all()
+        fake_client.calls.clear()
+
+        Category.query.filter_by(name='Books').all()
+
+        assert fake_client.calls == [('query', 'Category')]
+
+    def test_prefetch_uses_cache(self, fake_client, request_context):
+        self._categories(fake_client)
+        category = Category.query.all()[0]
+        products = [Product(name='Atlas', category_id=category.objectId)]
+        fake_client.calls.clear()
+
+        prefetch(products, 'category')
+
+        assert products[0].category is category
+        assert fake_client.calls == []
+
+
+class TestSessionScope:
+    """Tests for the per-context unit of work behind db.session."""
+
+    def test_threads_do_not_flush_each_other(self, fake_client):
+        added = threading.Barrier(2)
+        sessions = {}
+
+        def request(name):
+            db.session.add(CartItem(session_id=name, quantity=1))
+            added.wait()
+            sessions[name] = db.session
+            if name == 'a':
+                db.session.commit()
+        threads = [threading.Thread(target=request, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sessions['a'] is not sessions['b']
+        assert [row['session_id'] for row in fake_client.store['CartItem'].values()] == ['a']
+        assert len(sessions['b']._new) == 1
+
+    def test_request_teardown_discards_uncommitted_work(self, fake_client):
+        app = Flask(__name__)
+        db.init_app(app)
+        product = Product(name='Lamp', stock_quantity=2)
+        product.save()
+        with app.test_request_context('/'):
+            session = db.session
+            db.session.add(CartItem(session_id='s1', quantity=1))
+            product.stock_quantity = 0
+
+        assert db.session is not session
+        db.session.commit()
+        assert 'CartItem' not in fake_client.store
+        assert fake_client.store['Product'][product.objectId]['stock_quantity'] == 2
+
+    def test_gathered_calls_share_the_callers_session(self, fake_client, request_context):
+        first, second = gather(lambda: db.session, lambda: db.session)
+        assert first is second is db.session
+
+
+class TestGather:
+    """Tests for running independent loads concurrently."""
+
+    def test_calls_overlap_and_keep_order(self, fake_client, monkeypatch):
+        original = fake_client.query
+
+        def slow_query(*args, **kwargs):
+            time.sleep(0.1)
+            return original(*args, **kwargs)
+        monkeypatch.setattr(fake_client, 'query', slow_query)
+        Product(name='Lamp', status='active').save()
+
+        start = time.monotonic()
+        active, inactive, count = gather(
+            lambda: Product.query.filter_by(status='active').all(),
+            lambda: Product.query.filter_by(status='inactive').all(),
+            lambda: Product.query.count(),
+        )
+
+        assert time.monotonic() - start < 0.25
+        assert ([p.name for p in active], inactive, count) == (['Lamp'], [], 1)
+
+    def test_calls_share_the_request_identity_map(self, fake_client, request_context):
+        product = Product(name='Lamp')
+        product.save()
+
+        first, second = gather(
+            lambda: Product.query.get(product.objectId),
+            lambda: Product.query.filter_by(name='Lamp').first(),
+        )
+
+        assert first is second is Product.query.get(product.objectId)
+
+    def test_first_exception_is_raised(self, fake_client):
+        def fail():
+            raise LookupError('missing')
+
+        with pytest.raises(LookupError):
+            gather(lambda: 1, fail, lambda: 3)
+
+    def test_nested_gather_runs_inline(self, fake_client):
+        assert gather(lambda: gather(lambda: 1, lambda: 2), lambda: 3) == [[1, 2], 3]
@@ -0,0 +1,154 @@
+"""
+Unit tests for the product search index.
+"""
+
+import threading
+import time
+
+import pytest
+
+import product_search
+from models_b4a import db, Category, Product
+
+
+@pytest.fixture
+def catalog(fake_client, request_context):
+    kitchen = Category(name='Kitchen')
+    kitchen.save()
+    products = [
+        Product(name='Steel Kettle', description='Boils water fast', category_id=kitchen.id, status='active'),
+        Product(name='Tea Cup', description='Pairs with a kettle', category_id=kitchen.id, status='active'),
+        Product(name='Desk Lamp', description='Warm light (LED)', status='active'),
+    ]
+    for product in products:
+        product_search.index_product(product)
+        product.save()
+    return products
+
+
+def _search(text):
+    return Product.query.filter(product_search.search_criterion(text)).all()
+
+
+class TestProductSearch:
+    """Tests for indexing and querying search_terms."""
+
+    def test_tokenize(self):
+        assert product_search.tokenize('LED  Desk-Lamp, led!') == ['led', 'desk', 'lamp']
+
+    def test_terms_include_name_prefixes_and_category(self):
+        terms = product_search.index_terms('Kettle', 'Boils water', 'Kitchen')
+        assert {'ke', 'ket', 'kettle', 'ki', 'kitchen', 'boils', 'water'} <= set(terms)
+        assert 'wa' not in terms
+
+    def test_long_description_keeps_name_terms(self):
+        description = ' '.join(f'word{i:03d}' for i in range(product_search.MAX_TERMS))
+        terms = product_search.index_terms('Zebra Print Rug', description, 'Home')
+        assert len(terms) == product_search.MAX_TERMS
+        assert {'zebra', 'print', 'rug', 'home'} <= set(terms)
+
+    def test_search_is_one_indexed_lookup(self, catalog, fake_client):
+        fake_client.calls.clear()
+
+        results = _search('kettle')
+
+        assert {p.name for p in results} == {'Steel Kettle', 'Tea Cup'}
+        assert fake_client.calls == [('query', 'Product')]
+
+    def test_prefixes_match_names_only(self, catalog):
+        assert [p.name for p in _search('ket')] == ['Steel Kettle']
+
+    def test_all_tokens_must_match(self, catalog):
+        assert [p.name for p in _search('kitchen tea')] == ['Tea Cup']
+        assert _search('kettle lamp') == []
+
+    def test_regex_characters_are_plain_text(self, catalog):
+        assert _search('(.*)') == []
+        assert [p.name for p in _search('(led)')] == ['Desk Lamp']
+
+    def test_text_without_tokens_matches_nothing(self, catalog):
+        assert _search('a') == []
+        assert _search('!') == []
+
+    def test_rank_prefers_name_matches(self, catalog):
+        ranked = product_search.rank(list(reversed(catalog[:2])), 'kettle')
+        assert [p.name for p in ranked] == ['Steel Kettle', 'Tea Cup']
+
+    def test_edit_reindexes(self, catalog, fake_client):
+        lamp = catalog[2]
+        lamp.name = 'Floor Lamp'
+        product_search.index_product(lamp)
+        db.session.commit()
+
+        assert [p.name for p in _search('floor')] == ['Floor Lamp']
+        assert _search('desk') == []
+
+
+class TestSuggestionIndex:
+    """Tests for the in-memory suggestion trie."""
+
+    def test_loads_once_then_answers_from_memory(self, catalog, fake_client):
+        index = product_search.SuggestionIndex()
+        index.ensure_loaded()
+        fake_client.calls.clear()
+
+        assert [s['text'] for s in index.suggest('ke')] == ['Steel Kettle']
+        assert [s['text'] for s in index.suggest('k')] == []
+        assert [(s['type'], s['text']) for s in index.suggest('kit')] == [('category', 'Kitchen')]
+        assert fake_client.calls == []
+
+    def test_every_word_and_multiword_prefix(self, fake_client):
+        index = product_search.SuggestionIndex()
+        index.add(('product', 'p1'), 'Desk Lamp', 'product', 'p1')
+        index.add(('product', 'p2'), 'Desk Organizer', 'product', 'p2')
+
+        assert [s['text'] for s in index.suggest('lam')] == ['Desk Lamp']
+        assert [s['text'] for s in index.suggest('desk or')] == ['Desk Organizer']
+        assert [s['text'] for s in index.suggest('de')] == ['Desk Lamp', 'Desk Organizer']
+
+    def test_incremental_updates_bump_version(self, catalog):
+        index = product_search.SuggestionIndex()
+        lamp = catalog[2]
+        index.update_product(lamp)
+        version = index.version
+
+        lamp.name = 'Floor Lamp'
+        index.update_product(lamp)
+        assert [s['text'] for s in index.suggest('lamp')] == ['Floor Lamp']
+
+        lamp.status = 'inactive'
+        index.update_product(lamp)
+        assert index.suggest('lamp') == []
+        assert index.version == version + 2
+
+    def test_stale_index_reloads_in_background(self, catalog, fake_client):
+        index = product_search.SuggestionIndex(refresh_seconds=0.01)
+        index.ensure_loaded()
+        Product(name='Teapot', status='active').save()
+        time.sleep(0.02)
+
+        index.ensure_loaded()
+        deadline = time.monotonic() + 5
+        while not index.suggest('teapot') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [s['text'] for s in index.suggest('teapot')] == ['Teapot']
+
+    def test_suggest_while_entries_change(self):
+        index = product_search.SuggestionIndex()
+        stop = threading.Event()
+
+        def churn():
+            while not stop.is_set():
+                for i in range(50):
+                    index.add(('product', i), f'Lamp {i}', 'product', str(i))
+                for i in range(50):
+                    index.remove(('product', i))
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        try:
+            for _ in range(2000):
+                index.suggest('lamp')
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,133 @@
+"""
+Unit tests for the query result cache and its backends.
+"""
+
+import time
+
+import pytest
+
+import models_b4a
+from back4app_client import Back4AppUnavailable
+from models_b4a import db, CartItem, Product
+from query_cache import LocalCache, QueryCache, SQLiteCache
+
+
+@pytest.fixture(params=['local', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'local':
+        return LocalCache(max_entries=3)
+    return SQLiteCache(str(tmp_path / 'cache.sqlite3'), max_entries=3)
+
+
+class TestBackends:
+    """Tests shared by every backend."""
+
+    def test_set_get_and_expiry(self, backend):
+        backend.set('a', 'Product', '[1]', ttl=60)
+        backend.set('b', 'Product', '[2]', ttl=-1)
+        assert backend.get('a') == '[1]'
+        assert backend.get('b') is None
+        assert backend.get('b', stale=True) == '[2]'
+
+    def test_size_is_bounded(self, backend):
+        for i in range(5):
+            backend.set(f'k{i}', 'Product', str(i), ttl=60)
+            time.sleep(0.001)
+        assert [backend.get(f'k{i}') for i in range(5)] == [None, None, '2', '3', '4']
+
+    def test_invalidate_by_class(self, backend):
+        backend.set('a', 'Product', '1', ttl=60)
+        backend.set('b', 'Category', '2', ttl=60)
+        backend.invalidate('Product')
+        assert (backend.get('a'), backend.get('b')) == (None, '2')
+
+    def test_local_cache_evicts_least_recently_used(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 'Product', '1', ttl=60)
+        cache.set('b', 'Product', '2', ttl=60)
+        cache.get('a')
+        cache.set('c', 'Product', '3', ttl=60)
+        assert (cache.get('a'), cache.get('b')) == ('1', None)
+
+    def test_sqlite_is_shared_between_workers(self, tmp_path):
+        path = str(tmp_path / 'shared.sqlite3')
+        worker_a, worker_b = SQLiteCache(path), SQLiteCache(path)
+        worker_a.set('a', 'Product', '1', ttl=60)
+        assert worker_b.get('a') == '1'
+        worker_b.invalidate('Product')
+        assert worker_a.get('a') is None
+
+
+class TestCachedQueries:
+    """Tests for Query.cached() through models_b4a.query_cache."""
+
+    def _products(self, fake_client):
+        for i in range(3):
+            Product(name=f'Item {i}', status='active').save()
+        fake_client.calls.clear()
+
+    def _featured(self):
+        return Product.query.filter_by(status='active').order_by('-createdAt').limit(2).cached()
+
+    def test_repeat_query_is_served_from_cache(self, fake_client):
+        self._products(fake_client)
+
+        first = [p.name for p in self._featured().all()]
+        second = [p.name for p in self._featured().all()]
+
+        assert first == second == ['Item 2', 'Item 1']
+        assert fake_client.calls == [('query', 'Product')]
+
+    def test_key_includes_query_shape(self, fake_client):
+        self._products(fake_client)
+        self._featured().all()
+        Product.query.filter_by(status='active').order_by('-createdAt').limit(3).cached().all()
+        self._featured().count()
+        assert fake_client.calls == [('query', 'Product')] * 3
+
+    def test_save_invalidates_class(self, fake_client):
+        self._products(fake_client)
+        self._featured().all()
+
+        Product(name='Item 3', status='active').save()
+
+        assert [p.name for p in self._featured().all()] == ['Item 3', 'Item 2']
+
+    def test_commit_invalidates_only_written_classes(self, fake_client):
+        self._products(fake_client)
+        self._featured().all()
+        db.session.add(CartItem(session_id='s1', quantity=1))
+        db.session.commit()
+        fake_client.calls.clear()
+
+        self._featured().all()
+
+        assert fake_client.calls == []
+
+    def test_uncached_queries_and_classes_go_to_server(self, fake_client):
+        self._products(fake_client)
+        Product.query.filter_by(status='active').all()
+        Product.query.filter_by(status='active').all()
+        CartItem.query.cached().all()
+        CartItem.query.cached().all()
+        assert len(fake_client.calls) == 4
+
+    def test_disabled_backend(self, fake_client, monkeypatch):
+        monkeypatch.setattr(models_b4a, 'query_cache', QueryCache(None))
+        self._products(fake_client)
+        self._featured().all()
+        self._featured().all()
+        assert len(fake_client.calls) == 2
+
+    def test_stale_results_served_while_back4app_is_down(self, fake_client, monkeypatch):
+        self._products(fake_client)
+        self._featured().cached(ttl=-1).all()
+
+        def unavailable(*args, **kwargs):
+            raise Back4AppUnavailable('circuit open')
+        monkeypatch.setattr(fake_client, 'query', unavailable)
+
+        assert [p.name for p in self._featured().cached(ttl=-1).all()] == ['Item 2', 'Item 1']
+        assert models_b4a.query_cache.stats()['stale_hits'] == 1
+        with pytest.raises(Back4AppUnavailable):
+            Product.query.filter_by(status='active').all()
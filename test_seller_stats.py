@@ -0,0 +1,246 @@
+"""
+Unit tests for the pre-aggregated seller statistics.
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import models_b4a
+import seller_stats
+from models_b4a import db, SellerStats, SellerDailySales, Product, Order, OrderItem, Wishlist, ProductView
+
+
+@pytest.fixture
+def shop(fake_client, request_context):
+    products = []
+    for seller_id, price in (('seller-a', 10), ('seller-a', 5), ('seller-b', 20)):
+        product = Product(name=f'{seller_id} item', price=price, seller_id=seller_id, stock_quantity=10)
+        product.save()
+        products.append(product)
+    return products
+
+
+def _place_order(products, user_id='buyer-1', quantity=1):
+    order = Order(order_number='ORD-1', user_id=user_id, status='confirmed', total_amount=0)
+    db.session.add(order)
+    db.session.flush()
+    items = []
+    for product in products:
+        item = OrderItem(order_id=order.id, product_id=product.id, quantity=quantity, price=product.price)
+        db.session.add(item)
+        items.append(item)
+    db.session.commit()
+    return order, items
+
+
+class TestRecordOrder:
+    """Tests for incremental updates at order time."""
+
+    def test_order_updates_each_seller(self, shop, fake_client):
+        order, items = _place_order(shop, quantity=2)
+
+        seller_stats.record_order(order, items)
+
+        a = seller_stats.get_seller_stats('seller-a')
+        b = seller_stats.get_seller_stats('seller-b')
+        day = seller_stats.day_key(order.createdAt)
+        assert (a.total_revenue, a.total_orders, a.total_customers) == (30, 1, 1)
+        assert (b.total_revenue, b.total_orders) == (40, 1)
+        assert a.daily_orders == {day: 1}
+        assert a.daily_revenue == {day: 30}
+
+    def test_repeat_customer_counted_once(self, shop, fake_client):
+        for _ in range(2):
+            order, items = _place_order(shop[:1])
+            seller_stats.record_order(order, items)
+
+        stored = list(fake_client.store['SellerStats'].values())
+        assert len(stored) == 1
+        assert stored[0]['total_orders'] == 2
+        assert stored[0]['total_customers'] == 1
+
+    def test_views_and_wishlists(self, shop, fake_client):
+        fake_client.batch(seller_stats.view_ops({'seller-a': 2}))
+        seller_stats.record_wishlist_change('seller-a', 1)
+
+        stats = seller_stats.get_seller_stats('seller-a')
+        assert (stats.total_views, stats.total_wishlists) == (2, 1)
+
+
+    def test_duplicate_rows_are_summed(self, shop, fake_client):
+        # Two writers that both found no row each created one
+        SellerStats(seller_id='seller-a', total_orders=1, total_views=2, total_customers=1,
+                    daily_orders={'2025-01-01': 1}).save()
+        SellerStats(seller_id='seller-a', total_orders=2, total_views=3, total_customers=1,
+                    daily_orders={'2025-01-01': 1, '2025-01-02': 1}).save()
+
+        stats = seller_stats.get_seller_stats('seller-a')
+
+        assert (stats.total_orders, stats.total_views, stats.total_customers) == (3, 5, 2)
+        assert stats.daily_orders == {'2025-01-01': 2, '2025-01-02': 1}
+
+
+class TestDailySales:
+    """Tests for the per-seller, per-day sales rollup."""
+
+    def test_order_and_cancellation(self, shop, fake_client):
+        order, items = _place_order(shop, quantity=2)
+        seller_stats.record_order(order, items)
+        day = datetime.strptime(seller_stats.day_key(order.createdAt), '%Y-%m-%d').date()
+
+        rows = seller_stats.daily_sales('seller-a', day - timedelta(days=29), day)
+        assert (rows[day.isoformat()].revenue, rows[day.isoformat()].orders) == (30, 1)
+
+        order.status = 'cancelled'
+        db.session.commit()
+        seller_stats.record_order_cancelled(order, items)
+
+        stored = [r for r in fake_client.store['SellerDailySales'].values() if r['seller_id'] == 'seller-a']
+        assert [(r['revenue'], r['orders']) for r in stored] == [(0, 0)]
+
+    def test_range_excludes_older_days(self, shop, fake_client):
+        SellerDailySales(seller_id='seller-a', day='2024-01-01', revenue=5, orders=1).save()
+        SellerDailySales(seller_id='seller-a', day='2024-02-15', revenue=7, orders=1).save()
+
+        rows = seller_stats.daily_sales('seller-a', date(2024, 2, 1), date(2024, 3, 1))
+
+        assert list(rows) == ['2024-02-15']
+
+    def test_duplicate_day_rows_are_summed(self, shop, fake_client):
+        for revenue in (10, 15):
+            SellerDailySales(seller_id='seller-a', day='2025-01-31', revenue=revenue, orders=1).save()
+        SellerDailySales(seller_id='seller-a', day='2025-01-30', revenue=5, orders=1).save()
+
+        rows = seller_stats.daily_sales('seller-a', date(2025, 1, 30), date(2025, 1, 31))
+
+        assert {day: (row.revenue, row.orders) for day, row in rows.items()} == {
+            '2025-01-30': (5, 1), '2025-01-31': (25, 2)
+        }
+        seller_stats.rebuild_daily_sales('seller-a')
+        assert sorted(r['day'] for r in fake_client.store['SellerDailySales'].values()) == ['2025-01-30', '2025-01-31']
+
+    def test_rebuild_skips_cancelled_orders(self, shop, fake_client):
+        kept, _ = _place_order(shop[:1])
+        cancelled, _ = _place_order(shop[:2])
+        cancelled.status = 'cancelled'
+        db.session.commit()
+
+        assert seller_stats.rebuild_daily_sales('seller-a') == 1
+        stored = [r for r in fake_client.store['SellerDailySales'].values() if r['seller_id'] == 'seller-a']
+        assert [(r['revenue'], r['orders']) for r in stored] == [(10, 1)]
+
+
+class TestRebuild:
+    """Tests for rebuilding stats from raw rows."""
+
+    def test_rebuild_matches_incremental_stats(self, shop, fake_client):
+        order, items = _place_order(shop, user_id='buyer-2')
+        seller_stats.record_order(order, items)
+        fake_client.batch(seller_stats.view_ops({'seller-a': 1}))
+        ProductView(product_id=shop[0].id, view_type='full_detail').save()
+        Wishlist(user_id='buyer-2', product_id=shop[1].id).save()
+        seller_stats.record_wishlist_change('seller-a', 1)
+        expected = next(row for row in fake_client.store['SellerStats'].values() if row['seller_id'] == 'seller-a')
+
+        fake_client.store['SellerStats'].clear()
+        rebuilt = seller_stats.rebuild_seller_stats('seller-a')
+
+        for field in ('total_revenue', 'total_orders', 'total_customers', 'total_views',
+                      'total_wishlists', 'daily_orders', 'daily_revenue'):
+            assert getattr(rebuilt, field) == expected[field], field
+
+    def test_rebuild_chunks_id_lists(self, shop, fake_client, monkeypatch):
+        monkeypatch.setattr(seller_stats, 'IN_CHUNK_SIZE', 1)
+        for user_id in ('buyer-1', 'buyer-2'):
+            order, items = _place_order(shop[:2], user_id=user_id)
+            seller_stats.record_order(order, items)
+        for product in shop[:2]:
+            ProductView(product_id=product.id, view_type='full_detail').save()
+
+        rebuilt = seller_stats.rebuild_seller_stats('seller-a')
+
+        assert (rebuilt.total_revenue, rebuilt.total_orders, rebuilt.total_customers) == (30, 2, 2)
+        assert rebuilt.total_views == 2
+        assert seller_stats.rebuild_seller_orders('seller-a') == 2
+
+    def test_rebuild_merges_duplicate_rows(self, shop, fake_client):
+        for views in (1, 2):
+            SellerStats(seller_id='seller-a', total_views=views).save()
+
+        seller_stats.rebuild_seller_stats('seller-a')
+
+        assert len(fake_client.store['SellerStats']) == 1
+
+    def test_rebuild_product_view_counts(self, shop, fake_client):
+        for _ in range(3):
+            ProductView(product_id=shop[0].id, view_type='quick_view').save()
+        shop[1].view_count = 9
+        db.session.commit()
+
+        assert seller_stats.rebuild_product_view_counts('seller-a') == 3
+        assert [fake_client.store['Product'][p.id].get('view_count') for p in shop] == [3, 0, None]
+
+
+class TestSellerOrderFeed:
+    """Tests for the per-seller order index and its cursor pagination."""
+
+    def test_order_is_indexed_per_seller(self, shop, fake_client):
+        order, items = _place_order(shop, quantity=2)
+        seller_stats.record_order(order, items)
+
+        rows, next_cursor = seller_stats.seller_order_feed('seller-a')
+
+        assert next_cursor is None
+        assert [(r.order_id, r.total_amount, len(r.items)) for r in rows] == [(order.id, 30, 2)]
+        assert seller_stats.seller_order_feed('seller-b')[0][0].total_amount == 40
+
+    def test_pages_follow_cursor(self, shop, fake_client):
+        placed = []
+        for _ in range(5):
+            order, items = _place_order(shop[:1])
+            seller_stats.record_order(order, items)
+            placed.append(order.id)
+
+        seen = []
+        cursor = None
+        while True:
+            rows, cursor = seller_stats.seller_order_feed('seller-a', before=cursor, limit=2)
+            seen.append([r.order_id for r in rows])
+            if cursor is None:
+                break
+
+        assert seen == [placed[:2:-1], placed[2:0:-1], placed[:1]]
+
+    def test_orders_sharing_a_timestamp_are_not_skipped(self, shop, fake_client):
+        for _ in range(3):
+            order, items = _place_order(shop[:1])
+            seller_stats.record_order(order, items)
+        for row in fake_client.store['SellerOrder'].values():
+            row['order_created_at'] = '2025-01-31T12:00:00.000Z'
+        models_b4a.identity_map().clear()
+
+        first, cursor = seller_stats.seller_order_feed('seller-a', limit=2)
+        second, cursor = seller_stats.seller_order_feed('seller-a', before=cursor, limit=2)
+
+        assert cursor is None
+        assert len({row.id for row in first + second}) == 3
+
+    def test_status_change_is_copied(self, shop, fake_client):
+        order, items = _place_order(shop)
+        seller_stats.record_order(order, items)
+
+        order.status = 'shipped'
+        db.session.commit()
+        seller_stats.record_order_status(order)
+
+        assert {r['status'] for r in fake_client.store['SellerOrder'].values()} == {'shipped'}
+
+    def test_rebuild_recreates_rows(self, shop, fake_client):
+        order, _ = _place_order(shop)
+
+        assert seller_stats.rebuild_seller_orders('seller-a') == 1
+        assert seller_stats.rebuild_seller_orders('seller-a') == 1
+
+        rows = [r for r in fake_client.store['SellerOrder'].values() if r['seller_id'] == 'seller-a']
+        assert [(r['order_id'], r['total_amount']) for r in rows] == [(order.id, 15)]
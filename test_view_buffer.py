@@ -0,0 +1,108 @@
+"""
+Unit tests for the ProductView write-behind buffer.
+"""
+
+import time
+
+import pytest
+
+from back4app_client import BATCH_LIMIT
+from models_b4a import Product, SellerStats
+from view_buffer import ViewBuffer
+
+
+@pytest.fixture
+def products(fake_client):
+    products = [Product(name=f'Item {i}', seller_id=seller_id) for i, seller_id in enumerate(('seller-a', 'seller-a', 'seller-b'))]
+    for product in products:
+        product.save()
+    SellerStats(seller_id='seller-a', total_views=4).save()
+    fake_client.calls.clear()
+    return products
+
+
+def _stats(fake_client, seller_id):
+    return next(row for row in fake_client.store['SellerStats'].values() if row['seller_id'] == seller_id)
+
+
+class TestViewBuffer:
+    """Tests for queuing views and writing them in bulk."""
+
+    def test_add_does_not_touch_back4app(self, products, fake_client):
+        buffer = ViewBuffer(flush_interval=60)
+        buffer.add(product_id=products[0].id, view_type='full_detail')
+        assert fake_client.calls == []
+        assert buffer.stats()['pending'] == 1
+
+    def test_flush_writes_views_and_counters_in_one_batch(self, products, fake_client):
+        buffer = ViewBuffer(flush_interval=60)
+        for product in products + products[:1]:
+            buffer.add(product_id=product.id, view_type='full_detail')
+
+        assert buffer.flush() == 4
+
+        assert [c for c in fake_client.calls if c[0] == 'batch'] == [('batch', 9)]
+        assert len(fake_client.store['ProductView']) == 4
+        assert [fake_client.store['Product'][p.id].get('view_count') for p in products] == [2, 1, 1]
+        assert _stats(fake_client, 'seller-a')['total_views'] == 7
+        assert _stats(fake_client, 'seller-b')['total_views'] == 1
+        assert buffer.stats()['written'] == 4
+
+    def test_each_batch_request_fits_in_one_call(self, fake_client):
+        products = [Product(name=f'Item {i}', seller_id=f'seller-{i}') for i in range(30)]
+        for product in products:
+            product.save()
+        fake_client.calls.clear()
+        buffer = ViewBuffer(flush_interval=60)
+        for product in products:
+            buffer.add(product_id=product.id, view_type='full_detail')
+
+        assert buffer.flush() == 30
+
+        batches = [n for call, n in fake_client.calls if call == 'batch']
+        assert len(batches) > 1 and max(batches) <= BATCH_LIMIT
+        assert all(fake_client.store['Product'][p.id].get('view_count') == 1 for p in products)
+        assert sum(row['total_views'] for row in fake_client.store['SellerStats'].values()) == 30
+
+    def test_full_buffer_drops_views(self, products, fake_client):
+        buffer = ViewBuffer(max_size=2, flush_interval=60)
+        results = [buffer.add(product_id=products[0].id) for _ in range(3)]
+
+        assert results == [True, True, False]
+        assert (buffer.stats()['queued'], buffer.stats()['dropped']) == (2, 1)
+
+    def test_full_batch_wakes_flusher(self, products, fake_client):
+        buffer = ViewBuffer(batch_size=2, flush_interval=60)
+        buffer.add(product_id=products[0].id)
+        buffer.add(product_id=products[1].id)
+
+        deadline = time.monotonic() + 5
+        while buffer.stats()['written'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert buffer.stats()['written'] == 2
+
+    def test_failed_write_is_counted(self, products, fake_client, monkeypatch):
+        def fail(ops):
+            raise RuntimeError('timeout')
+        monkeypatch.setattr(fake_client, 'batch', fail)
+        buffer = ViewBuffer(flush_interval=60)
+        buffer.add(product_id=products[0].id)
+
+        assert buffer.flush() == 0
+        assert buffer.stats()['failed'] == 1
+
+    def test_failed_counter_update_is_counted(self, products, fake_client, monkeypatch):
+        batch = fake_client.batch
+
+        def fail_stats_updates(ops):
+            results = batch(ops)
+            return [{'error': {'code': 155, 'error': 'Request limit exceeded'}}
+                    if op['method'] == 'PUT' and op['path'].startswith('classes/SellerStats/') else result
+                    for op, result in zip(ops, results)]
+        monkeypatch.setattr(fake_client, 'batch', fail_stats_updates)
+        buffer = ViewBuffer(flush_interval=60)
+        buffer.add(product_id=products[0].id)
+        buffer.add(product_id=products[2].id)
+
+        assert buffer.flush() == 1
+        assert (buffer.stats()['written'], buffer.stats()['failed']) == (1, 1)
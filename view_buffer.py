@@ -0,0 +1,185 @@
+"""
+Write-behind buffer for ProductView tracking.
+
+Product pages used to insert their ProductView row (and bump the seller's
+view count) before responding. Views are now queued in memory and written by
+a background thread in bulk /batch requests, together with the increments of
+Product.view_count and SellerStats.total_views, whenever
+BACK4APP_VIEW_BATCH_SIZE views are waiting or every BACK4APP_VIEW_FLUSH_SECONDS.
+
+The queue is bounded by BACK4APP_VIEW_BUFFER_SIZE; views that arrive while it
+is full are dropped and counted rather than slowing the request down.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+import models_b4a
+import seller_stats
+from back4app_client import BATCH_LIMIT
+from models_b4a import Increment, Product, ProductView
+
+logger = logging.getLogger(__name__)
+
+
+class ViewBuffer:
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None):
+        self.max_size = max_size or int(os.environ.get('BACK4APP_VIEW_BUFFER_SIZE', 10000))
+        self.batch_size = batch_size or int(os.environ.get('BACK4APP_VIEW_BATCH_SIZE', BATCH_LIMIT))
+        self.flush_interval = flush_interval or float(os.environ.get('BACK4APP_VIEW_FLUSH_SECONDS', 5))
+
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def add(self, **fields):
+        """Queues one ProductView; returns False if it was dropped because the buffer is full."""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        self._count(queued=1)
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """Writes every queued view now; returns how many were written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                views = []
+                while len(views) < self.batch_size:
+                    try:
+                        views.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not views:
+                    return written
+                written += self._write(views)
+
+    def stats(self):
+        """Returns the buffer's counters, for monitoring."""
+        return {
+            'pending': self._queue.qsize(),
+            'max_size': self.max_size,
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+        }
+
+    def _count(self, **amounts):
+        with self._counter_lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='view-buffer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"View buffer flush failed: {e}")
+
+    def _write(self, views):
+        """Inserts views and adds them to their products' and sellers' counters.
+
+        Views are written in groups small enough for one /batch request each.
+        Parse runs the operations of a batch independently, so a view counts
+        as failed when its insert, its product's view_count increment or its
+        seller's SellerStats update returns an error.
+        """
+        try:
+            products = Product.query.only('seller_id').get_many(view.get('product_id') for view in views)
+        except Exception as e:
+            logger.warning(f"Failed to write {len(views)} product views: {e}")
+            self._count(failed=len(views))
+            return 0
+        sellers = {product_id: product.seller_id for product_id, product in products.items()}
+        return sum(self._write_group(group, sellers) for group in _groups(views, sellers))
+
+    def _write_group(self, views, sellers):
+        try:
+            views_by_product = {}
+            views_by_seller = {}
+            for view in views:
+                product_id = view.get('product_id')
+                if product_id in sellers:
+                    views_by_product[product_id] = views_by_product.get(product_id, 0) + 1
+                seller_id = sellers.get(product_id)
+                views_by_seller[seller_id] = views_by_seller.get(seller_id, 0) + 1
+
+            ops = [ProductView(**view)._save_op() for view in views]
+            for product_id, count in views_by_product.items():
+                body = {'view_count': Increment(count).to_parse()}
+                ops.append({'method': 'PUT', 'path': f'classes/Product/{product_id}', 'body': body})
+            ops.extend(seller_stats.view_ops(views_by_seller))
+            results = models_b4a.client.batch(ops)
+        except Exception as e:
+            logger.warning(f"Failed to write {len(views)} product views: {e}")
+            self._count(failed=len(views))
+            return 0
+
+        # Results follow the ops: inserts, then view_count increments, then view_ops()'s one op per seller
+        product_results = dict(zip(views_by_product, results[len(views):]))
+        seller_results = dict(zip([s for s in views_by_seller if s], results[len(views) + len(views_by_product):]))
+        failed = 0
+        for view, result in zip(views, results):
+            product_id = view.get('product_id')
+            related = (result, product_results.get(product_id, {}), seller_results.get(sellers.get(product_id), {}))
+            if any('error' in r for r in related):
+                failed += 1
+        self._count(written=len(views) - failed, failed=failed)
+        return len(views) - failed
+
+
+def _groups(views, sellers):
+    """Splits views so each group's operations fit in BATCH_LIMIT.
+
+    A group costs one insert per view, one view_count increment per product
+    and one SellerStats operation per seller.
+    """
+    group, products, seller_ids = [], set(), set()
+    for view in views:
+        product_id = view.get('product_id')
+        seller_id = sellers.get(product_id)
+        new_product = product_id in sellers and product_id not in products
+        new_seller = seller_id is not None and seller_id not in seller_ids
+        if group and len(group) + len(products) + len(seller_ids) + 1 + new_product + new_seller > BATCH_LIMIT:
+            yield group
+            group, products, seller_ids = [], set(), set()
+        group.append(view)
+        if product_id in sellers:
+            products.add(product_id)
+        if seller_id is not None:
+            seller_ids.add(seller_id)
+    if group:
+        yield group
+
+
+view_buffer = ViewBuffer()
+
+# Write whatever is still queued when the worker shuts down
+atexit.register(view_buffer.flush)